@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+    Multi-process acquisition from sensors on several FTDI cables.
+
+    Each FTDI URL is serviced by its own worker process running a blocking
+    pyftdi session. The workers write timestamped samples to shared memory
+    ring buffers (one writer per ring) and the supervisor merges the rings
+    into one time-ordered stream.
+"""
+
+import time
+import multiprocessing
+from multiprocessing import shared_memory
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+from psd import PSDSunSensor, PSD_DEFAULT_URL, open_i2c
+
+
+# Sample record stored in the rings. Time is time.monotonic_ns() at the
+# middle of the transfer, which is comparable between the processes.
+SAMPLE_DTYPE = np.dtype([
+    ("time", "<i8"),
+    ("bus", "u1"),
+    ("addr", "u1"),
+    ("status", "u1"),
+    ("x", "<i2"),
+    ("y", "<i2"),
+    ("intensity", "<u2"),
+])
+
+# Sample status codes
+SAMPLE_OK = 0
+SAMPLE_ERROR = 1
+
+# Ring header: write counter followed by padding to keep the records aligned
+_HEADER_SIZE = 64
+
+
+class SampleRing:
+    """
+    Single writer, single reader ring buffer of samples in shared memory.
+
+    The writer stores the record first and then publishes it by incrementing
+    the write counter, so the reader never sees partially written records.
+    The slot of the next record may be under writing, so a read returns at
+    most capacity - 1 samples. If the reader falls further behind, the
+    oldest samples are lost and counted to `dropped`.
+    """
+
+    def __init__(self, capacity: int, name: Optional[str]=None):
+        """
+        Args:
+            capacity: Number of samples in the ring
+            name: Name of an existing shared memory block to attach to.
+                If not given a new block is created.
+        """
+        self.capacity = capacity
+        size = _HEADER_SIZE + capacity * SAMPLE_DTYPE.itemsize
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self._counter = np.ndarray((1,), dtype="<u8", buffer=self.shm.buf)
+        self._records = np.ndarray((capacity,), dtype=SAMPLE_DTYPE, buffer=self.shm.buf, offset=_HEADER_SIZE)
+        if name is None:
+            self._counter[0] = 0
+        self.read_index = 0
+        self.dropped = 0
+
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+
+    @property
+    def written(self) -> int:
+        return int(self._counter[0])
+
+
+    def write(self, record: tuple) -> None:
+        """
+        Append one record (tuple in SAMPLE_DTYPE field order).
+        """
+        n = int(self._counter[0])
+        self._records[n % self.capacity] = record
+        self._counter[0] = n + 1
+
+
+    def read(self) -> np.ndarray:
+        """
+        Read all the samples written since the previous read.
+        """
+        end = int(self._counter[0])
+        start = self.read_index
+        if end - start > self.capacity:
+            self.dropped += end - start - self.capacity
+            start = end - self.capacity
+        if start == end:
+            return np.empty(0, dtype=SAMPLE_DTYPE)
+
+        i, j = start % self.capacity, end % self.capacity
+        if i < j:
+            out = self._records[i:j].copy()
+        else:
+            out = np.concatenate((self._records[i:], self._records[:j]))
+
+        # The writer may have overwritten the oldest samples during the copy.
+        # The record at the counter is written before the counter is
+        # incremented, so its slot may be torn too.
+        overrun = int(self._counter[0]) + 1 - start - self.capacity
+        if overrun > 0:
+            self.dropped += overrun
+            out = out[overrun:]
+        self.read_index = end
+        return out
+
+
+    def close(self, unlink: bool=False) -> None:
+        del self._counter, self._records
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def _worker(index: int, url: str, addresses: Sequence[int], ring_name: str, capacity: int,
+        stop, frequency: Optional[float], interval: float, bus_factory: Callable) -> None:
+    """
+    Acquisition worker process: poll point measurements from the sensors on
+    one bus round robin and write them to the ring.
+    """
+    ring = SampleRing(capacity, ring_name)
+    try:
+        i2c = bus_factory(url, frequency)
+        sensors = [ PSDSunSensor(addr, i2c) for addr in addresses ]
+        next_round = time.monotonic()
+        while not stop.is_set():
+            for psd in sensors:
+                t0 = time.monotonic_ns()
+                try:
+                    x, y, intensity = psd.get_point()
+                    status = SAMPLE_OK
+                except Exception:
+                    x = y = intensity = 0
+                    status = SAMPLE_ERROR
+                t = (t0 + time.monotonic_ns()) // 2
+                ring.write((t, index, psd.addr, status, x, y, intensity))
+
+            if interval:
+                next_round += interval
+                delay = next_round - time.monotonic()
+                if delay > 0:
+                    stop.wait(delay)
+                else:
+                    next_round = time.monotonic()
+    finally:
+        ring.close()
+
+
+class Acquisition:
+    """
+    Acquisition supervisor running one worker process per FTDI cable.
+
+    Usage:
+        with Acquisition({ "ftdi://ftdi:232h/1": [0x4A, 0x4B], "ftdi://ftdi:232h/2": [0x4A] }) as acq:
+            for samples in acq.stream(duration=10):
+                ...
+    """
+
+    def __init__(self, buses: Dict[str, Sequence[int]], capacity: int=1 << 16, frequency: Optional[float]=None,
+            interval: float=0.0, bus_factory: Callable=open_i2c):
+        """
+        Args:
+            buses: Dictionary from FTDI URL to the sensor addresses on the bus
+            capacity: Ring size in samples per bus
+            frequency: I2C bus frequency (default: tuned frequency of each URL)
+            interval: Minimum interval between polling rounds on each bus (0 = as fast as possible)
+            bus_factory: Function (url, frequency) returning the I2C controller.
+                Must be picklable as it is called in the worker process.
+        """
+        self.urls = list(buses)
+        self.buses = buses
+        self.capacity = capacity
+        self.frequency = frequency
+        self.interval = interval
+        self.bus_factory = bus_factory
+        self.rings: List[SampleRing] = []
+        self.workers = []
+        self._pending = np.empty(0, dtype=SAMPLE_DTYPE)
+        self._latest = None
+        # Spawn fresh interpreters as libusb state does not survive a fork
+        self._ctx = multiprocessing.get_context("spawn")
+        self._stop = self._ctx.Event()
+
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._latest = np.full(len(self.urls), -1, dtype=np.int64)
+        for index, url in enumerate(self.urls):
+            ring = SampleRing(self.capacity)
+            worker = self._ctx.Process(target=_worker, name=f"acquire-{index}", daemon=True,
+                args=(index, url, list(self.buses[url]), ring.name, self.capacity,
+                    self._stop, self.frequency, self.interval, self.bus_factory))
+            worker.start()
+            self.rings.append(ring)
+            self.workers.append(worker)
+
+
+    def stop(self) -> None:
+        self._stop.set()
+        for worker in self.workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+
+
+    def close(self) -> None:
+        self.stop()
+        for ring in self.rings:
+            ring.close(unlink=True)
+        self.rings, self.workers = [], []
+
+
+    def __enter__(self) -> "Acquisition":
+        self.start()
+        return self
+
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+    @property
+    def dropped(self) -> int:
+        return sum(ring.dropped for ring in self.rings)
+
+
+    def read(self, flush: bool=False) -> np.ndarray:
+        """
+        Read new samples from all the rings merged in time order.
+
+        Each ring is ordered in time, so samples are released only up to the
+        oldest latest timestamp over the running workers. Later samples are
+        held until the other workers have caught up.
+
+        Args:
+            flush: Release all the samples regardless of the other workers
+
+        Returns:
+            Structured array of SAMPLE_DTYPE
+        """
+        chunks = [ self._pending ]
+        for i, ring in enumerate(self.rings):
+            samples = ring.read()
+            if len(samples):
+                self._latest[i] = samples["time"][-1]
+                chunks.append(samples)
+
+        merged = np.concatenate(chunks)
+        merged = merged[np.argsort(merged["time"], kind="stable")]
+
+        running = [ i for i, worker in enumerate(self.workers) if worker.is_alive() ]
+        if flush or not running:
+            self._pending = merged[:0]
+            return merged
+
+        watermark = self._latest[running].min()
+        n = np.searchsorted(merged["time"], watermark, side="right")
+        self._pending = merged[n:]
+        return merged[:n]
+
+
+    def stream(self, duration: Optional[float]=None, period: float=0.05) -> Iterator[np.ndarray]:
+        """
+        Iterate merged sample batches.
+
+        Args:
+            duration: Duration in seconds (None = until the workers exit)
+            period: Interval between reads of the rings
+        """
+        end = None if duration is None else time.monotonic() + duration
+        while end is None or time.monotonic() < end:
+            if not any(worker.is_alive() for worker in self.workers):
+                break
+            time.sleep(period)
+            samples = self.read()
+            if len(samples):
+                yield samples
+        self.stop()
+        samples = self.read(flush=True)
+        if len(samples):
+            yield samples
+
+
+if __name__ == "__main__":
+    import sys
+    import csv
+    import argparse
+
+    auto_int = lambda x: int(x, 0)
+    parser = argparse.ArgumentParser(description="Acquire samples from sensors on several FTDI cables")
+    parser.add_argument('--bus', '-b', nargs='+', action='append', metavar=("URL", "ADDR"),
+        help="FTDI URL followed by the sensor addresses (repeat for each cable)")
+    parser.add_argument('--duration', '-t', type=float, default=10.0, help="Acquisition duration in seconds")
+    parser.add_argument('--interval', type=float, default=0.0, help="Polling round interval per bus")
+    parser.add_argument('--frequency', type=float, help="I2C bus frequency (default: tuned frequency)")
+    parser.add_argument('--capacity', type=int, default=1 << 16, help="Ring size in samples per bus")
+    parser.add_argument('--output', '-w', help="Output CSV file (default: stdout)")
+    args = parser.parse_args()
+
+    buses = { bus[0]: [ auto_int(a) for a in bus[1:] ] or [0x4A] for bus in (args.bus or [[PSD_DEFAULT_URL]]) }
+
+    f = open(args.output, "w", newline="") if args.output else sys.stdout
+    writer = csv.writer(f)
+    writer.writerow(["Time", "URL", "Addr", "Status", "Position X", "Position Y", "Intensity"])
+
+    n = 0
+    with Acquisition(buses, args.capacity, args.frequency, args.interval) as acq:
+        t0 = None
+        for samples in acq.stream(args.duration):
+            if t0 is None:
+                t0 = samples["time"][0]
+            for s in samples:
+                writer.writerow([ "%.6f" % ((s["time"] - t0) / 1e9), acq.urls[s["bus"]], "0x%02X" % s["addr"],
+                    s["status"], s["x"], s["y"], s["intensity"] ])
+            n += len(samples)
+        dropped = acq.dropped
+
+    if f is not sys.stdout:
+        f.close()
+    print(f"{n} samples from {len(buses)} buses, {dropped} dropped", file=sys.stderr)
@@ -0,0 +1,153 @@
+"""
+    Adaptive angle grid for the calibration sweep.
+
+    A coarse pass is measured first and fitted. Each interval between the
+    measured angles is then bisected if the calibration residual at either
+    end is large or the position changes steeply over it. The refinement is
+    repeated until no interval qualifies or the minimum step is reached, so
+    the stage moves are spent where the calibration error is.
+
+    Beyond about +-71 degrees the light point leaves the detector and the
+    position saturates to the full scale. The saturated angles have large
+    residuals whatever the calibration, so they are left out of the fit and
+    of the split criteria.
+"""
+
+from typing import List, Optional
+
+import numpy as np
+
+from plot import axis_data, fit_axis
+
+
+# Full scale of the firmware position and the fraction of it treated as saturated
+POSITION_FULL_SCALE = 2048
+SATURATION = 0.97
+
+
+def saturated(position) -> np.ndarray:
+    """
+    Mask of the positions clipped to the full scale of the detector.
+    """
+    return np.abs(position) >= SATURATION * POSITION_FULL_SCALE
+
+
+def angle_residuals(rows, params, axis: str="x") -> tuple:
+    """
+    Per-angle calibration residuals of the swept axis.
+
+    Args:
+        rows: List of (angle, x, y, intensity) tuples
+        params: [offset, height] of the swept axis
+        axis: Swept axis, "x" or "y"
+
+    Returns:
+        Tuple of (stage angles, RMS angle error in degrees, mean position, mean intensity)
+        arrays, one element per distinct stage angle.
+    """
+    stage = np.array(rows, dtype=float)[:, 0]
+    angle, position, intensity = axis_data(rows, axis)
+    offset, height = params
+    err = angle - np.degrees(np.arctan((position + offset) / height))
+
+    angles, index, counts = np.unique(stage, return_inverse=True, return_counts=True)
+    mean = lambda v: np.bincount(index, weights=v) / counts
+    return angles, np.sqrt(mean(err**2)), mean(position), mean(intensity)
+
+
+def spacing_weights(angle) -> np.ndarray:
+    """
+    Per-sample weights proportional to the square root of the angular
+    spacing around each angle, so that the densely refined regions do not
+    dominate the weighted fit.
+    """
+    angles, index = np.unique(angle, return_inverse=True)
+    if len(angles) < 2:
+        return np.ones(len(angle))
+    edges = np.concatenate(([angles[0]], (angles[:-1] + angles[1:]) / 2, [angles[-1]]))
+    spacing = np.diff(edges)
+    return np.sqrt(spacing / np.mean(spacing))[index]
+
+
+def refine(angles, residuals, position, intensity, min_step: float=1.0, residual_threshold: Optional[float]=None,
+        gradient_threshold: Optional[float]=None, min_intensity: float=50) -> np.ndarray:
+    """
+    Select new angles by bisecting the intervals that need more samples.
+
+    Args:
+        angles: Measured angles in ascending order
+        residuals: RMS angle error at each angle in degrees
+        position: Mean position of the swept axis at each angle
+        intensity: Mean intensity at each angle
+        min_step: Intervals shorter than 2 * min_step are not split
+        residual_threshold: Split if the residual at either end exceeds this (degrees).
+            Default is twice the median residual.
+        gradient_threshold: Split if the position changes faster than this (counts/degree).
+            Default is 1.5 times the median gradient.
+        min_intensity: Intervals without light at either end are not split
+
+    Intervals with a saturated position at either end are not split and
+    don't count in the default thresholds.
+
+    Returns:
+        New angles to be measured
+    """
+    width = np.diff(angles)
+    gradient = np.abs(np.diff(position)) / width
+    residual = np.maximum(residuals[:-1], residuals[1:])
+    lit = np.maximum(intensity[:-1], intensity[1:]) >= min_intensity
+    valid = lit & ~(saturated(position[:-1]) | saturated(position[1:]))
+    if not np.any(valid):
+        return np.array([])
+    if residual_threshold is None:
+        residual_threshold = 2 * np.median(residuals[~saturated(position)])
+    if gradient_threshold is None:
+        gradient_threshold = 1.5 * np.median(gradient[valid])
+
+    split = valid & (width >= 2 * min_step) & ((residual > residual_threshold) | (gradient > gradient_threshold))
+    mid = (angles[:-1] + angles[1:])[split] / 2
+    # Keep the new angles on the min_step grid
+    return np.unique(np.round(mid / min_step) * min_step)
+
+
+def adaptive_sweep(psd, thor, degree: float=80, coarse_step: float=10, min_step: float=1,
+        csvwriter=None, samples: int=10, dwell: float=0.1, max_passes: int=5, axis: str="x",
+        verbose: bool=True, **thresholds) -> List[tuple]:
+    """
+    Run a coarse sweep and refine it where the calibration residuals are large.
+
+    Args:
+        degree: Sweep range in degrees
+        coarse_step: Angle step of the first pass
+        min_step: Smallest angle step of the refined grid
+        max_passes: Maximum number of refinement passes
+        axis: Axis rotated by the sweep, "x" or "y". Only its residuals drive the refinement.
+        thresholds: Keyword arguments for refine()
+
+    Returns:
+        List of (angle, x, y, intensity) tuples
+    """
+    from meas import step_sweep
+
+    new = np.arange(-degree, degree + coarse_step / 2, coarse_step)
+    rows = []
+    for n in range(max_passes + 1):
+        rows += step_sweep(psd, thor, new, csvwriter, samples, dwell, verbose=False)
+        angle, position, intensity = axis_data(rows, axis)
+        unsaturated = ~saturated(position)
+        res = fit_axis(angle[unsaturated], position[unsaturated],
+            (intensity * spacing_weights(angle))[unsaturated])
+        measured, residuals, mp, mi = angle_residuals(rows, res.x, axis)
+        if verbose:
+            print(f"Pass {n}: {len(measured)} angles, offset_{axis} {res.x[0]:.2f}, "
+                f"height {res.x[1]:.2f}, max residual {np.max(residuals[~saturated(mp)]):.3f} deg")
+
+        new = refine(measured, residuals, mp, mi, min_step, **thresholds)
+        new = np.setdiff1d(new, measured)
+        if len(new) == 0:
+            break
+        if n % 2:
+            new = new[::-1] # Alternate direction to shorten the moves
+
+    rows.sort()
+    return rows
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+    Hardware-free benchmarks for the host acquisition and calibration tools.
+
+    The sensors and the rotator are replaced with the simulated endpoints from
+    sim.py so the benchmarks measure the host side software only. Results are
+    appended to a JSON history file and can be compared against a baseline.
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import platform
+import datetime
+import tempfile
+import subprocess
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+import fwmodel
+from sim import SimulatedI2cController, SimulatedRotator, SimulatedSensor
+from psd import PSDSunSensor, Calibration
+from thor import ThorRotator
+
+
+BENCHMARKS = {}
+
+
+def benchmark(name: str, unit: str, better: str="higher"):
+    """
+    Register a benchmark function.
+
+    Args:
+        name: Benchmark name
+        unit: Unit of the result
+        better: "higher" or "lower" depending which direction is an improvement
+    """
+    def decorator(func: Callable[[dict], Dict[str, float]]):
+        BENCHMARKS[name] = (func, unit, better)
+        return func
+    return decorator
+
+
+def timed(func: Callable, repeat: int=3) -> float:
+    """
+    Best wall time of `repeat` calls in seconds.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def make_sensor(config: dict, addr: int=0x4A, i2c: Optional[SimulatedI2cController]=None) -> PSDSunSensor:
+    """
+    Create a PSDSunSensor connected to a simulated sensor.
+    """
+    if i2c is None:
+        i2c = SimulatedI2cController()
+    i2c.sensors[addr] = SimulatedSensor(sun=lambda: (10.0, -5.0), seed=addr)
+    psd = PSDSunSensor(addr, i2c)
+    if not config["real_delays"]:
+        psd.conversion_delay = {}
+    return psd
+
+
+@benchmark("getter_rate", "samples/s")
+def bench_getters(config):
+    psd = make_sensor(config)
+    n = config["samples"]
+    results = {}
+    for getter in ("get_raw", "get_point", "get_vector", "get_angles", "get_all", "get_temperature", "get_calibration"):
+        func = getattr(psd, getter)
+        results[getter] = n / timed(lambda: [ func() for _ in range(n) ])
+    return results
+
+
+@benchmark("multi_sensor_rate", "samples/s")
+def bench_multi_sensor(config):
+    i2c = SimulatedI2cController()
+    sensors = [ make_sensor(config, addr, i2c) for addr in range(0x4A, 0x4A + config["sensors"]) ]
+    n = config["samples"] // len(sensors)
+    elapsed = timed(lambda: [ psd.get_point() for _ in range(n) for psd in sensors ])
+    return { f"{len(sensors)}_sensors": n * len(sensors) / elapsed }
+
+
+@benchmark("sweep_time", "s", better="lower")
+def bench_sweep(config):
+    import meas
+
+    rotator = SimulatedRotator(velocity=config["velocity"], acceleration=10 * config["velocity"])
+    thor = ThorRotator(_serial=rotator)
+    i2c = SimulatedI2cController()
+    psd = make_sensor(config, i2c=i2c)
+    i2c.sensors[0x4A].sun = lambda: (rotator.angle, 0.0)
+
+    degree = config["degree"]
+    angles = np.arange(-degree, degree + 1, 1)
+    thor.move_absolute(1, angles[0] * thor.EncCnt)
+    elapsed = timed(lambda: meas.step_sweep(psd, thor, angles, samples=10, dwell=0, verbose=False), repeat=1)
+    return { f"step_{2 * degree + 1}_angles": elapsed }
+
+
+@benchmark("adaptive_angles", "angles", better="lower")
+def bench_adaptive(config):
+    """
+    Stage angles measured by the full step sweep, the adaptive sweep and the
+    uniform sweep with as many angles as the adaptive one, of the same sensor.
+    """
+    return { name: len(np.unique([ row[0] for row in rows ])) for name, rows in run_adaptive(config).items() }
+
+
+@benchmark("adaptive_error", "deg", better="lower")
+def bench_adaptive_error(config):
+    """
+    Largest calibrated angle error of the full, adaptive and uniform sweep fits
+    within +-70 degrees, against the simulated sensor geometry. All are fitted
+    like adaptive_sweep: saturated positions left out, spacing weights applied.
+    """
+    from plot import axis_data, fit_axis
+    from adaptive import saturated, spacing_weights
+
+    height, offset = 698.0, 30.0
+    points = height * np.tan(np.radians(np.linspace(-70, 70, 141))) + offset
+    truth = np.degrees(np.arctan((points - offset) / height))
+    results = {}
+    for name, rows in run_adaptive(config).items():
+        angles, positions, intensity = axis_data(rows, "x")
+        unsaturated = ~saturated(positions)
+        fit_offset, fit_height = fit_axis(angles[unsaturated], positions[unsaturated],
+            (intensity * spacing_weights(angles))[unsaturated]).x
+        results[name] = float(np.max(np.abs(np.degrees(np.arctan((points + fit_offset) / fit_height)) - truth)))
+    return results
+
+
+def run_adaptive(config) -> dict:
+    """
+    Run the full step sweep, the adaptive sweep and a uniform step sweep with
+    the same number of angles as the adaptive one, of an X axis with the
+    sensor offset 30 and height 698.
+
+    Returns:
+        Dictionary from the sweep name to its rows
+    """
+    import meas
+    import adaptive
+
+    rotator = SimulatedRotator(velocity=config["velocity"], acceleration=10 * config["velocity"])
+    thor = ThorRotator(_serial=rotator)
+    i2c = SimulatedI2cController()
+    psd = make_sensor(config, i2c=i2c)
+    i2c.sensors[0x4A] = SimulatedSensor(sun=lambda: (rotator.angle, 0.0), height=698, offset=(30, 0), seed=1)
+
+    degree = config["degree"]
+    sweeps = {
+        "full": meas.step_sweep(psd, thor, np.arange(-degree, degree + 1, 1), samples=10, dwell=0, verbose=False),
+        "adaptive": adaptive.adaptive_sweep(psd, thor, degree, samples=10, dwell=0, verbose=False),
+    }
+    count = len(np.unique([ row[0] for row in sweeps["adaptive"] ]))
+    uniform = np.unique(np.round(np.linspace(-degree, degree, count)))
+    sweeps["uniform"] = meas.step_sweep(psd, thor, uniform, samples=10, dwell=0, verbose=False)
+    return sweeps
+
+
+def write_capture(fname: str, rows: int) -> None:
+    """
+    Write a synthetic capture in the meas.py CSV format.
+    """
+    angles = np.repeat(np.arange(-80, 81), -(-rows // 161))[:rows]
+    x = np.round(670 * np.tan(np.radians(angles))).astype(int)
+    with open(fname, "w", newline="") as f:
+        writer = csv.writer(f)
+        meas_header = [["Calibaration:"], ["Offset X", "Offset Y", "Height", "Samples", "Temp Offset"],
+            list(Calibration(0, 0, 670, 1, 662)), ['Angle', 'Position X', 'Position Y', 'Intensity']]
+        writer.writerows(meas_header)
+        writer.writerows(zip(angles, x, -x, np.full(rows, 700)))
+
+
+@benchmark("load_rate", "rows/s")
+def bench_load(config):
+    from plot import read_sunsensor_csv
+
+    rows = config["rows"]
+    with tempfile.TemporaryDirectory() as tmp:
+        fname = os.path.join(tmp, "capture.csv")
+        write_capture(fname, rows)
+        data = read_sunsensor_csv(fname)
+
+        npz = os.path.join(tmp, "capture.npz")
+        np.savez(npz, angles=data[0], pointsx=data[1], pointsy=data[2], intensity=data[3])
+
+        def load_npz():
+            with np.load(npz) as f:
+                [ f[k] for k in f.files ]
+
+        return {
+            "csv": rows / timed(lambda: read_sunsensor_csv(fname)),
+            "npz": rows / timed(load_npz),
+        }
+
+
+@benchmark("fit_time", "s", better="lower")
+def bench_fit(config):
+    from plot import fit_calib
+
+    rng = np.random.default_rng(0)
+    results = {}
+    for n in config["fit_sizes"]:
+        angles = np.repeat(np.arange(-80, 81), -(-n // 161))[:n].astype(float)
+        points = 670 * np.tan(np.radians(angles)) + rng.normal(0, 5, n)
+        intensity = 1000 * np.cos(np.radians(angles))
+        results[f"{n}_samples"] = timed(lambda: fit_calib(angles, angles, points, points, intensity, intensity), repeat=1)
+    return results
+
+
+@benchmark("lut_time", "s", better="lower")
+def bench_lut(config):
+    positions = np.arange(-2048, 2049, dtype=np.int16)
+    return {
+        "generate": timed(lambda: fwmodel.make_lut(256, 256)),
+        "lookup_all": timed(lambda: fwmodel.atan(positions)),
+    }
+
+
+def run(config: dict, selected=None) -> dict:
+    """
+    Run the benchmarks.
+
+    Returns:
+        Dictionary of results indexed by "benchmark.case".
+    """
+    results = {}
+    for name, (func, unit, better) in BENCHMARKS.items():
+        if selected and name not in selected:
+            continue
+        print(f"Running {name}...", file=sys.stderr)
+        for case, value in func(config).items():
+            results[f"{name}.{case}"] = { "value": value, "unit": unit, "better": better }
+    return results
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+            text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_run(fname: str) -> dict:
+    """
+    Load the latest run from a history or baseline file.
+    """
+    with open(fname) as f:
+        data = json.load(f)
+    return data[-1] if isinstance(data, list) else data
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """
+    Compare results against a baseline run.
+
+    Returns:
+        List of (name, baseline value, current value, relative change) tuples
+        for the results that got worse more than the threshold.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline["results"]:
+            continue
+        old, new = baseline["results"][name]["value"], result["value"]
+        change = (new - old) / old if old else 0.0
+        worse = -change if result["better"] == "higher" else change
+        if worse > threshold:
+            regressions.append((name, old, new, change))
+    return regressions
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="PSD host software benchmarks")
+    parser.add_argument('benchmarks', nargs='*', help=f"Benchmarks to run ({', '.join(BENCHMARKS)})")
+    parser.add_argument('--history', default="bench_history.json", help="JSON history file")
+    parser.add_argument('--baseline', help="Compare against a baseline or history file")
+    parser.add_argument('--save_baseline', help="Save this run as a baseline file")
+    parser.add_argument('--threshold', type=float, default=0.2, help="Relative change flagged as a regression")
+    parser.add_argument('--real_delays', action='store_true', help="Keep the sensor conversion delays")
+    parser.add_argument('--samples', type=int, default=2000, help="Samples per getter")
+    parser.add_argument('--sensors', type=int, default=6, help="Number of sensors on the bus")
+    parser.add_argument('--degree', type=int, default=80, help="Sweep range in degrees")
+    parser.add_argument('--velocity', type=float, default=200, help="Simulated stage velocity (deg/s)")
+    parser.add_argument('--rows', type=int, default=100000, help="Rows in the load benchmark file")
+    parser.add_argument('--fit_sizes', type=int, nargs='+', default=[161, 1610, 16100], help="Fit dataset sizes")
+    args = parser.parse_args()
+
+    config = vars(args)
+    results = run(config, args.benchmarks)
+
+    for name, result in results.items():
+        print(f"{name:<40} {result['value']:>14.4f} {result['unit']}")
+
+    entry = {
+        "time": datetime.datetime.now().isoformat(),
+        "commit": git_commit(),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "config": { k: config[k] for k in ("real_delays", "samples", "sensors", "degree", "velocity", "rows", "fit_sizes") },
+        "results": results,
+    }
+
+    history = []
+    if os.path.exists(args.history):
+        with open(args.history) as f:
+            history = json.load(f)
+    history.append(entry)
+    with open(args.history, "w") as f:
+        json.dump(history, f, indent=1)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(entry, f, indent=1)
+
+    if args.baseline:
+        regressions = compare(results, load_run(args.baseline), args.threshold)
+        for name, old, new, change in regressions:
+            print(f"REGRESSION {name}: {old:.4f} -> {new:.4f} ({100 * change:+.1f} %)")
+        if regressions:
+            sys.exit(1)
+        print("No regressions")
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+    Bootstrap confidence intervals and leave-one-angle-out cross-validation
+    for the calibration fit.
+
+    Each axis is only swept by its own capture, so the statistics are
+    calculated from an X_calib and Y_calib capture pair like plot.py does.
+    The two captures may have different angles and are resampled separately.
+    The measurements at one stage angle are correlated (same stage position,
+    same light spot), so by default whole angles are resampled with
+    replacement. The refits are split to chunks and run in a process pool,
+    warm started from the point estimate.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from plot import fit_calib, read_capture_pair
+
+
+PARAMETERS = ("offset_x", "offset_y", "height")
+
+
+class BootstrapResult(NamedTuple):
+    estimate: np.ndarray # Point estimate [offset_x, offset_y, height]
+    samples: np.ndarray # Bootstrap estimates (N, 3)
+    low: np.ndarray # Lower confidence limits
+    high: np.ndarray # Upper confidence limits
+    angle_error: float # Confidence bound of the angle error over the measured positions (deg)
+
+
+def _refit_chunk(data, indices, x0) -> np.ndarray:
+    """
+    Refit the calibration for each pair of X and Y index sets.
+    """
+    x_angles, y_angles, x, y, x_intensity, y_intensity = data
+    out = np.empty((len(indices), 3))
+    for i, (xi, yi) in enumerate(indices):
+        out[i] = fit_calib(x_angles[xi], y_angles[yi], x[xi], y[yi], x_intensity[xi], y_intensity[yi], x0=x0).x
+    return out
+
+
+def _run(data, index_sets, x0, workers: Optional[int]) -> np.ndarray:
+    """
+    Run the refits in a process pool.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(index_sets) < 2:
+        return _refit_chunk(data, index_sets, x0)
+    chunks = [ index_sets[i::workers] for i in range(workers) if index_sets[i::workers] ]
+    with ProcessPoolExecutor(max_workers=len(chunks)) as pool:
+        results = list(pool.map(_refit_chunk, [data] * len(chunks), chunks, [x0] * len(chunks)))
+    # Restore the original order
+    out = np.empty((len(index_sets), 3))
+    for i, result in enumerate(results):
+        out[i::len(chunks)] = result
+    return out
+
+
+def calibrated_angles(params, points) -> np.ndarray:
+    """
+    Calibrated angles for the points with one or more parameter sets.
+
+    Args:
+        params: [offset_x, offset_y, height] or array of them (N, 3)
+        points: Positions
+
+    Returns:
+        Array (N, 2, len(points)) of x and y angles in degrees
+    """
+    params = np.atleast_2d(params)
+    points = np.asarray(points, dtype=float)
+    offsets = params[:, :2, None]
+    height = params[:, 2, None, None]
+    return np.degrees(np.arctan((points[None, None, :] + offsets) / height))
+
+
+def _resample(angles, rng, by_angle: bool) -> np.ndarray:
+    """
+    Indices of one bootstrap resample of an axis.
+    """
+    if by_angle:
+        groups = [ np.flatnonzero(angles == a) for a in np.unique(angles) ]
+        return np.concatenate([ groups[g] for g in rng.integers(0, len(groups), len(groups)) ])
+    return rng.integers(0, len(angles), len(angles))
+
+
+def bootstrap(x_angles, y_angles, x, y, x_intensity, y_intensity, resamples: int=500, confidence: float=95,
+        by_angle: bool=True, seed: Optional[int]=None, workers: Optional[int]=None) -> BootstrapResult:
+    """
+    Bootstrap the calibration fit.
+
+    Args:
+        x_angles, y_angles, x, y, x_intensity, y_intensity: Capture pair as returned by read_capture_pair
+        resamples: Number of bootstrap refits
+        confidence: Confidence level in percent
+        by_angle: Resample whole angles instead of single samples
+        seed: Random seed
+        workers: Number of worker processes (default: CPU count)
+
+    Returns:
+        BootstrapResult
+    """
+    data = tuple(np.asarray(a, dtype=float) for a in (x_angles, y_angles, x, y, x_intensity, y_intensity))
+    estimate = fit_calib(*data).x
+
+    rng = np.random.default_rng(seed)
+    index_sets = [ (_resample(data[0], rng, by_angle), _resample(data[1], rng, by_angle))
+        for _ in range(resamples) ]
+
+    samples = _run(data, index_sets, tuple(estimate), workers)
+
+    alpha = (100 - confidence) / 2
+    low, high = np.percentile(samples, [alpha, 100 - alpha], axis=0)
+
+    # Angle error of the bootstrap calibrations against the point estimate
+    # over the positions measured on each axis
+    err = []
+    for axis, p in enumerate(data[2:4]):
+        points = np.linspace(p.min(), p.max(), 101)
+        err.append((calibrated_angles(samples, points) - calibrated_angles(estimate, points))[:, axis])
+    angle_error = float(np.percentile(np.max(np.abs(np.concatenate(err, axis=1)), axis=1), confidence))
+
+    return BootstrapResult(estimate, samples, low, high, angle_error)
+
+
+def leave_one_angle_out(x_angles, y_angles, x, y, x_intensity, y_intensity, workers: Optional[int]=None):
+    """
+    Leave-one-angle-out cross-validation of a capture pair. An angle is held
+    out of both captures, whichever of them measured it.
+
+    Returns:
+        Tuple of (angles, RMS prediction error at each held out angle in degrees)
+    """
+    data = tuple(np.asarray(a, dtype=float) for a in (x_angles, y_angles, x, y, x_intensity, y_intensity))
+    estimate = fit_calib(*data).x
+    unique = np.union1d(data[0], data[1])
+    index_sets = [ (np.flatnonzero(data[0] != a), np.flatnonzero(data[1] != a)) for a in unique ]
+    params = _run(data, index_sets, tuple(estimate), workers)
+
+    errors = np.empty(len(unique))
+    for i, a in enumerate(unique):
+        x_held, y_held = data[0] == a, data[1] == a
+        predicted = calibrated_angles(params[i], np.concatenate((data[2][x_held], data[3][y_held])))
+        n = np.count_nonzero(x_held)
+        err = np.concatenate((predicted[0, 0, :n], predicted[0, 1, n:])) - a
+        errors[i] = np.sqrt(np.mean(err**2))
+    return unique, errors
+
+
+if __name__ == "__main__":
+    import time
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Calibration fit uncertainty")
+    parser.add_argument('files', nargs='+', help="X_calib capture files, one per sensor. The Y_calib captures are found by name.")
+    parser.add_argument('--resamples', '-n', type=int, default=500, help="Number of bootstrap refits")
+    parser.add_argument('--confidence', type=float, default=95, help="Confidence level (%%)")
+    parser.add_argument('--samples', action='store_true', help="Resample single samples instead of whole angles")
+    parser.add_argument('--loao', action='store_true', help="Run leave-one-angle-out cross-validation")
+    parser.add_argument('--workers', '-j', type=int, help="Number of worker processes")
+    parser.add_argument('--seed', type=int, help="Random seed")
+    args = parser.parse_args()
+
+    for fname in args.files:
+        data = read_capture_pair(fname)
+        start = time.perf_counter()
+        result = bootstrap(*data, resamples=args.resamples, confidence=args.confidence,
+            by_angle=not args.samples, seed=args.seed, workers=args.workers)
+
+        print(f"{fname}: {len(data[0]) + len(data[1])} samples, {args.resamples} resamples in {time.perf_counter() - start:.1f} s")
+        for name, value, low, high, std in zip(PARAMETERS, result.estimate, result.low, result.high, result.samples.std(axis=0)):
+            print(f"  {name:<9} {value:9.3f}  {args.confidence:g}% CI [{low:9.3f}, {high:9.3f}]  std {std:.3f}")
+        print(f"  angle error bound ({args.confidence:g}%): {result.angle_error:.4f} deg")
+
+        if args.loao:
+            angles, errors = leave_one_angle_out(*data, workers=args.workers)
+            worst = np.argmax(errors)
+            print(f"  leave-one-angle-out RMS error {np.sqrt(np.mean(errors**2)):.4f} deg, "
+                f"worst {errors[worst]:.4f} deg at {angles[worst]:g} deg")
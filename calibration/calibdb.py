@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""
+    SQLite store of the sensor calibrations.
+
+    Every sensor is identified by its serial (e.g. the number written on the
+    board) and has its current I2C address. Each stored calibration keeps the
+    Calibration tuple, the fit statistics, the capture file it was fitted
+    from and a timestamp, so the history of every sensor can be looked up
+    and the latest values can be pushed back to the sensors.
+"""
+
+import csv
+import json
+import sqlite3
+import datetime
+from typing import List, NamedTuple, Optional, Union
+
+from psd import Calibration, PSDSunSensor, PSD_DEFAULT_URL
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sensors (
+    id INTEGER PRIMARY KEY,
+    serial TEXT NOT NULL UNIQUE,
+    address INTEGER,
+    description TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS calibrations (
+    id INTEGER PRIMARY KEY,
+    sensor_id INTEGER NOT NULL REFERENCES sensors(id),
+    timestamp TEXT NOT NULL,
+    offset_x INTEGER NOT NULL,
+    offset_y INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    samples INTEGER NOT NULL,
+    temp_offset INTEGER NOT NULL,
+    residual REAL,
+    angle_error REAL,
+    capture TEXT,
+    notes TEXT NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS sensors_address ON sensors(address);
+CREATE INDEX IF NOT EXISTS calibrations_sensor_time ON calibrations(sensor_id, timestamp);
+CREATE INDEX IF NOT EXISTS calibrations_time ON calibrations(timestamp);
+"""
+
+
+class StoredCalibration(NamedTuple):
+    serial: str
+    address: Optional[int]
+    timestamp: str # ISO 8601
+    calibration: Calibration
+    residual: Optional[float] # RMS angle residual of the fit (deg)
+    angle_error: Optional[float] # Angle error bound, e.g. from bootstrap.py (deg)
+    capture: Optional[str] # Capture file the calibration was fitted from
+    notes: str
+
+
+_SELECT = """
+    SELECT s.serial, s.address, c.timestamp, c.offset_x, c.offset_y, c.height, c.samples, c.temp_offset,
+        c.residual, c.angle_error, c.capture, c.notes
+    FROM calibrations c JOIN sensors s ON s.id = c.sensor_id
+"""
+
+
+def _row(row) -> StoredCalibration:
+    return StoredCalibration(row[0], row[1], row[2], Calibration(*row[3:8]), *row[8:])
+
+
+def _name(sensor: Union[str, int]) -> str:
+    return f"address 0x{sensor:02x}" if isinstance(sensor, int) else f"sensor {sensor}"
+
+
+class CalibrationDB:
+    """
+    Calibration database.
+    """
+
+    def __init__(self, path: str="calibration.db"):
+        """
+        Args:
+            path: SQLite database file. Created if it doesn't exist.
+        """
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+    def add_sensor(self, serial: str, address: Optional[int]=None, description: Optional[str]=None) -> int:
+        """
+        Add a sensor or update its address and description.
+
+        Returns:
+            Sensor row id
+        """
+        with self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO sensors (serial) VALUES (?)", (serial, ))
+            if address is not None:
+                self.conn.execute("UPDATE sensors SET address = ? WHERE serial = ?", (address, serial))
+            if description is not None:
+                self.conn.execute("UPDATE sensors SET description = ? WHERE serial = ?", (description, serial))
+        return self.conn.execute("SELECT id FROM sensors WHERE serial = ?", (serial, )).fetchone()[0]
+
+
+    def add_calibration(self, serial: str, calib: Calibration, timestamp: Optional[str]=None,
+            residual: Optional[float]=None, angle_error: Optional[float]=None,
+            capture: Optional[str]=None, notes: str="") -> int:
+        """
+        Store a calibration of a sensor. Unknown sensors are added.
+
+        Args:
+            serial: Sensor serial
+            calib: Calibration values
+            timestamp: ISO 8601 timestamp. Default is now.
+
+        Returns:
+            Calibration row id
+        """
+        sensor_id = self.add_sensor(serial)
+        if timestamp is None:
+            timestamp = datetime.datetime.now().isoformat(timespec="seconds")
+        with self.conn:
+            cur = self.conn.execute(
+                "INSERT INTO calibrations (sensor_id, timestamp, offset_x, offset_y, height, samples, temp_offset, "
+                "residual, angle_error, capture, notes) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (sensor_id, timestamp, *map(int, calib), residual, angle_error, capture, notes))
+        return cur.lastrowid
+
+
+    def _where(self, sensor: Union[str, int]):
+        if isinstance(sensor, int):
+            sensor = self.serial(sensor)
+        return "s.serial = ?", (sensor, )
+
+
+    def serial(self, address: int) -> Optional[str]:
+        """
+        Serial of the sensor with an I2C address. The addresses are reused on
+        every unit, so an address shared by several sensors raises LookupError.
+        """
+        serials = [ row[0] for row in self.conn.execute("SELECT serial FROM sensors WHERE address = ? ORDER BY serial", (address, )) ]
+        if len(serials) > 1:
+            raise LookupError(f"Address 0x{address:02x} is shared by sensors {', '.join(serials)}, use the serial")
+        return serials[0] if serials else None
+
+
+    def history(self, sensor: Union[str, int], since: Optional[str]=None, until: Optional[str]=None) -> List[StoredCalibration]:
+        """
+        Calibrations of a sensor in chronological order.
+
+        Args:
+            sensor: Serial (str) or I2C address (int). An address shared by
+                several sensors raises LookupError.
+            since, until: Optional ISO 8601 time limits
+        """
+        where, params = self._where(sensor)
+        if since is not None:
+            where += " AND c.timestamp >= ?"
+            params += (since, )
+        if until is not None:
+            where += " AND c.timestamp <= ?"
+            params += (until, )
+        rows = self.conn.execute(_SELECT + f" WHERE {where} ORDER BY c.timestamp, c.id", params)
+        return [ _row(row) for row in rows ]
+
+
+    def latest(self, sensor: Union[str, int], before: Optional[str]=None) -> Optional[StoredCalibration]:
+        """
+        Latest calibration of a sensor.
+
+        Args:
+            sensor: Serial (str) or I2C address (int). An address shared by
+                several sensors raises LookupError.
+            before: Optional ISO 8601 time limit
+        """
+        where, params = self._where(sensor)
+        if before is not None:
+            where += " AND c.timestamp <= ?"
+            params += (before, )
+        row = self.conn.execute(_SELECT + f" WHERE {where} ORDER BY c.timestamp DESC, c.id DESC LIMIT 1", params).fetchone()
+        return None if row is None else _row(row)
+
+
+    def all_latest(self) -> List[StoredCalibration]:
+        """
+        Latest calibration of every sensor.
+        """
+        rows = self.conn.execute(_SELECT + """
+            WHERE c.id = (SELECT c2.id FROM calibrations c2 WHERE c2.sensor_id = c.sensor_id
+                ORDER BY c2.timestamp DESC, c2.id DESC LIMIT 1)
+            ORDER BY s.serial""")
+        return [ _row(row) for row in rows ]
+
+
+    def export(self, fname: str, latest_only: bool=False) -> int:
+        """
+        Export calibrations to a CSV or JSON file (decided from the extension).
+
+        Returns:
+            Number of exported calibrations
+        """
+        if latest_only:
+            rows = self.all_latest()
+        else:
+            rows = [ _row(row) for row in self.conn.execute(_SELECT + " ORDER BY s.serial, c.timestamp, c.id") ]
+
+        flat = [ { "serial": r.serial, "address": r.address, "timestamp": r.timestamp, **r.calibration._asdict(),
+            "residual": r.residual, "angle_error": r.angle_error, "capture": r.capture, "notes": r.notes } for r in rows ]
+
+        with open(fname, "w", newline="") as f:
+            if fname.endswith(".json"):
+                json.dump(flat, f, indent=1)
+            else:
+                writer = csv.DictWriter(f, fieldnames=list(flat[0].keys()) if flat else [ "serial" ])
+                writer.writeheader()
+                writer.writerows(flat)
+        return len(flat)
+
+
+    def push(self, i2c, sensors: Optional[List[Union[str, int]]]=None, verify: bool=True) -> dict:
+        """
+        Write the latest stored calibration to each sensor on the bus.
+
+        Args:
+            i2c: Configured I2C controller
+            sensors: Serials (str) or I2C addresses (int) of the sensors on
+                the bus. Default is all the sensors in the database with an
+                address. The addresses are reused on every unit, so an address
+                shared by several sensors fails instead of guessing the unit.
+            verify: Read back and compare the calibration
+
+        Returns:
+            Dictionary of serial or address -> written Calibration (or the exception on failure)
+        """
+        if sensors is None:
+            sensors = sorted({ r.address for r in self.all_latest() if r.address is not None })
+
+        results = {}
+        for sensor in sensors:
+            try:
+                stored = self.latest(sensor)
+                if stored is None:
+                    raise LookupError(f"No calibration for {_name(sensor)}")
+                if stored.address is None:
+                    raise LookupError(f"No address for sensor {stored.serial}")
+                psd = PSDSunSensor(stored.address, i2c)
+                psd.set_calibration(stored.calibration)
+                if verify and psd.get_calibration() != stored.calibration:
+                    raise RuntimeError("Calibration read back doesn't match")
+                results[sensor] = stored.calibration
+            except Exception as e:
+                results[sensor] = e
+        return results
+
+
+def read_capture_calibration(fname: str) -> Calibration:
+    """
+    Read the calibration preamble of a meas.py capture file.
+    """
+    with open(fname) as f:
+        rows = csv.reader(f)
+        next(rows) # "Calibaration:"
+        next(rows) # Header
+        return Calibration(*map(int, next(rows)))
+
+
+def fit_capture(fname: str, y_fname: Optional[str]=None) -> tuple:
+    """
+    Fit an X_calib and Y_calib capture pair like plot.py does. Each capture
+    only sweeps one axis, so both are needed for the offsets.
+
+    Args:
+        fname: X_calib capture file
+        y_fname: Y_calib capture file. Default is found by name.
+
+    Returns:
+        Tuple of (Calibration, RMS angle residual in degrees)
+    """
+    import numpy as np
+    from plot import fit_calib, read_capture_pair, y_capture
+
+    if y_fname is None:
+        y_fname = y_capture(fname)
+    x_angles, y_angles, x, y, x_intensity, y_intensity = read_capture_pair(fname, y_fname)
+    # The captures are measured with zero offsets so the fitted values are absolute
+    preamble = read_capture_calibration(fname)
+    x = x - preamble.offset_x
+    y = y - read_capture_calibration(y_fname).offset_y
+    offset_x, offset_y, height = fit_calib(x_angles, y_angles, x, y, x_intensity, y_intensity).x
+    err_x = x_angles - np.degrees(np.arctan((x + offset_x) / height))
+    err_y = y_angles - np.degrees(np.arctan((y + offset_y) / height))
+    residual = float(np.sqrt(np.mean(np.concatenate((err_x, err_y))**2)))
+    calib = Calibration(round(offset_x), round(offset_y), round(height), preamble.samples, preamble.temp_offset)
+    return calib, residual
+
+
+if __name__ == "__main__":
+    import argparse
+
+    auto_int = lambda x: int(x,0)
+    sensor_id = lambda x: int(x, 0) if x.lower().startswith("0x") else x
+
+    parser = argparse.ArgumentParser(description="Sensor calibration database")
+    parser.add_argument('--db', default="calibration.db", help="Database file")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("sensor", help="Add or update a sensor")
+    p.add_argument('serial')
+    p.add_argument('--addr', '-a', type=auto_int, help="Sensor I2C address")
+    p.add_argument('--description', help="Free text description")
+
+    p = sub.add_parser("add", help="Store a calibration")
+    p.add_argument('serial')
+    p.add_argument('--calib', type=int, nargs=5, metavar=("OFFSET_X", "OFFSET_Y", "HEIGHT", "SAMPLES", "TEMP_OFFSET"),
+        help="Calibration values")
+    p.add_argument('--capture', help="Fit the calibration from a meas.py X_calib capture file")
+    p.add_argument('--capture_y', help="Y_calib capture file paired with --capture (default: found by name)")
+    p.add_argument('--angle_error', type=float, help="Angle error bound (deg)")
+    p.add_argument('--timestamp', help="ISO 8601 timestamp (default: now)")
+    p.add_argument('--notes', default="", help="Free text notes")
+
+    p = sub.add_parser("show", help="Show the latest calibration of sensors")
+    p.add_argument('sensors', nargs='*', type=sensor_id, help="Serials or 0x addresses (default: all)")
+
+    p = sub.add_parser("history", help="Show the calibration history of a sensor")
+    p.add_argument('sensor', type=sensor_id, help="Serial or 0x address")
+    p.add_argument('--since', help="ISO 8601 start time")
+    p.add_argument('--until', help="ISO 8601 end time")
+
+    p = sub.add_parser("export", help="Export calibrations to CSV or JSON")
+    p.add_argument('output')
+    p.add_argument('--latest', action='store_true', help="Only the latest calibration of each sensor")
+
+    p = sub.add_parser("push", help="Write the latest calibrations to the sensors on the bus")
+    p.add_argument('sensors', nargs='*', type=sensor_id, help="Serials or 0x addresses (default: all known)")
+    p.add_argument('--url', default=PSD_DEFAULT_URL, help="FTDI device URL")
+
+    args = parser.parse_args()
+    db = CalibrationDB(args.db)
+
+    def print_row(r: StoredCalibration):
+        addr = "    " if r.address is None else f"0x{r.address:02x}"
+        stats = "" if r.residual is None else f" residual {r.residual:.3f} deg"
+        stats += "" if r.angle_error is None else f" error bound {r.angle_error:.3f} deg"
+        print(f"{r.serial:<12} {addr} {r.timestamp} {tuple(r.calibration)}{stats} {r.capture or ''} {r.notes}")
+
+    if args.command == "sensor":
+        db.add_sensor(args.serial, args.addr, args.description)
+
+    elif args.command == "add":
+        residual = None
+        capture = args.capture
+        if args.capture:
+            calib, residual = fit_capture(args.capture, args.capture_y)
+            if args.capture_y:
+                capture = f"{args.capture},{args.capture_y}"
+        elif args.calib:
+            calib = Calibration(*args.calib)
+        else:
+            parser.error("Either --calib or --capture is required")
+        db.add_calibration(args.serial, calib, args.timestamp, residual, args.angle_error, capture, args.notes)
+        print_row(db.latest(args.serial))
+
+    elif args.command == "show":
+        try:
+            rows = [ db.latest(s) for s in args.sensors ] if args.sensors else db.all_latest()
+        except LookupError as e:
+            parser.error(str(e))
+        for r in rows:
+            if r is not None:
+                print_row(r)
+
+    elif args.command == "history":
+        try:
+            rows = db.history(args.sensor, args.since, args.until)
+        except LookupError as e:
+            parser.error(str(e))
+        for r in rows:
+            print_row(r)
+
+    elif args.command == "export":
+        print(f"Exported {db.export(args.output, args.latest)} calibrations")
+
+    elif args.command == "push":
+        from pyftdi.i2c import I2cController
+
+        i2c = I2cController()
+        i2c.configure(args.url, frequency=50e3)
+        for sensor, result in db.push(i2c, args.sensors or None).items():
+            print(f"{_name(sensor)}: {result}")
+        i2c.terminate()
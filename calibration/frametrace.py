@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+    Bounded in-memory trace of the raw I2C and APT frames.
+
+    Tracing is enabled by assigning a FrameTrace object to the `trace` class
+    attribute of PSDSunSensor and/or ThorRotator. The frames are kept in a
+    ring buffer and written to a binary trace file on demand or automatically
+    when a transaction fails. This tool decodes the trace files.
+
+    Trace file format (little-endian):
+        "FRMTRACE", version (B), wall clock ns (Q), monotonic ns (Q)
+        then for each frame:
+        monotonic ns (Q), bus (B), direction (B), address (B), length (H), payload
+"""
+
+import os
+import time
+import struct
+import datetime
+import threading
+from collections import deque
+from typing import Iterator, NamedTuple, Optional
+
+
+TRACE_MAGIC = b"FRMTRACE"
+TRACE_VERSION = 1
+
+TRACE_I2C = 0
+TRACE_APT = 1
+
+TRACE_TX = 0
+TRACE_RX = 1
+
+_file_header = struct.Struct("<8sBQQ")
+_frame_header = struct.Struct("<QBBBH")
+
+
+class Frame(NamedTuple):
+    timestamp: int # time.monotonic_ns()
+    bus: int
+    direction: int
+    addr: int
+    data: bytes
+
+
+class FrameTrace:
+    """
+    Ring buffer of the latest raw frames.
+    """
+
+    def __init__(self, capacity: int=4096, error_dir: Optional[str]=None, min_interval: float=10.0):
+        """
+        Args:
+            capacity: Number of frames kept in memory
+            error_dir: If given, the buffer is dumped to this directory when a transaction fails.
+            min_interval: Minimum time in seconds between the automatic dumps
+        """
+        self.frames = deque(maxlen=capacity)
+        self.error_dir = error_dir
+        self.min_interval = min_interval
+        self._last_dump = -float("inf")
+        self._lock = threading.Lock()
+
+
+    def record(self, bus: int, direction: int, addr: int, data: bytes) -> None:
+        """
+        Append a frame to the buffer.
+        """
+        self.frames.append(Frame(time.monotonic_ns(), bus, direction, addr, bytes(data)))
+
+
+    def dump(self, fname: str) -> int:
+        """
+        Write the buffered frames to a trace file.
+
+        Returns:
+            Number of frames written
+        """
+        frames = list(self.frames)
+        with self._lock, open(fname, "wb") as f:
+            f.write(_file_header.pack(TRACE_MAGIC, TRACE_VERSION, time.time_ns(), time.monotonic_ns()))
+            f.write(b"".join(_frame_header.pack(t, bus, direction, addr, len(data)) + data
+                for t, bus, direction, addr, data in frames))
+        return len(frames)
+
+
+    def error(self) -> Optional[str]:
+        """
+        Dump the buffer to error_dir after a failed transaction.
+
+        Returns:
+            Name of the written file or None.
+        """
+        now = time.monotonic()
+        if self.error_dir is None or now - self._last_dump < self.min_interval:
+            return None
+        self._last_dump = now
+
+        os.makedirs(self.error_dir, exist_ok=True)
+        fname = os.path.join(self.error_dir, datetime.datetime.now().strftime("trace_%Y%m%d_%H%M%S_%f.bin"))
+        self.dump(fname)
+        return fname
+
+
+def read_trace(fname: str) -> Iterator[Frame]:
+    """
+    Read the frames from a trace file.
+
+    Yields:
+        Frame objects. Timestamps are converted to wall clock nanoseconds.
+    """
+    with open(fname, "rb") as f:
+        buf = f.read()
+
+    magic, version, wall, mono = _file_header.unpack_from(buf)
+    if magic != TRACE_MAGIC or version != TRACE_VERSION:
+        raise ValueError(f"{fname!r} is not a frame trace file")
+
+    pos = _file_header.size
+    while pos < len(buf):
+        t, bus, direction, addr, length = _frame_header.unpack_from(buf, pos)
+        pos += _frame_header.size
+        yield Frame(t - mono + wall, bus, direction, addr, buf[pos:pos + length])
+        pos += length
+
+
+def decode_frame(frame: Frame) -> str:
+    """
+    Describe a frame using the PSD command and APT message tables.
+    """
+    import psd, thor
+
+    if frame.bus == TRACE_I2C:
+        if not frame.data:
+            return ""
+        prefix = "PSD_CMD_" if frame.direction == TRACE_TX else "PSD_RSP_"
+        names = { v: k for k, v in vars(psd).items() if k.startswith(prefix) }
+        return names.get(frame.data[0], f"0x{frame.data[0]:02x}") + " " + frame.data[1:].hex(" ")
+
+    if len(frame.data) < 6:
+        return "Truncated " + frame.data.hex(" ")
+    message_id, param1, param2, dest, src = struct.unpack_from("<HBBBB", frame.data)
+    name = "MGMSG_" + thor.MGMSG_NAMES.get(message_id, f"0x{message_id:04x}")
+    if dest & 0x80:
+        return f"{name} {frame.data[6:].hex(' ')}"
+    return f"{name} param1={param1} param2={param2}"
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Frame trace decoder")
+    parser.add_argument('trace', help="Trace file")
+    parser.add_argument('--bus', choices=("i2c", "apt"), help="Only show frames of the given bus")
+    parser.add_argument('--raw', action='store_true', help="Print the raw bytes too")
+    args = parser.parse_args()
+
+    bus = { None: None, "i2c": TRACE_I2C, "apt": TRACE_APT }[args.bus]
+    previous = None
+    for frame in read_trace(args.trace):
+        if bus is not None and frame.bus != bus:
+            continue
+        t = datetime.datetime.fromtimestamp(frame.timestamp / 1e9)
+        delta = 0 if previous is None else (frame.timestamp - previous) / 1e6
+        previous = frame.timestamp
+        print(f"{t:%H:%M:%S.%f} {delta:+10.3f} ms {'I2C' if frame.bus == TRACE_I2C else 'APT'} "
+            f"0x{frame.addr:02x} {'TX' if frame.direction == TRACE_TX else 'RX'} {decode_frame(frame)}")
+        if args.raw:
+            print("    ", frame.data.hex(" "))
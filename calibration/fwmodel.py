@@ -0,0 +1,153 @@
+"""
+    NumPy model of the PSD Sun Sensor firmware arithmetic.
+
+    The functions replicate the integer math of v3/fw (read_voltage_channels,
+    calculate_position and atan) bug for bug so that host side simulations
+    see the same numbers as the sensor would report.
+    All functions work on arrays of any shape.
+"""
+
+import numpy as np
+
+
+ADC_MAX = 1023
+LUT_SIZE = 256
+
+# Content of `lt` in v3/fw/main.c: the first half of the generated table.
+# Positions beyond are clipped to the last entry.
+FIRMWARE_LUT = np.array([
+       0,    9,   18,   27,   36,   45,   54,   62,
+      71,   80,   89,   98,  106,  115,  123,  132,
+     140,  149,  157,  165,  174,  182,  190,  198,
+     206,  213,  221,  229,  236,  244,  251,  258,
+     266,  273,  280,  287,  294,  300,  307,  314,
+     320,  326,  333,  339,  345,  351,  357,  363,
+     369,  374,  380,  386,  391,  396,  402,  407,
+     412,  417,  422,  427,  432,  436,  441,  445,
+     450,  454,  459,  463,  467,  472,  476,  480,
+     484,  488,  491,  495,  499,  503,  506,  510,
+     513,  517,  520,  524,  527,  530,  533,  537,
+     540,  543,  546,  549,  552,  555,  558,  560,
+     563,  566,  569,  571,  574,  576,  579,  581,
+     584,  586,  589,  591,  593,  596,  598,  600,
+     603,  605,  607,  609,  611,  613,  615,  617,
+     619,  621,  623,  625,  627,  629,  631,  633,
+], dtype=np.int16)
+
+
+def make_lut(lut_size: int=LUT_SIZE, atan_ratio: float=256, adc: int=ADC_MAX + 1) -> np.ndarray:
+    """
+    Generate a position to angle look-up table the same way as lut.py.
+
+    Args:
+        lut_size: Number of entries in the table
+        atan_ratio: Position value corresponding to 45 degrees
+        adc: Position range covered by the table
+
+    Returns:
+        Table of angles in 0.1 degrees as int16 array.
+    """
+    step = adc // lut_size
+    return np.round(10 * np.degrees(np.arctan2(step * np.arange(lut_size), atan_ratio))).astype(np.int16)
+
+
+def _c_div(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    C integer division (truncating towards zero). Division by zero gives 0.
+    """
+    b_safe = np.where(b == 0, 1, b)
+    q = np.abs(a) // np.abs(b_safe)
+    return np.where(b == 0, 0, np.sign(a) * np.sign(b_safe) * q)
+
+
+def average_samples(adc_sum: np.ndarray, samples: int) -> np.ndarray:
+    """
+    Average accumulated ADC readings and invert them as in read_voltage_channels().
+
+    Args:
+        adc_sum: Sum of `samples` 10-bit ADC readings per channel.
+        samples: Calibration samples value.
+
+    Returns:
+        Raw measurement values as uint16 array.
+    """
+    adc_sum = np.asarray(adc_sum, dtype=np.int64)
+    shifts = { 1: 0, 2: 1, 4: 2, 8: 3, 16: 4 }
+    if samples in shifts:
+        avg = adc_sum >> shifts[samples]
+    else:
+        avg = adc_sum // samples
+    return (ADC_MAX - avg).astype(np.uint16)
+
+
+def acquired_samples(samples: int) -> int:
+    """
+    Number of ADC rounds the firmware actually runs for given samples value.
+    """
+    return samples if 0 < samples <= 8 else 1
+
+
+def calculate_position(raw: np.ndarray, offset_x: int=0, offset_y: int=0):
+    """
+    Firmware calculate_position()
+
+    Args:
+        raw: Raw measurements as array of shape (..., 4) in order x1, x2, y1, y2.
+        offset_x, offset_y: Calibration offsets
+
+    Returns:
+        Tuple of x, y (int16) and intensity (uint16) arrays.
+    """
+    raw = np.asarray(raw, dtype=np.int64)
+    x1, x2, y1, y2 = np.moveaxis(raw, -1, 0)
+
+    total = x1 + x2 + y1 + y2
+    a = (x2 + y1) - (x1 + y2)
+    b = (x2 + y2) - (x1 + y1)
+
+    x = _c_div(a << 11, total).astype(np.int16)
+    y = _c_div(b << 11, total).astype(np.int16)
+    intensity = (total >> 2).astype(np.uint16)
+    intensity = np.where(intensity > 1024, 0, intensity).astype(np.uint16)
+
+    x = (x.astype(np.int64) + offset_x).astype(np.int16)
+    y = (y.astype(np.int64) + offset_y).astype(np.int16)
+    return x, y, intensity
+
+
+def atan(x: np.ndarray, lut: np.ndarray=FIRMWARE_LUT, step: int=4, exact: bool=True) -> np.ndarray:
+    """
+    Firmware atan() look-up with linear interpolation.
+
+    Args:
+        x: Light point positions (int16)
+        lut: Look-up-table
+        step: Position difference between table entries (4 in the firmware)
+        exact: If True the firmware interpolation is replicated bug for bug
+            (slope from the sum of the neighbouring entries and sign lost).
+            If False a proper signed linear interpolation is done instead.
+
+    Returns:
+        Angles in 0.1 degrees as int16 array.
+    """
+    lut = np.asarray(lut, dtype=np.int64)
+    size = len(lut)
+    x = np.asarray(x, dtype=np.int64)
+    ax = np.abs(x)
+
+    pos = ax // step
+    clipped = pos >= size - 1
+    pos = np.minimum(pos, size - 2)
+    i = ax - pos * step
+
+    if exact:
+        d = (lut[pos + 1] + lut[pos]) // step
+        y = (lut[pos] + i * d) & 0xFFFF
+    else:
+        y = lut[pos] + (i * (lut[pos + 1] - lut[pos])) // step
+    y = np.where(clipped, lut[size - 1], y)
+    y = y.astype(np.uint16).astype(np.int16)
+
+    if exact:
+        return y
+    return np.where(x >= 0, y, -y).astype(np.int16)
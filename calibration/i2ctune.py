@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+    I2C bus clock tuner for the FTDI link.
+
+    Steps the bus frequency up and runs a burst of GET_ALL and GET_CALIBRATION
+    transactions with every sensor at each step. A step passes when all the
+    responses have the expected response code and the calibration values
+    match the ones read at the lowest frequency. The selected frequency is
+    the fastest passing step within a margin of the first failing one, or of
+    the highest tested one if none fails, and it is saved to PSD_TUNING_FILE
+    where PSDSunSensor picks it up.
+"""
+
+import json
+import time
+import datetime
+from typing import List, NamedTuple, Sequence
+
+from psd import PSDSunSensor, PSD_DEFAULT_URL, PSD_TUNING_FILE
+
+
+DEFAULT_FREQUENCIES = (10e3, 50e3, 100e3, 200e3, 300e3, 400e3, 600e3, 800e3, 1e6)
+
+
+class TuningStep(NamedTuple):
+    frequency: float # Requested bus frequency (Hz)
+    transactions: int # Number of transactions
+    errors: int # Number of failed or inconsistent transactions
+    rate: float # Transactions per second
+    error: str # First error message
+
+
+def run_burst(sensors: Sequence[PSDSunSensor], reference: dict, burst: int) -> TuningStep:
+    """
+    Run a burst of GET_ALL and GET_CALIBRATION transactions with each sensor.
+
+    Args:
+        sensors: Sensors on the bus
+        reference: Expected calibration for each sensor address
+        burst: Number of transaction pairs per sensor
+    """
+    errors, first_error, transactions = 0, "", 0
+    start = time.perf_counter()
+    for _ in range(burst):
+        for psd in sensors:
+            for transaction in (psd.get_all, psd.get_calibration):
+                transactions += 1
+                try:
+                    value = transaction()
+                except Exception as e:
+                    errors += 1
+                    first_error = first_error or f"0x{psd.addr:02X} {transaction.__name__}: {e}"
+                    continue
+                if transaction == psd.get_calibration and value != reference[psd.addr]:
+                    errors += 1
+                    first_error = first_error or f"0x{psd.addr:02X} inconsistent calibration {value}"
+    elapsed = time.perf_counter() - start
+    return TuningStep(0.0, transactions, errors, transactions / elapsed, first_error)
+
+
+def tune(i2c, addresses: Sequence[int], url: str=PSD_DEFAULT_URL, frequencies: Sequence[float]=DEFAULT_FREQUENCIES,
+        burst: int=20, margin: float=0.75, verbose: bool=True):
+    """
+    Find the fastest reliable I2C bus frequency.
+
+    Args:
+        i2c: I2C controller object. It is reconfigured for each frequency.
+        addresses: Sensor addresses on the bus
+        url: FTDI device URL
+        frequencies: Frequencies to be tested in increasing order. The first
+            one is used to read the reference calibrations.
+        burst: Number of GET_ALL/GET_CALIBRATION pairs per sensor at each frequency
+        margin: The selected frequency is at most margin times the first failing frequency,
+            or the highest tested frequency if all of them pass
+        verbose: Print the results of each step
+
+    Returns:
+        Tuple of (selected frequency, list of TuningStep)
+    """
+    frequencies = sorted(frequencies)
+
+    def configure(frequency):
+        i2c.terminate()
+        i2c.configure(url, frequency=frequency)
+        return [ PSDSunSensor(addr, i2c) for addr in addresses ]
+
+    sensors = configure(frequencies[0])
+    reference = { psd.addr: psd.get_calibration() for psd in sensors }
+
+    steps: List[TuningStep] = []
+    failed = None
+    for frequency in frequencies:
+        step = run_burst(configure(frequency), reference, burst)._replace(frequency=frequency)
+        steps.append(step)
+        if verbose:
+            print(f"{frequency / 1e3:7.1f} kHz: {step.transactions} transactions, {step.errors} errors, "
+                f"{step.rate:.0f}/s {step.error}")
+        if step.errors:
+            failed = frequency
+            break
+
+    passed = [ step.frequency for step in steps if not step.errors ]
+    if not passed:
+        raise RuntimeError(f"No reliable bus frequency: {steps[0].error}")
+    # Passing the highest tested frequency doesn't show any margin either
+    limit = margin * (failed if failed is not None else passed[-1])
+    selected = ([ f for f in passed if f <= limit ] or passed[:1])[-1]
+
+    # Leave the controller at the selected frequency
+    configure(selected)
+    return selected, steps
+
+
+def save_tuning(url: str, frequency: float, steps: Sequence[TuningStep], fname: str=PSD_TUNING_FILE) -> None:
+    """
+    Save the selected frequency of the URL to the tuning file.
+    """
+    try:
+        with open(fname) as f:
+            tuning = json.load(f)
+    except (OSError, ValueError):
+        tuning = {}
+
+    tuning[url] = {
+        "frequency": frequency,
+        "tuned": datetime.datetime.now().isoformat(timespec="seconds"),
+        "steps": [ step._asdict() for step in steps ],
+    }
+    with open(fname, "w") as f:
+        json.dump(tuning, f, indent=2)
+
+
+if __name__ == "__main__":
+    import argparse
+    from psd import open_i2c, scan_sensors
+
+    auto_int = lambda x: int(x, 0)
+    parser = argparse.ArgumentParser(description="Find the fastest reliable I2C bus frequency")
+    parser.add_argument('--url', default=PSD_DEFAULT_URL, help="FTDI device URL")
+    parser.add_argument('--addr', '-a', type=auto_int, nargs='+', help="Sensor I2C addresses (default: scan)")
+    parser.add_argument('--frequencies', type=float, nargs='+', default=DEFAULT_FREQUENCIES, help="Frequencies to be tested")
+    parser.add_argument('--burst', type=int, default=20, help="Transaction pairs per sensor at each frequency")
+    parser.add_argument('--margin', type=float, default=0.75, help="Margin to the first failing or the highest passing frequency")
+    parser.add_argument('--output', '-w', default=PSD_TUNING_FILE, help="Tuning file")
+    parser.add_argument('--dry_run', action='store_true', help="Don't save the result")
+    args = parser.parse_args()
+
+    i2c = open_i2c(args.url, min(args.frequencies))
+    addresses = args.addr or scan_sensors(i2c)
+    if not addresses:
+        raise SystemExit("No sensors found")
+
+    frequency, steps = tune(i2c, addresses, args.url, args.frequencies, args.burst, args.margin)
+    print(f"Selected {frequency / 1e3:.1f} kHz")
+    if not args.dry_run:
+        save_tuning(args.url, frequency, steps, args.output)
+        print(f"Saved to {args.output}")
@@ -2,11 +2,10 @@
     Generate position to angle look-up table
 """
 
-import matplotlib
-import matplotlib.pyplot as plt
-import numpy as np
 import math
 
+import numpy as np
+
 
 ATAN_RATIO = 256
 LUT_SIZE = 256
@@ -18,44 +17,65 @@ RATIO = ADC // LUT_SIZE
 def real(x):
     return 10 * math.degrees(math.atan2(x, ATAN_RATIO))
 
-LUT = np.empty(LUT_SIZE)
-for i in range(LUT_SIZE):
-    LUT[i] = round(real(RATIO * i))
 
+def make_lut() -> np.ndarray:
+    """
+    Generate the look-up table in 0.1 degrees.
+    """
+    return np.round(10 * np.degrees(np.arctan2(RATIO * np.arange(LUT_SIZE), ATAN_RATIO)))
 
-for i in range(128//8):
-    print(", ".join("%4d" % x for x in LUT[8*i:8*(i+1)]) )
 
+def print_lut(lut) -> None:
+    """
+    Print the first half of the table as C initializer rows.
+    """
+    for i in range(128//8):
+        print(", ".join("%4d" % x for x in lut[8*i:8*(i+1)]) )
 
-def lut_tan(x):
+
+def lut_tan(x, lut):
     pos = x // RATIO
     if pos >= LUT_SIZE - 1:
-        return LUT[-1]
-    return round(LUT[pos] + ((x - 4*pos) * (LUT[pos + 1] - LUT[pos])) // RATIO)
+        return lut[-1]
+    return round(lut[pos] + ((x - 4*pos) * (lut[pos + 1] - lut[pos])) // RATIO)
+
 
+def plot_lut(lut) -> None:
+    import matplotlib.pyplot as plt
 
-if 1:
     fig, ax = plt.subplots()
-    ax.step(range(LUT_SIZE), LUT)
+    ax.step(range(LUT_SIZE), lut)
 
     ax.set(xlabel='ADC count', ylabel='Angle', title='Lookup table')
     ax.grid()
+    plt.show()
 
-else:
 
-    t = np.empty(ADC)
-    err = np.empty(ADC)
-    for i in range(ADC):
-
-        t[i] = i
-        err[i] = abs(real(i) - lut_tan(i))
-        #print(real(i), lut_tan(i))
+def plot_error(lut) -> None:
+    import matplotlib.pyplot as plt
 
+    t = np.arange(ADC)
+    err = np.array([ abs(real(i) - lut_tan(i, lut)) for i in range(ADC) ])
 
     fig, ax = plt.subplots()
     ax.plot(t, err)
 
     ax.set(xlabel='ADC count', ylabel='Error', title='Error in degrees (max %.2f, std: %.2f)' % (max(err), np.std(err)))
     ax.grid()
+    plt.show()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Tangent look-up table generator")
+    parser.add_argument('--plot', action='store_true', help="Plot the table")
+    parser.add_argument('--error', action='store_true', help="Plot the interpolation error")
+    args = parser.parse_args()
 
-plt.show()
+    LUT = make_lut()
+    print_lut(LUT)
+    if args.plot:
+        plot_lut(LUT)
+    if args.error:
+        plot_error(LUT)
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+    Monte Carlo simulation of the PSD Sun Sensor angle accuracy.
+
+    Random sun directions are converted to light point positions with the
+    same geometry as calc_calib() (height * tan(angle) + offset), split to the
+    four PSD diode currents, quantized by the ADC and run through the firmware
+    integer math (see fwmodel.py). The angle errors are collected to fixed
+    histograms so that the memory use doesn't depend on the number of trials.
+"""
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, NamedTuple, Optional
+
+import numpy as np
+
+import fwmodel
+
+
+class SimulationParameters(NamedTuple):
+    """
+    Simulated sensor and firmware configuration
+    """
+    height: float = 670         # Optical height in position units
+    offset_x: float = 0         # Light point offset in position units
+    offset_y: float = 0
+    fov: float = 50             # Half field of view in degrees
+    full_scale: float = 3000    # Sum of the diode counts at normal incidence
+    noise: float = 1.0          # ADC noise (standard deviation in counts)
+    samples: int = 1            # Calibration samples value
+    lut_size: int = 0           # 0 = use the firmware table
+    exact: bool = True          # Replicate the firmware interpolation bug for bug
+
+
+# Histogram bins for the angle errors (degrees)
+ERROR_RANGE = 20.0
+ERROR_BINS = 40000
+
+# Error sources collected
+ERRORS = ("firmware", "host")
+
+
+def diode_counts(px: np.ndarray, py: np.ndarray, total: np.ndarray) -> np.ndarray:
+    """
+    Split the light point position to the four diode currents.
+    Inverse of calculate_position() for a tetra-lateral PSD.
+
+    Args:
+        px, py: Light point position in position units (-2048 to 2048)
+        total: Sum of the diode currents in ADC counts
+
+    Returns:
+        Diode currents (x1, x2, y1, y2) in ADC counts as array of shape (..., 4).
+    """
+    ux = np.clip(px / 2048, -1, 1)
+    uy = np.clip(py / 2048, -1, 1)
+    q = total / 4
+    return np.stack((
+        q * (1 - ux - uy),
+        q * (1 + ux + uy),
+        q * (1 + ux - uy),
+        q * (1 - ux + uy),
+    ), axis=-1).clip(0, None)
+
+
+def simulate_chunk(params: SimulationParameters, trials: int, seed: np.random.SeedSequence) -> Dict[str, np.ndarray]:
+    """
+    Simulate a chunk of trials.
+
+    Returns:
+        Dictionary containing an error histogram and [count, sum, sum of squares, max abs]
+        statistics for each error source.
+    """
+    rng = np.random.default_rng(seed)
+
+    # Random sun directions within the field of view
+    ax = rng.uniform(-params.fov, params.fov, trials)
+    ay = rng.uniform(-params.fov, params.fov, trials)
+    tx, ty = np.tan(np.radians(ax)), np.tan(np.radians(ay))
+    cos_incidence = 1 / np.sqrt(1 + tx**2 + ty**2)
+
+    # Geometry and diode currents
+    px = params.height * tx + params.offset_x
+    py = params.height * ty + params.offset_y
+    currents = diode_counts(px, py, params.full_scale * cos_incidence)
+
+    # ADC with noise. The ADC sees the inverted TIA output voltage.
+    adc_sum = np.zeros(currents.shape, dtype=np.int64)
+    for _ in range(fwmodel.acquired_samples(params.samples)):
+        adc = fwmodel.ADC_MAX - currents + rng.normal(0, params.noise, currents.shape)
+        adc_sum += np.clip(np.round(adc), 0, fwmodel.ADC_MAX).astype(np.int64)
+    raw = fwmodel.average_samples(adc_sum, params.samples)
+
+    # Firmware calculation with perfect calibration
+    offset_x, offset_y = -round(params.offset_x), -round(params.offset_y)
+    x, y, _ = fwmodel.calculate_position(raw, offset_x, offset_y)
+
+    if params.lut_size:
+        lut = fwmodel.make_lut(params.lut_size, params.height, adc=2048)
+        step = 2048 // params.lut_size
+    else:
+        lut, step = fwmodel.FIRMWARE_LUT, 4
+
+    errors = {
+        "firmware": np.concatenate((
+            fwmodel.atan(x, lut, step, params.exact) / 10 - ax,
+            fwmodel.atan(y, lut, step, params.exact) / 10 - ay,
+        )),
+        "host": np.concatenate((
+            np.degrees(np.arctan(x / round(params.height))) - ax,
+            np.degrees(np.arctan(y / round(params.height))) - ay,
+        )),
+    }
+
+    result = {}
+    for name, err in errors.items():
+        result[name] = np.histogram(err, bins=ERROR_BINS, range=(-ERROR_RANGE, ERROR_RANGE))[0]
+        result[name + "_stats"] = np.array([err.size, err.sum(), (err**2).sum(), np.abs(err).max()])
+    return result
+
+
+def _simulate(args):
+    return simulate_chunk(*args)
+
+
+def run_simulation(params: SimulationParameters,
+        trials: int,
+        chunk_size: int=1_000_000,
+        workers: Optional[int]=None,
+        seed: Optional[int]=None
+    ) -> Dict[str, np.ndarray]:
+    """
+    Run the Monte Carlo simulation in a process pool.
+
+    Args:
+        params: Simulation parameters
+        trials: Total number of simulated sun directions
+        chunk_size: Number of trials simulated at once by one worker
+        workers: Number of worker processes (default: number of CPUs)
+        seed: Random seed for reproducible results
+
+    Returns:
+        Summed chunk results (see simulate_chunk)
+    """
+    n_chunks = -(-trials // chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(n_chunks)
+    sizes = [ min(chunk_size, trials - i * chunk_size) for i in range(n_chunks) ]
+
+    total = {}
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        for result in pool.map(_simulate, ((params, n, s) for n, s in zip(sizes, seeds))):
+            for name, value in result.items():
+                if name not in total:
+                    total[name] = value
+                elif name.endswith("_stats"):
+                    total[name][:3] += value[:3]
+                    total[name][3] = max(total[name][3], value[3])
+                else:
+                    total[name] += value
+    return total
+
+
+def percentiles(hist: np.ndarray, q) -> np.ndarray:
+    """
+    Calculate percentiles from an error histogram.
+
+    Args:
+        hist: Error histogram
+        q: Percentiles (0-100)
+
+    Returns:
+        Error values for each percentile in degrees.
+    """
+    edges = np.linspace(-ERROR_RANGE, ERROR_RANGE, ERROR_BINS + 1)
+    cdf = np.cumsum(hist) / hist.sum()
+    idx = np.searchsorted(cdf, np.asarray(q) / 100)
+    return edges[np.minimum(idx + 1, ERROR_BINS)]
+
+
+def print_report(result: Dict[str, np.ndarray]) -> None:
+    """
+    Print error distribution summary.
+    """
+    q = [0.135, 2.275, 50, 97.725, 99.865]
+    print(f"{'':>10} {'trials':>12} {'mean':>8} {'std':>8} {'max':>8}   " + " ".join(f"{p:>7}%" for p in q))
+    for name in ERRORS:
+        n, s, s2, max_err = result[name + "_stats"]
+        mean = s / n
+        std = np.sqrt(max(s2 / n - mean**2, 0))
+        p = percentiles(result[name], q)
+        print(f"{name:>10} {int(n):>12d} {mean:>8.3f} {std:>8.3f} {max_err:>8.3f}   " + " ".join(f"{v:>8.3f}" for v in p))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="PSD angle accuracy Monte Carlo simulator")
+    parser.add_argument('--trials', '-n', type=float, default=1e7, help="Number of simulated sun directions")
+    parser.add_argument('--chunk', type=int, default=1_000_000, help="Trials per chunk")
+    parser.add_argument('--workers', '-j', type=int, help="Number of worker processes")
+    parser.add_argument('--seed', type=int, help="Random seed")
+    parser.add_argument('--height', type=float, default=670, help="Optical height in position units")
+    parser.add_argument('--offset', type=float, nargs=2, default=(0, 0), help="Light point offset")
+    parser.add_argument('--fov', type=float, default=50, help="Half field of view in degrees")
+    parser.add_argument('--full_scale', type=float, default=3000, help="Diode count sum at normal incidence")
+    parser.add_argument('--noise', type=float, default=1.0, help="ADC noise in counts")
+    parser.add_argument('--samples', type=int, default=1, help="Calibration samples value")
+    parser.add_argument('--lut_size', type=int, default=0, help="Generated LUT size (0 = firmware table)")
+    parser.add_argument('--fixed', action='store_true', help="Use corrected atan interpolation")
+    parser.add_argument('--save', help="Save error histograms to a .npz file")
+    args = parser.parse_args()
+
+    params = SimulationParameters(
+        height=args.height,
+        offset_x=args.offset[0],
+        offset_y=args.offset[1],
+        fov=args.fov,
+        full_scale=args.full_scale,
+        noise=args.noise,
+        samples=args.samples,
+        lut_size=args.lut_size,
+        exact=not args.fixed,
+    )
+    print(params)
+
+    t = time.monotonic()
+    result = run_simulation(params, int(args.trials), args.chunk, args.workers, args.seed)
+    print(f"Simulated {int(args.trials)} trials in {time.monotonic() - t:.1f} s\n")
+    print_report(result)
+
+    if args.save:
+        np.savez_compressed(args.save, edges=np.linspace(-ERROR_RANGE, ERROR_RANGE, ERROR_BINS + 1),
+            params=np.array(params, dtype=float), **result)
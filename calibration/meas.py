@@ -5,139 +5,329 @@
 
 import time, datetime
 import os, csv
+import threading
 
 from thor import ThorRotator
-from psd import PSDSunSensor, Calibration
+from psd import PSDSunSensor, Calibration, PointMeasurement, PSD_DEFAULT_TEMP_OFFSET
 import numpy as np
-import matplotlib.pyplot as plt
-
-import argparse
-
-parser = argparse.ArgumentParser(description="PSD measurement tool")
-auto_int = lambda x: int(x,0)
-parser.add_argument('--addr', '-a', type=auto_int, default=0x4A, help="Sensor I2C address")
-parser.add_argument('--device', '-D', default="/dev/ttyUSB0", help="Stepper motor Serial device")
-parser.add_argument('--constant', '-c', action="store_true", help="Only do constant measurement at 0 deg")
-parser.add_argument('--degree', '-d', type=int, default=80, help="Degree measurement max")
-
-parser.add_argument('-w', '--write', dest="save_path",
-                    default="meas",
-                    type=str, 
-                    help="save files to folder")
-
-args = parser.parse_args()
-
-info = "_psd_%x" % args.addr
-if args.constant:
-    info += "_constant"
-fname = datetime.datetime.now().isoformat("_") + info
-
-angles = []
-pointsx = []
-pointsy = []
-intensity = []
-
-# Start writing to CSV file
-csv_fname = f"{args.save_path}/{fname}.csv"
-if not os.path.exists(args.save_path):
-    os.makedirs(args.save_path)
-
-print(f"Outputting to {csv_fname!r}")
-with open(csv_fname, 'w') as csvfile: 
-    # creating a csv writer object 
-    csvwriter = csv.writer(csvfile) 
-
-    psd = PSDSunSensor(args.addr)
-    psd.set_calibration(Calibration(0, 0, 670, 1, 639))
-    thor = ThorRotator(device=args.device)
-
-    # Read the current calibration and write it to measurement file
-    calib = psd.get_calibration()
-    print(calib)
-    
+
+
+def read_point(psd: PSDSunSensor) -> PointMeasurement:
+    """
+    Read a point measurement retrying until the sensor responds.
+    """
+    while True:
+        try:
+            return psd.get_point()
+        except:
+            continue
+
+
+def write_calibration(csvwriter, calib: Calibration, timestamps: bool=False) -> None:
+    """
+    Write the calibration preamble and the measurement header to the CSV file.
+
+    Args:
+        timestamps: Add a Time column for the continuous sweep
+    """
     csvwriter.writerow(["Calibaration:"])
     csvwriter.writerow(["Offset X", "Offset Y", "Height", "Samples", "Temp Offset"])
     csvwriter.writerow([calib[0], calib[1], calib[2], calib[3], calib[4]])
 
     fields = ['Angle', 'Position X', 'Position Y', 'Intensity']
-    # writing header 
-    csvwriter.writerow(fields) 
-    if args.constant:
-        print("Moving platform to 0 deg. Please wait.")
-        angle = 0
+    if timestamps:
+        fields.append('Time')
+    # writing header
+    csvwriter.writerow(fields)
+
+
+def record(csvwriter, rows, angle, pos: PointMeasurement, verbose: bool=True) -> None:
+    """
+    Write a measurement to the CSV file and store it for plotting.
+    """
+    if verbose:
+        print(f"Angle: {angle:>5} deg, X: {pos.x:<5}, Y: {pos.y:<5}, Intensity: {pos.intensity:<5}")
+    if csvwriter is not None:
+        csvwriter.writerow([angle, pos.x, pos.y, pos.intensity])
+    rows.append((angle, pos.x, pos.y, pos.intensity))
+
+
+def constant_measurement(psd: PSDSunSensor, thor: ThorRotator, csvwriter=None,
+        samples: int=250, interval: float=0.1, verbose: bool=True):
+    """
+    Measure the sensor at 0 degrees.
+
+    Returns:
+        List of (angle, x, y, intensity) tuples
+    """
+    rows = []
+    angle = 0
+    # Rotate
+    thor.move_absolute(1, angle * thor.EncCnt)
+    time.sleep(0.1)
+
+    for _ in range(samples):
+        record(csvwriter, rows, angle, read_point(psd), verbose)
+        time.sleep(interval)
+    return rows
+
+
+def step_sweep(psd: PSDSunSensor, thor: ThorRotator, angles, csvwriter=None,
+        samples: int=10, dwell: float=0.1, verbose: bool=True, callback=None):
+    """
+    Rotate the stage to each angle and take samples after each dwell.
+
+    Args:
+        callback: Optional function called with the angle and its rows
+            after each angle. The sweep stops if it returns True.
+
+    Returns:
+        List of (angle, x, y, intensity) tuples
+    """
+    rows = []
+    for angle in angles:
+
         # Rotate
         thor.move_absolute(1, angle * thor.EncCnt)
-        time.sleep(0.1)
-        
-        for _ in range(250):
-            # Measure
-            while True:
-                try:
-                    pos = psd.get_point()
-                except:
-                    continue
-                break
-                
-            print(f"Angle: {angle:>5} deg, X: {pos.x:<5}, Y: {pos.y:<5}, Intensity: {pos.intensity:<5}")
-            # write measurement
-            csvwriter.writerow([angle, pos.x, pos.y, pos.intensity])
-
-            # Store for plottin
-            angles.append(angle)
-            pointsx.append(pos.x)
-            pointsy.append(pos.y)
-            intensity.append(pos.intensity)
-            time.sleep(0.1)
-    else:
-        print("Moving platform to", -args.degree, "deg. Please wait.")
-        for angle in np.arange(-args.degree, args.degree+1, 1):
-
-            # Rotate
-            thor.move_absolute(1, angle * thor.EncCnt)
-            for _ in range(10):
-                time.sleep(0.1)
-
-                # Measure
-                while True:
-                    try:
-                        pos = psd.get_point()
-                    except:
-                        continue
+        for _ in range(samples):
+            time.sleep(dwell)
+            record(csvwriter, rows, angle, read_point(psd), verbose)
+
+        if callback is not None and callback(angle, rows[-samples:]):
+            break
+    return rows
+
+
+def continuous_sweep(psd: PSDSunSensor, thor: ThorRotator, start: float, stop: float,
+        velocity: float, csvwriter=None, encoder_interval: float=0.02, verbose: bool=True):
+    """
+    Rotate the stage at constant velocity from start to stop angle while
+    sampling the sensor as fast as possible. The encoder is polled from
+    another thread and the stage angle of each sensor sample is interpolated
+    from the encoder readings afterwards.
+
+    Args:
+        start: Start angle in degrees
+        stop: Stop angle in degrees
+        velocity: Stage velocity in degrees per second
+        encoder_interval: Encoder polling interval in seconds
+
+    Returns:
+        List of (angle, x, y, intensity) tuples
+    """
+    channel = 1
+    thor.move_absolute(channel, start * thor.EncCnt)
+    params = thor.get_velocity(channel)
+    thor.set_velocity(channel, params.min_velocity, params.accleration, int(velocity * thor.velocity_scale))
+
+    forward = stop > start
+    limit = stop * thor.EncCnt
+    duration = 2 * abs(stop - start) / velocity + 5.0
+    done = threading.Event()
+    encoder = []
+
+    def poll_encoder():
+        try:
+            while not done.is_set():
+                t = time.monotonic()
+                position = thor.get_position()
+                t = (t + time.monotonic()) / 2
+                encoder.append((t, position))
+                if (position >= limit) if forward else (position <= limit):
                     break
-                
-                print(f"Angle: {angle:>5} deg, X: {pos.x:<5}, Y: {pos.y:<5}, Intensity: {pos.intensity:<5}")
-                # write measurement
-                csvwriter.writerow([angle, pos.x, pos.y, pos.intensity])
+                time.sleep(encoder_interval)
+        finally:
+            done.set()
+
+    samples = []
+    thread = threading.Thread(target=poll_encoder, daemon=True)
+    thor.move_velocity(channel, 1 if forward else 2)
+    thread.start()
+    try:
+        deadline = time.monotonic() + duration
+        while not done.is_set() and time.monotonic() < deadline:
+            # The sensor converts right after the command is received
+            t = time.monotonic()
+            try:
+                pos = psd.get_point()
+            except:
+                continue
+            samples.append((t, pos.x, pos.y, pos.intensity))
+    finally:
+        done.set()
+        thor.stop(channel)
+        thread.join()
+        thor.set_velocity(channel, *params[1:])
+
+    if not samples or len(encoder) < 2:
+        return []
+
+    enc_t, enc_pos = np.array(encoder).T
+    t, x, y, intensity = np.array(samples).T
+    valid = (t >= enc_t[0]) & (t <= enc_t[-1])
+    t, x, y, intensity = t[valid], x[valid], y[valid], intensity[valid]
+    angles = np.interp(t, enc_t, enc_pos) / thor.EncCnt
+    valid = (angles >= min(start, stop)) & (angles <= max(start, stop))
+    t, angles, x, y, intensity = t[valid], angles[valid], x[valid], y[valid], intensity[valid]
+
+    if csvwriter is not None:
+        csvwriter.writerows(zip(np.round(angles, 4), x.astype(int), y.astype(int), intensity.astype(int), np.round(t - t[0], 6)))
+    if verbose:
+        print(f"{len(angles)} samples in {t[-1] - t[0]:.1f} s, "
+            f"{len(angles) / abs(stop - start):.1f} samples/deg")
+    return list(zip(angles, x.astype(int), y.astype(int), intensity.astype(int)))
+
+
+def plot_measurements(title, rows):
+    import matplotlib.pyplot as plt
+
+    angles, pointsx, pointsy, intensity = zip(*rows)
+
+    fig, axes = plt.subplots(3)
+    axes[0].plot(angles, pointsx, marker = 'o')
+    axes[0].set_ylabel('Position X')
+    axes[0].set_xlabel('Angle')
+
+    axes[0].set_ylim([-1024, 1024])
+
+    axes[1].plot(angles, pointsy, marker = 'o')
+    axes[1].set_ylabel('Position Y')
+    axes[1].set_xlabel('Angle')
+
+    axes[1].set_ylim([-1024, 1024])
+
+    axes[2].plot(angles, intensity, marker = 'o')
+    axes[2].set_ylabel('Intensity')
+    axes[2].set_xlabel('Angle')
+
+    axes[2].set_ylim([0, 1024])
+
+    fig.suptitle(title)
+
+    plt.show()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="PSD measurement tool")
+    auto_int = lambda x: int(x,0)
+    parser.add_argument('--addr', '-a', type=auto_int, default=0x4A, help="Sensor I2C address")
+    parser.add_argument('--device', '-D', default="/dev/ttyUSB0", help="Stepper motor Serial device")
+    parser.add_argument('--constant', '-c', action="store_true", help="Only do constant measurement at 0 deg")
+    parser.add_argument('--degree', '-d', type=int, default=80, help="Degree measurement max")
+    parser.add_argument('--samples', type=int, default=10, help="Samples per angle")
+    parser.add_argument('--dwell', type=float, default=0.1, help="Delay before each sample")
+    parser.add_argument('--plan', action="store_true", help="Optimize the stage velocity parameters for the step sweep")
+    parser.add_argument('--max_velocity', type=float, help="Stage velocity limit for --plan (deg/s, default: the stage's velocity parameters)")
+    parser.add_argument('--max_acceleration', type=float, help="Stage acceleration limit for --plan (deg/s^2, default: the stage's velocity parameters)")
+    parser.add_argument('--settle', type=float, default=0.0, help="Settling time after each move for --plan (s)")
+    parser.add_argument('--settle_coeff', type=float, default=0.0, help="Settling time per acceleration for --plan (s per deg/s^2). "
+                        "Required by --plan, without it the plan would always be the stage limits.")
+    parser.add_argument('--axis', choices=("x", "y"), default="x", help="Sensor axis rotated by the sweep (Y_calib captures are mirrored)")
+    parser.add_argument('--online', type=float, metavar="SIGMA", help="Interleave the angles and stop when the calibration uncertainty is below SIGMA degrees")
+    parser.add_argument('--adaptive', action="store_true", help="Coarse sweep refined where the calibration residuals are large")
+    parser.add_argument('--continuous', type=float, metavar="VELOCITY", help="Continuous sweep at given velocity (deg/s)")
+
+    parser.add_argument('-w', '--write', dest="save_path",
+                        default="meas",
+                        type=str,
+                        help="save files to folder")
+    parser.add_argument('--metrics', help="Export bus latency metrics to a file (.json or Prometheus text)")
+    parser.add_argument('--trace', help="Dump the raw bus frames to this directory on errors")
+    parser.add_argument('--metrics_interval', type=float, default=10, help="Metrics export interval in seconds")
+
+    args = parser.parse_args()
+    if args.plan and args.settle_coeff <= 0:
+        parser.error("--plan needs the settling model --settle_coeff")
+
+    if args.trace:
+        from frametrace import FrameTrace
+        PSDSunSensor.trace = ThorRotator.trace = FrameTrace(error_dir=args.trace)
+
+    exporter = None
+    if args.metrics:
+        from metrics import Metrics, MetricsExporter
+        PSDSunSensor.metrics = ThorRotator.metrics = Metrics()
+        exporter = MetricsExporter(PSDSunSensor.metrics, args.metrics, args.metrics_interval)
+        exporter.start()
+
+    info = "_psd_%x" % args.addr
+    if args.constant:
+        info += "_constant"
+    fname = datetime.datetime.now().isoformat("_") + info
+
+    # Start writing to CSV file
+    csv_fname = f"{args.save_path}/{fname}.csv"
+    if not os.path.exists(args.save_path):
+        os.makedirs(args.save_path)
+
+    print(f"Outputting to {csv_fname!r}")
+    with open(csv_fname, 'w') as csvfile:
+        # creating a csv writer object
+        csvwriter = csv.writer(csvfile)
 
-                # Store for plottin
-                angles.append(angle)
-                pointsx.append(pos.x)
-                pointsy.append(pos.y)
-                intensity.append(pos.intensity)
+        psd = PSDSunSensor(args.addr)
+        # Keep the sensor's own temperature offset unless it's in raw mode
+        temp_offset = psd.get_calibration().temp_offset or PSD_DEFAULT_TEMP_OFFSET
+        psd.set_calibration(Calibration(0, 0, 670, 1, temp_offset))
+        thor = ThorRotator(device=args.device)
 
-#np.savez_compressed(f"{args.save_path}/{fname}", angles=angles, pointsx=pointsx, pointsy=pointsy, intensity=intensity)
+        # Read the current calibration and write it to measurement file
+        calib = psd.get_calibration()
+        print(calib)
+        write_calibration(csvwriter, calib, timestamps=args.continuous is not None)
 
-fig, axes = plt.subplots(3)
-axes[0].plot(angles, pointsx, marker = 'o')
-axes[0].set_ylabel('Position X')
-axes[0].set_xlabel('Angle')
+        if args.constant:
+            print("Moving platform to 0 deg. Please wait.")
+            rows = constant_measurement(psd, thor, csvwriter)
+        elif args.adaptive:
+            import adaptive
+            rows = adaptive.adaptive_sweep(psd, thor, args.degree, csvwriter=csvwriter, samples=args.samples, dwell=args.dwell,
+                axis=args.axis)
+        elif args.continuous:
+            print("Moving platform to", -args.degree, "deg. Please wait.")
+            rows = continuous_sweep(psd, thor, -args.degree, args.degree, args.continuous, csvwriter)
+        else:
+            angles = np.arange(-args.degree, args.degree+1, 1)
+            callback = None
+            if args.online:
+                import online
+                angles = online.interleaved(angles)
+                callback = online.sweep_callback(online.OnlineCalibration(), args.online, args.degree, args.axis)
 
-axes[0].set_ylim([-1024, 1024])
+            # Plan for the final move order and the dwell of step_sweep below
+            if args.plan:
+                import planner
+                limits = planner.stage_limits(thor)
+                limits = limits._replace(max_velocity=args.max_velocity or limits.max_velocity,
+                    max_acceleration=args.max_acceleration or limits.max_acceleration)
 
-axes[1].plot(angles, pointsy, marker = 'o')
-axes[1].set_ylabel('Position Y')
-axes[1].set_xlabel('Angle')
+                # Measure the time to read one sample
+                t = time.monotonic()
+                for _ in range(5):
+                    read_point(psd)
+                read_time = (time.monotonic() - t) / 5
 
-axes[1].set_ylim([-1024, 1024])
+                sweep_plan = planner.plan(angles, args.samples, args.dwell, read_time, limits,
+                    start=thor.degrees(thor.get_position()), settle=args.settle, settle_coeff=args.settle_coeff)
+                planner.apply(thor, sweep_plan)
+                print(f"Velocity {sweep_plan.velocity:.2f} deg/s, acceleration {sweep_plan.acceleration:.2f} deg/s^2, "
+                    f"predicted sweep time {sweep_plan.predicted:.1f} s")
 
-axes[2].plot(angles, intensity, marker = 'o')
-axes[2].set_ylabel('Intensity')
-axes[2].set_xlabel('Angle')
+            print("Moving platform to", angles[0], "deg. Please wait.")
+            start = time.monotonic()
+            rows = step_sweep(psd, thor, angles, csvwriter, args.samples, args.dwell, callback=callback)
+            if args.online:
+                rows.sort()
+            if args.plan:
+                print(f"Measured sweep time {time.monotonic() - start:.1f} s (predicted {sweep_plan.predicted:.1f} s)")
 
-axes[2].set_ylim([0, 1024])
+    if exporter is not None:
+        exporter.stop()
 
-fig.suptitle("PSD %x" % args.addr)
+    #np.savez_compressed(f"{args.save_path}/{fname}", angles=angles, pointsx=pointsx, pointsy=pointsy, intensity=intensity)
 
-plt.show()
+    plot_measurements("PSD %x" % args.addr, rows)
 
-#thor.move_absolute(1, -50 * thor.EncCnt)
\ No newline at end of file
+    #thor.move_absolute(1, -50 * thor.EncCnt)
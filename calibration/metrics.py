@@ -0,0 +1,233 @@
+"""
+    Low overhead latency histograms and counters for the sensor and rotator drivers.
+
+    Instrumentation is enabled by assigning a Metrics object to the `metrics`
+    class attribute of PSDSunSensor and/or ThorRotator:
+
+        metrics = Metrics()
+        PSDSunSensor.metrics = ThorRotator.metrics = metrics
+        MetricsExporter(metrics, "bench.prom", interval=10).start()
+
+    When the attribute is None (default) the drivers only pay for a single
+    attribute check per transaction.
+"""
+
+import os
+import json
+import math
+import threading
+from typing import Dict, Optional, Tuple
+
+
+class LatencyHistogram:
+    """
+    HDR style log-linear histogram.
+
+    Values are recorded as integer nanoseconds into buckets where each power
+    of two is split to 2^sub_bucket_bits linear sub buckets, giving a constant
+    relative precision over the whole range.
+    """
+
+    def __init__(self, sub_bucket_bits: int=5):
+        self.sub_bucket_bits = sub_bucket_bits
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+
+    def _index(self, ns: int) -> int:
+        s = self.sub_bucket_bits
+        exp = ns.bit_length() - 1
+        if exp < s:
+            return ns
+        return ((exp - s + 1) << s) + (ns >> (exp - s)) - (1 << s)
+
+
+    def _lower_bound(self, index: int) -> int:
+        s = self.sub_bucket_bits
+        if index < (1 << s):
+            return index
+        exp = (index >> s) + s - 1
+        return ((index & ((1 << s) - 1)) + (1 << s)) << (exp - s)
+
+
+    def record(self, seconds: float) -> None:
+        """
+        Record a latency value in seconds.
+        """
+        idx = self._index(max(1, int(seconds * 1e9)))
+        self.counts[idx] = self.counts.get(idx, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+
+    def percentile(self, q: float) -> float:
+        """
+        Value at percentile q (0-100) in seconds.
+        """
+        counts = dict(self.counts)
+        n = sum(counts.values())
+        if n == 0:
+            return math.nan
+        target = q / 100 * n
+        cumulative = 0
+        for idx in sorted(counts):
+            cumulative += counts[idx]
+            if cumulative >= target:
+                # Middle of the bucket
+                low, high = self._lower_bound(idx), self._lower_bound(idx + 1)
+                return min((low + high) / 2e9, self.max)
+        return self.max
+
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "min": self.min if self.count else math.nan,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "p999": self.percentile(99.9),
+        }
+
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Metrics:
+    """
+    Registry of labeled latency histograms and counters.
+    """
+
+    def __init__(self):
+        self.histograms: Dict[Tuple[str, Labels], LatencyHistogram] = {}
+        self.counters: Dict[Tuple[str, Labels], int] = {}
+        self._lock = threading.Lock()
+
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        """
+        Record a latency to the histogram `name` with given labels.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        hist = self.histograms.get(key)
+        if hist is None:
+            with self._lock:
+                hist = self.histograms.setdefault(key, LatencyHistogram())
+        hist.record(seconds)
+
+
+    def count(self, name: str, value: int=1, **labels) -> None:
+        """
+        Increment the counter `name` with given labels.
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+
+    def snapshot(self) -> dict:
+        """
+        Snapshot of all the metrics as a JSON serializable dictionary.
+        """
+        def fmt(name, labels):
+            if not labels:
+                return name
+            return name + "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+        with self._lock:
+            histograms = dict(self.histograms)
+            counters = dict(self.counters)
+
+        return {
+            "histograms": { fmt(*key): hist.summary() for key, hist in histograms.items() },
+            "counters": { fmt(*key): value for key, value in counters.items() },
+        }
+
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), indent=1)
+
+
+    def to_prometheus(self) -> str:
+        """
+        Metrics in Prometheus text exposition format. Histograms are exported as summaries.
+        """
+        with self._lock:
+            histograms = dict(self.histograms)
+            counters = dict(self.counters)
+
+        def fmt(labels, **extra):
+            items = list(labels) + list(extra.items())
+            if not items:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+        lines = []
+        for name in sorted({ name for name, _ in histograms }):
+            lines.append(f"# TYPE {name} summary")
+            for (n, labels), hist in histograms.items():
+                if n != name:
+                    continue
+                for q in (0.5, 0.9, 0.99, 0.999):
+                    lines.append(f"{name}{fmt(labels, quantile=q)} {hist.percentile(100 * q):.9g}")
+                lines.append(f"{name}_sum{fmt(labels)} {hist.total:.9g}")
+                lines.append(f"{name}_count{fmt(labels)} {hist.count}")
+
+        for name in sorted({ name for name, _ in counters }):
+            lines.append(f"# TYPE {name} counter")
+            for (n, labels), value in counters.items():
+                if n == name:
+                    lines.append(f"{name}{fmt(labels)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+class MetricsExporter(threading.Thread):
+    """
+    Background thread writing metrics snapshots to a file on an interval.
+    """
+
+    def __init__(self, metrics: Metrics, path: str, interval: float=10.0, fmt: Optional[str]=None):
+        """
+        Args:
+            metrics: Metrics registry to be exported
+            path: Output file. The file is replaced atomically on every write.
+            interval: Export interval in seconds
+            fmt: "json" or "prometheus". Default is decided from the file extension.
+        """
+        super().__init__(daemon=True)
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.fmt = fmt or ("json" if path.endswith(".json") else "prometheus")
+        self._stop_event = threading.Event()
+
+
+    def write(self) -> None:
+        text = self.metrics.to_json() if self.fmt == "json" else self.metrics.to_prometheus()
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, self.path)
+
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            self.write()
+
+
+    def stop(self) -> None:
+        """
+        Stop the exporter and write the final snapshot.
+        """
+        self._stop_event.set()
+        self.write()
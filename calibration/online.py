@@ -0,0 +1,207 @@
+"""
+    Recursive calibration estimate updated during the sweep.
+
+    A step sweep rotates only one sensor axis, so the estimate covers the
+    offset of the swept axis and the height. It minimizes the same intensity
+    weighted angle residuals as plot.fit_calib
+        angle - atan((p + offset) / height)
+    After every dwell the new samples are appended and a few
+    Levenberg-Marquardt iterations are run starting from the previous estimate, so
+    each update costs only a couple of small vectorized passes over the
+    data. The residual variance is estimated from the data which gives the
+    parameter covariance and the resulting angle uncertainty at every step.
+"""
+
+from typing import Optional
+
+import numpy as np
+
+from plot import axis_data
+
+
+class OnlineCalibration:
+    """
+    Recursive weighted least squares estimate of the offset and height of one axis.
+    """
+
+    # Initial Levenberg-Marquardt damping of every update
+    DAMPING = 1e-3
+
+    def __init__(self, prior=(0.0, 670.0), min_intensity: int=50, iterations: int=5):
+        """
+        Args:
+            prior: Initial guess of [offset, height]
+            min_intensity: Samples with lower intensity are ignored
+            iterations: Maximum Levenberg-Marquardt iterations per update
+        """
+        self.params = np.asarray(prior, dtype=float)
+        self.min_intensity = min_intensity
+        self.iterations = iterations
+        self.data = np.empty((0, 3))
+        self.info = np.zeros((2, 2))
+        self.ssr = 0.0
+        self.damping = self.DAMPING
+        self.bounds = (np.array([-200, 500]), np.array([200, 1000]))
+
+
+    def _linearize(self, params):
+        angles, p, w = self.data.T
+        offset, height = params
+        u = (p + offset) / height
+        d = np.degrees(1 / (1 + u**2)) / height # d atan(u) / d offset
+        r = angles - np.degrees(np.arctan(u))
+        J = np.column_stack((d, -d * u))
+        return J, r, w
+
+
+    def update(self, angles, positions, intensity) -> np.ndarray:
+        """
+        Add samples and update the estimate.
+
+        Args:
+            angles: Angles of the swept axis in degrees
+            positions: Measured positions of the swept axis
+            intensity: Measured intensities used as weights as in plot.fit_calib
+
+        Returns:
+            Current [offset, height] estimate
+        """
+        angles, positions, intensity = (np.atleast_1d(np.asarray(a, dtype=float)) for a in (angles, positions, intensity))
+        valid = intensity >= self.min_intensity
+        if not np.any(valid):
+            return self.params
+        self.data = np.concatenate((self.data, np.column_stack((angles, positions, intensity**2))[valid]))
+
+        # Levenberg-Marquardt iterations within the plot.fit_calib bounds.
+        # A rejected step of a previous update must not stall this one.
+        self.damping = min(self.damping, self.DAMPING)
+        J, r, w = self._linearize(self.params)
+        cost = np.sum(w * r**2)
+        for _ in range(self.iterations):
+            Jw = J * w[:, None]
+            info, grad = Jw.T @ J, Jw.T @ r
+            while self.damping < 1e8:
+                step = np.linalg.lstsq(info + self.damping * np.diag(np.diag(info)), grad, rcond=None)[0]
+                params = np.clip(self.params + step, self.bounds[0], self.bounds[1])
+                J_new, r_new, _ = self._linearize(params)
+                cost_new = np.sum(w * r_new**2)
+                if cost_new <= cost:
+                    self.damping = max(self.damping / 10, 1e-6)
+                    break
+                self.damping *= 10
+            else:
+                break
+            converged = np.all(np.abs(params - self.params) < 1e-4)
+            self.params, J, r, cost = params, J_new, r_new, cost_new
+            if converged:
+                break
+
+        self.info = (J * w[:, None]).T @ J
+        self.ssr = float(cost)
+        return self.params
+
+
+    @property
+    def angles(self) -> set:
+        """
+        Distinct angles measured.
+        """
+        return set(np.round(self.data[:, 0], 3))
+
+
+    @property
+    def covariance(self) -> np.ndarray:
+        """
+        Parameter covariance with the residual variance estimated from the data.
+        """
+        dof = max(len(self.data) - 2, 1)
+        return (self.ssr / dof) * np.linalg.pinv(self.info)
+
+
+    @property
+    def sigma(self) -> np.ndarray:
+        """
+        Standard deviations of [offset, height].
+        """
+        return np.sqrt(np.diag(self.covariance))
+
+
+    def angle_sigma(self, fov: float=80.0, n: int=161) -> float:
+        """
+        Largest standard deviation of the calibrated angle over the field of
+        view caused by the parameter uncertainty.
+
+        Args:
+            fov: Half field of view in degrees
+
+        Returns:
+            Angle uncertainty in degrees
+        """
+        height = self.params[1]
+        angles = np.radians(np.linspace(-fov, fov, n))
+        t = np.tan(angles)
+        c2 = np.cos(angles)**2
+        # d angle / d offset = cos^2 / height, d angle / d height = -tan cos^2 / height
+        J = np.column_stack((c2 / height, -t * c2 / height))
+        return float(np.degrees(np.sqrt(np.max(np.einsum("ni,ij,nj->n", J, self.covariance, J)))))
+
+
+    def converged(self, target: float, fov: float=80.0, min_angles: int=5) -> bool:
+        """
+        Is the angle uncertainty below the target.
+
+        Args:
+            target: Target angle uncertainty in degrees
+            fov: Half field of view in degrees
+            min_angles: Minimum number of distinct angles measured
+        """
+        return len(self.angles) >= min_angles and self.angle_sigma(fov) < target
+
+
+def interleaved(angles) -> np.ndarray:
+    """
+    Order the angles coarse to fine (ends and middle first, then bisecting
+    the gaps) so that an early stopped sweep still covers the whole range.
+    """
+    angles = np.asarray(angles)
+    n = len(angles)
+    if n <= 2:
+        return angles
+    order = [0, n - 1]
+    seen = { 0, n - 1 }
+    intervals = [(0, n - 1)]
+    while intervals:
+        next_intervals = []
+        for lo, hi in intervals:
+            mid = (lo + hi) // 2
+            if mid not in seen:
+                seen.add(mid)
+                order.append(mid)
+            if mid - lo > 1:
+                next_intervals.append((lo, mid))
+            if hi - mid > 1:
+                next_intervals.append((mid, hi))
+        intervals = next_intervals
+    return angles[order]
+
+
+def sweep_callback(estimator: OnlineCalibration, target: Optional[float]=None, fov: float=80.0,
+        axis: str="x", verbose: bool=True):
+    """
+    Create a step_sweep callback updating the estimator after each dwell.
+    The callback returns True to stop the sweep when the target angle
+    uncertainty has been reached.
+
+    Args:
+        axis: Axis rotated by the sweep, "x" or "y"
+    """
+    def callback(angle, rows) -> bool:
+        angles, positions, intensity = axis_data(rows, axis)
+        offset, height = estimator.update(angles, positions, intensity)
+        sigma = estimator.angle_sigma(fov)
+        if verbose:
+            print(f"offset_{axis} {offset:7.2f}, height {height:7.2f}, "
+                f"angle sigma {sigma:.4f} deg after {len(estimator.angles)} angles")
+        return target is not None and estimator.converged(target, fov)
+
+    return callback
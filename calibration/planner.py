@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+    Plan the stage velocity and acceleration for a step sweep.
+
+    The move between two angles follows a trapezoidal velocity profile:
+        d >= v^2 / a:  t = d / v + v / a
+        d <  v^2 / a:  t = 2 sqrt(d / a)       (triangular, v never reached)
+
+    After each move the stage settles for settle + settle_coeff * a seconds
+    before the samples are taken. Each sample takes the dwell time and the
+    time to read the point from the sensor. The candidate settings are
+    evaluated on a grid within the stage limits and the fastest is chosen.
+
+    Without a settling time growing with the acceleration the moves only get
+    faster towards the limits, so plan() requires settle_coeff > 0. The limits
+    are the stage's own velocity parameters (see stage_limits()).
+"""
+
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from thor import ThorRotator
+
+
+class StageLimits(NamedTuple):
+    max_velocity: float # deg/s
+    max_acceleration: float # deg/s^2
+    min_velocity: float = 0.1 # deg/s
+    min_acceleration: float = 0.1 # deg/s^2
+
+
+class SweepPlan(NamedTuple):
+    velocity: float # deg/s
+    acceleration: float # deg/s^2
+    predicted: float # Predicted sweep time in seconds
+
+
+def move_time(distance, velocity, acceleration):
+    """
+    Duration of trapezoidal moves. All the arguments broadcast.
+
+    Args:
+        distance: Move distance in degrees
+        velocity: Maximum velocity in deg/s
+        acceleration: Acceleration in deg/s^2
+
+    Returns:
+        Move time in seconds
+    """
+    distance = np.abs(distance)
+    trapezoid = distance / velocity + velocity / acceleration
+    triangle = 2 * np.sqrt(distance / acceleration)
+    return np.where(distance >= velocity**2 / acceleration, trapezoid, triangle)
+
+
+def stage_limits(thor: ThorRotator, channel: int=1) -> StageLimits:
+    """
+    Read the velocity parameters configured to the stage controller as the limits.
+    """
+    velocity, acceleration = thor.get_velocity_degrees(channel)
+    return StageLimits(velocity, acceleration)
+
+
+def sweep_time(angles, velocity, acceleration, samples: int, dwell: float, read_time: float,
+        start: Optional[float]=None, settle: float=0.0, settle_coeff: float=0.0):
+    """
+    Predicted duration of a step sweep.
+
+    Args:
+        angles: Target angles in the sweep order
+        velocity: Maximum velocity (deg/s), scalar or array
+        acceleration: Acceleration (deg/s^2), scalar or array broadcasting with velocity
+        samples: Number of samples at each angle
+        dwell: Delay before each sample in seconds
+        read_time: Time to read one sample from the sensor in seconds
+        start: Stage angle before the sweep. Default is the first angle.
+        settle: Constant settling time after each move in seconds
+        settle_coeff: Settling time per unit of acceleration (s per deg/s^2)
+
+    Returns:
+        Sweep time in seconds
+    """
+    angles = np.asarray(angles, dtype=float)
+    distances = np.diff(angles, prepend=angles[0] if start is None else start)
+    distances = distances[distances != 0]
+
+    velocity = np.asarray(velocity, dtype=float)[..., None]
+    acceleration = np.asarray(acceleration, dtype=float)[..., None]
+    moves = np.sum(move_time(distances, velocity, acceleration), axis=-1)
+    settling = len(distances) * (settle + settle_coeff * acceleration[..., 0])
+    return moves + settling + len(angles) * samples * (dwell + read_time)
+
+
+def plan(angles, samples: int, dwell: float, read_time: float, limits: StageLimits,
+        start: Optional[float]=None, settle: float=0.0, settle_coeff: float=0.0, grid: int=50) -> SweepPlan:
+    """
+    Find the velocity and acceleration minimizing the sweep time.
+
+    Args:
+        angles: Target angles in the sweep order
+        samples: Number of samples at each angle
+        dwell: Delay before each sample in seconds
+        read_time: Time to read one sample from the sensor in seconds
+        limits: Stage limits
+        start: Stage angle before the sweep
+        settle: Constant settling time after each move in seconds
+        settle_coeff: Settling time per unit of acceleration (must be positive)
+        grid: Number of candidates per parameter
+
+    Returns:
+        SweepPlan of the fastest candidate
+    """
+    if settle_coeff <= 0:
+        raise ValueError("Without settle_coeff the fastest plan is always the stage limits")
+
+    v = np.geomspace(limits.min_velocity, limits.max_velocity, grid)
+    a = np.geomspace(limits.min_acceleration, limits.max_acceleration, grid)
+    vv, aa = np.meshgrid(v, a, indexing="ij")
+    t = sweep_time(angles, vv, aa, samples, dwell, read_time, start, settle, settle_coeff)
+    i = np.unravel_index(np.argmin(t), t.shape)
+    return SweepPlan(float(vv[i]), float(aa[i]), float(t[i]))
+
+
+def apply(thor: ThorRotator, sweep_plan: SweepPlan, channel: int=1) -> None:
+    """
+    Set the planned velocity parameters to the stage.
+    """
+    thor.set_velocity_degrees(channel, sweep_plan.velocity, sweep_plan.acceleration)
+
+
+if __name__ == "__main__":
+    import argparse
+    from psd import PSDSunSensor, PSD_CMD_GET_POINT
+
+    parser = argparse.ArgumentParser(description="Step sweep velocity planner")
+    parser.add_argument('--degree', '-d', type=float, default=80, help="Sweep range in degrees")
+    parser.add_argument('--step', type=float, default=1, help="Angle step in degrees")
+    parser.add_argument('--start', type=float, help="Stage angle before the sweep")
+    parser.add_argument('--samples', type=int, default=10, help="Samples per angle")
+    parser.add_argument('--dwell', type=float, default=0.1, help="Delay before each sample in seconds")
+    parser.add_argument('--read_time', type=float, default=PSDSunSensor.conversion_delay[PSD_CMD_GET_POINT],
+        help="Time to read one sample in seconds (default: the sensor conversion delay)")
+    parser.add_argument('--device', '-D', help="Read the stage limits from the rotator on this serial device")
+    parser.add_argument('--max_velocity', type=float, help="Stage velocity limit (deg/s) if no --device")
+    parser.add_argument('--max_acceleration', type=float, help="Stage acceleration limit (deg/s^2) if no --device")
+    parser.add_argument('--settle', type=float, default=0.0, help="Settling time after each move (s)")
+    parser.add_argument('--settle_coeff', type=float, required=True, help="Settling time per acceleration (s per deg/s^2)")
+    args = parser.parse_args()
+
+    if args.device:
+        limits = stage_limits(ThorRotator(device=args.device))
+    elif args.max_velocity and args.max_acceleration:
+        limits = StageLimits(args.max_velocity, args.max_acceleration)
+    else:
+        parser.error("Give the stage limits with --device or --max_velocity and --max_acceleration")
+
+    angles = np.arange(-args.degree, args.degree + args.step / 2, args.step)
+    best = plan(angles, args.samples, args.dwell, args.read_time, limits, args.start, args.settle, args.settle_coeff)
+    current = sweep_time(angles, limits.max_velocity, limits.max_acceleration, args.samples, args.dwell,
+        args.read_time, args.start, args.settle, args.settle_coeff)
+
+    print(f"Velocity {best.velocity:.3f} deg/s, acceleration {best.acceleration:.3f} deg/s^2")
+    print(f"Predicted sweep time {best.predicted:.1f} s (at the limits {float(current):.1f} s)")
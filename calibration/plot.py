@@ -2,37 +2,115 @@
 import sys
 import csv
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.optimize import minimize
 
 
-def calc_calib(name, angles, x_points, y_points, x_intensities, y_intensities):
+# Stage angle sign of the single axis captures. The Y_calib captures are
+# mirrored, which the main below undoes by flipping the Y data.
+AXIS_SIGN = { "x": 1, "y": -1 }
+
+
+def fit_calib(x_angles, y_angles, x_points, y_points, x_intensities, y_intensities, disp=False, x0=(0, 0, 700)):
+    """
+    Fit offset_x, offset_y and height to the measurements.
+
+    Args:
+        x_angles, y_angles: Stage angles of the X and Y measurements. The axes
+            are swept separately, so the angles and their counts may differ.
+        x0: Initial guess of [offset_x, offset_y, height]
+
+    Returns:
+        scipy.optimize.OptimizeResult where x is [offset_x, offset_y, height]
+    """
+    from scipy.optimize import minimize
+
+    x_angles, y_angles = np.asarray(x_angles, dtype=float), np.asarray(y_angles, dtype=float)
+    x_points, y_points = np.asarray(x_points, dtype=float), np.asarray(y_points, dtype=float)
+    x_weights = np.asarray(x_intensities, dtype=float)**2
+    y_weights = np.asarray(y_intensities, dtype=float)**2
+    x_tan, y_tan = np.tan(np.radians(x_angles)), np.tan(np.radians(y_angles))
 
     def fit_position(x):
-        x_calculated = x[2] * np.tan(np.radians(angles)) + x[0]
-        y_calculated = x[2] * np.tan(np.radians(angles)) + x[1]
+        x_calculated = x[2] * x_tan + x[0]
+        y_calculated = x[2] * y_tan + x[1]
 
-        return sum(( x_intensities * (x_points - x_calculated) )**2.0)  + \
-               sum(( y_intensities * (y_points - y_calculated) )**2.0)
+        return np.dot(x_weights, (x_points - x_calculated)**2) + \
+               np.dot(y_weights, (y_points - y_calculated)**2)
 
     def fit_angle(x):
         x_calculated = np.degrees(np.arctan((x_points + x[0]) / x[2]))
         y_calculated = np.degrees(np.arctan((y_points + x[1]) / x[2]))
 
-        return sum(( x_intensities * (angles - x_calculated) )**2.0)  + \
-               sum(( y_intensities * (angles - y_calculated) )**2.0)
+        return np.dot(x_weights, (x_angles - x_calculated)**2) + \
+               np.dot(y_weights, (y_angles - y_calculated)**2)
 
 
-    res = minimize(fit_angle,
-        x0=[0, 0, 700],
+    return minimize(fit_angle,
+        x0=list(x0),
         method='Nelder-Mead',
-        options={'xatol': 1e-8, 'maxfev': 2000, 'disp': True},
+        options={'xatol': 1e-8, 'maxfev': 2000, 'disp': disp},
         bounds=(
             (-200, 200),
             (-200, 200),
             (500, 1000)
         ),
     )
+
+
+def fit_axis(angles, points, intensities, disp=False, x0=(0, 700)):
+    """
+    Fit the offset and height of one axis to a single axis sweep.
+
+    Args:
+        angles: Angles of the swept axis, e.g. from axis_data()
+        x0: Initial guess of [offset, height]
+
+    Returns:
+        scipy.optimize.OptimizeResult where x is [offset, height]
+    """
+    from scipy.optimize import minimize
+
+    angles = np.asarray(angles, dtype=float)
+    points = np.asarray(points, dtype=float)
+    weights = np.asarray(intensities, dtype=float)**2
+
+    def fit_angle(x):
+        calculated = np.degrees(np.arctan((points + x[0]) / x[1]))
+        return np.dot(weights, (angles - calculated)**2)
+
+    # The default simplex barely moves a zero offset guess and stalls
+    simplex = np.array([x0, x0, x0], dtype=float) + [[0, 0], [20, 0], [0, 50]]
+    return minimize(fit_angle,
+        x0=list(x0),
+        method='Nelder-Mead',
+        options={'xatol': 1e-8, 'maxfev': 2000, 'disp': disp, 'initial_simplex': simplex},
+        bounds=(
+            (-200, 200),
+            (500, 1000)
+        ),
+    )
+
+
+def axis_data(rows, axis: str="x"):
+    """
+    Swept axis of a single axis capture. Only one axis moves during a sweep,
+    so only its offset and the height can be fitted from the capture.
+
+    Args:
+        rows: List of (angle, x, y, intensity) tuples
+        axis: Swept axis, "x" or "y"
+
+    Returns:
+        Tuple of (angles, positions, intensities) arrays. The angles are
+        mirrored for the Y axis like in the main below.
+    """
+    angles, x, y, intensity = np.array(rows, dtype=float).reshape(-1, 4).T
+    return AXIS_SIGN[axis] * angles, (x if axis == "x" else y), intensity
+
+
+def calc_calib(name, x_angles, y_angles, x_points, y_points, x_intensities, y_intensities):
+    import matplotlib.pyplot as plt
+
+    res = fit_calib(x_angles, y_angles, x_points, y_points, x_intensities, y_intensities, disp=True)
     offset_x, offset_y, height = res.x
     print(res)
     print()
@@ -44,21 +122,21 @@ def calc_calib(name, angles, x_points, y_points, x_intensities, y_intensities):
     print(f"{height=}")
     print("\n")
 
-    x_calculated = height * np.tan(np.radians(angles)) - offset_x
-    y_calculated = height * np.tan(np.radians(angles)) - offset_y
+    x_calculated = height * np.tan(np.radians(x_angles)) - offset_x
+    y_calculated = height * np.tan(np.radians(y_angles)) - offset_y
 
     # X measured points and calculated points
     fig, axes = plt.subplots(3, 2, num=name, figsize=(16,9))
-    axes[0,0].scatter(angles, x_points, marker = 'o')
-    axes[0,0].plot(angles, x_calculated, "r")
+    axes[0,0].scatter(x_angles, x_points, marker = 'o')
+    axes[0,0].plot(x_angles, x_calculated, "r")
     axes[0,0].set_ylabel('Position X')
     axes[0,0].set_xlabel('Angle [deg]')
     axes[0,0].set_ylim([-1024, 1024])
     axes[0,0].set_title("X-axis")
 
     # Y measured points and calculated points
-    axes[0,1].scatter(angles, y_points, marker = 'o')
-    axes[0,1].plot(angles, y_calculated, "r")
+    axes[0,1].scatter(y_angles, y_points, marker = 'o')
+    axes[0,1].plot(y_angles, y_calculated, "r")
     axes[0,1].set_ylabel('Position Y')
     axes[0,1].set_xlabel('Angle [deg]')
     axes[0,1].set_ylim([-1024, 1024])
@@ -66,7 +144,7 @@ def calc_calib(name, angles, x_points, y_points, x_intensities, y_intensities):
 
     # X error graph
     calculated_angle = np.degrees(np.arctan((x_points + offset_x) / height))
-    axes[1,0].scatter(angles, angles - calculated_angle, marker = 'o')
+    axes[1,0].scatter(x_angles, x_angles - calculated_angle, marker = 'o')
     axes[1,0].set_ylabel('X Angle error')
     axes[1,0].set_xlabel('Angle [deg]')
     axes[1,0].set_ylim([-10, 10])
@@ -74,20 +152,20 @@ def calc_calib(name, angles, x_points, y_points, x_intensities, y_intensities):
 
     # Y error graph
     calculated_angle = np.degrees(np.arctan((y_points + offset_y) / height))
-    axes[1,1].scatter(angles, angles - calculated_angle, marker = 'o')
+    axes[1,1].scatter(y_angles, y_angles - calculated_angle, marker = 'o')
     axes[1,1].set_ylabel('Y Angle error')
     axes[1,1].set_xlabel('Angle [deg]')
     axes[1,1].set_ylim([-10, 10])
     axes[1,1].grid(True)
 
     # X intensity
-    axes[2,0].plot(angles, x_intensities, marker = 'o')
+    axes[2,0].plot(x_angles, x_intensities, marker = 'o')
     axes[2,0].set_ylabel('X Intensity')
     axes[2,0].set_xlabel('Angle [deg]')
     axes[2,0].set_ylim([0, 1024])
 
     # Y intensity
-    axes[2,1].plot(angles, y_intensities, marker = 'o')
+    axes[2,1].plot(y_angles, y_intensities, marker = 'o')
     axes[2,1].set_ylabel('Y Intensity')
     axes[2,1].set_xlabel('Angle [deg]')
     axes[2,1].set_ylim([0, 1024])
@@ -111,7 +189,7 @@ def read_sunsensor_csv(fname):
         next(csvFile)
         # displaying the contents of the CSV file
         for lines in csvFile:
-            angles.append(int(lines[0]))
+            angles.append(float(lines[0]))
             pointsx.append(int(lines[1]))
             pointsy.append(int(lines[2]))
             intensity.append(int(lines[3]))
@@ -119,19 +197,51 @@ def read_sunsensor_csv(fname):
     return np.array(angles), np.array(pointsx), np.array(pointsy), np.array(intensity)
 
 
+def y_capture(fname):
+    """
+    Name of the Y_calib capture paired with an X_calib capture.
+    """
+    if "X_calib" not in fname:
+        raise ValueError(f"Can't find the Y_calib capture of {fname!r}")
+    return fname.replace("X_calib", "Y_calib")
+
+
+def read_capture_pair(fname, y_fname=None):
+    """
+    Read an X_calib capture and its Y_calib counterpart like the main below.
+
+    Args:
+        fname: X_calib capture file
+        y_fname: Y_calib capture file. Default is fname with X_calib replaced by Y_calib.
+
+    Returns:
+        Tuple of (x angles, y angles, x positions, y positions, x intensities,
+        y intensities) in the argument order of fit_calib. The Y data is
+        mirrored and flipped like the main below. The captures may have
+        different angles, e.g. continuous or adaptive sweeps.
+    """
+    if y_fname is None:
+        y_fname = y_capture(fname)
+
+    x_angles, points_xx, _, intensity_x = read_sunsensor_csv(fname)
+    y_angles, _, points_yy, intensity_y = read_sunsensor_csv(y_fname)
+    return x_angles, -y_angles[::-1], points_xx, points_yy[::-1], intensity_x, intensity_y[::-1]
+
+
 if __name__ == "__main__":
     name = sys.argv[1]
     angles, points_xx, points_xy, intensity_x = read_sunsensor_csv(name)
-    angles, points_yx, points_yy, intensity_y = read_sunsensor_csv(name.replace("X_calib", "Y_calib"))
+    y_angles, points_yx, points_yy, intensity_y = read_sunsensor_csv(name.replace("X_calib", "Y_calib"))
 
     # flipping the y data so that fitting is easier
     #points_xx = points_xx[::-1]
     #points_xy = points_xy[::-1]
     #intensity_x = intensity_x[::-1]
 
+    y_angles = -y_angles[::-1]
     points_yx = points_yx[::-1]
     points_yy = points_yy[::-1]
     intensity_y = intensity_y[::-1]
 
-    calc_calib(name, angles, points_xx, points_yy, intensity_x, intensity_y)
+    calc_calib(name, angles, y_angles, points_xx, points_yy, intensity_x, intensity_y)
 
@@ -3,20 +3,30 @@
     Control PSD Sun Sensor over FTDI 232H USB interface cable.
 """
 
+import os
 import sys
+import json
 import time
+import random
 import struct
-from typing import List, NamedTuple, Tuple, Union
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
 
 from pyftdi.i2c import I2cController, I2cPort, I2cNackError
 
+from frametrace import TRACE_I2C, TRACE_TX, TRACE_RX
+
 
 __all__ = [
     "RawMeasurement",
     "PointMeasurement",
-    "VectorMeasurement"
+    "VectorMeasurement",
     "AngleMeasurement",
     "Calibration",
+    "BurstMeasurement",
+    "LatchedMeasurement",
+    "ProfileProbe",
+    "ProfileStats",
+    "Status",
 ]
 
 
@@ -28,6 +38,9 @@ PSD_CMD_GET_VECTOR      = 0x05
 PSD_CMD_GET_ANGLES      = 0x06
 PSD_CMD_GET_ALL         = 0x07
 PSD_CMD_GET_TEMPERATURE = 0x08
+PSD_CMD_GET_BURST       = 0x09
+PSD_CMD_TRIGGER         = 0x0C
+PSD_CMD_GET_LATCHED     = 0x0D
 PSD_CMD_SET_CALIBRATION = 0x10
 PSD_CMD_GET_CALIBRATION = 0x11
 PSD_CMD_SET_I2C_ADDRESS = 0xE8
@@ -41,11 +54,53 @@ PSD_RSP_VECTOR          = 0xF5
 PSD_RSP_ANGLES          = 0xF6
 PSD_RSP_ALL             = 0xF7
 PSD_RSP_TEMPERATURE     = 0xF8
+PSD_RSP_BURST           = 0xF9
+PSD_RSP_LATCHED         = 0xFC
 PSD_RSP_CALIBRATION     = 0xFA
 PSD_RSP_UNKNOWN_COMMAND = 0xFD
 PSD_RSP_INVALID_PARAM   = 0xFE
 PSD_RSP_ERROR           = 0xFF
 
+# Burst record formats
+PSD_BURST_RAW           = 0x00
+PSD_BURST_POINT         = 0x01
+
+# Burst record fields (NumPy dtype descriptions) and the max records in one burst
+PSD_BURST_FIELDS = {
+    PSD_BURST_RAW: [("x1", "<u2"), ("x2", "<u2"), ("y1", "<u2"), ("y2", "<u2")],
+    PSD_BURST_POINT: [("x", "<i2"), ("y", "<i2"), ("intensity", "<u2")],
+}
+PSD_BURST_MAX = { PSD_BURST_RAW: 15, PSD_BURST_POINT: 20 }
+
+# ADC time of one sample of the four channels: 16 sample-and-hold and 11
+# conversion clocks per channel from ACLK (ADCSSEL_1 = REFOCLK 32768 Hz)
+PSD_ADC_SAMPLE_TIME     = 4 * (16 + 11) / 32768
+
+# Measurement age clock (Timer_B1 on ACLK). PROFILING builds run the timer
+# from SMCLK and report its clock, measured at startup, in the status response.
+PSD_TIMESTAMP_CLOCK_HZ  = 32768
+
+# I2C general call address for the broadcast trigger
+PSD_GENERAL_CALL_ADDRESS = 0x00
+
+# Firmware profiling probes in the extended status response (PROFILING build)
+PSD_PROFILE_PROBES = ("adc", "position", "atan", "command")
+
+# Default FTDI 232H device URL
+PSD_DEFAULT_URL = "ftdi://ftdi:232h/1"
+
+# I2C bus frequency used when the bus has not been tuned (see i2ctune.py)
+PSD_DEFAULT_FREQUENCY = 50e3
+
+# Bus frequencies selected by i2ctune.py for each FTDI URL
+PSD_TUNING_FILE = os.path.expanduser("~/.psd_i2c.json")
+
+# Firmware default temperature sensor offset (see calibration_t in main.c)
+PSD_DEFAULT_TEMP_OFFSET = 662
+
+# Command names for diagnostics
+PSD_COMMAND_NAMES = { v: k[8:] for k, v in list(globals().items()) if k.startswith("PSD_CMD_") }
+
 
 # Structures for data
 class RawMeasurement(NamedTuple):
@@ -93,6 +148,52 @@ class Calibration(NamedTuple):
     samples: int
     temp_offset: int
 
+class BurstMeasurement(NamedTuple):
+    """
+    Records sampled back to back by the sensor.
+    """
+    sequence: int # Burst sequence number (incremented by the sensor for each burst)
+    samples: "numpy.ndarray" # Structured array with PSD_BURST_FIELDS of the format
+
+class ProfileProbe(NamedTuple):
+    """
+    Firmware cycle counters of one profiling probe. The counters are
+    cumulative since reset and wrap around.
+    """
+    count: int # Number of measurements (16-bit)
+    last: int # Cycles of the last measurement
+    min: int
+    max: int
+    total: int # Sum of the cycles (32-bit)
+
+class ProfileStats(NamedTuple):
+    """
+    Profiling probe statistics over an interval.
+    """
+    count: int # Number of measurements in the interval
+    mean: float # Mean cycles in the interval
+    last: int
+    min: int # Since reset
+    max: int # Since reset
+
+class Status(NamedTuple):
+    """
+    Sensor status
+    """
+    sleeping: bool
+    clock: int # Timestamp and profiling timer clock (Hz) of the firmware build
+    profile: Optional[Dict[str, ProfileProbe]] # None if the firmware is not a profiling build
+
+class LatchedMeasurement(NamedTuple):
+    """
+    Measurement latched by a broadcast trigger
+    """
+    sequence: int # Trigger tag
+    age: float # Time since the trigger in seconds
+    raw: RawMeasurement
+    point: PointMeasurement
+    angles: AngleMeasurement
+
 
 
 class PSDSunSensor:
@@ -100,7 +201,25 @@ class PSDSunSensor:
     Class to communicate to single PSD Sun Sensor over I2C.
     """
 
-    def __init__(self, addr: int, i2c: I2cController = None):
+    # Time in seconds to wait for the sensor to sample before reading the response
+    conversion_delay = {
+        PSD_CMD_GET_RAW: 0.01,
+        PSD_CMD_GET_POINT: 0.01,
+        PSD_CMD_GET_VECTOR: 0.01,
+        PSD_CMD_GET_ANGLES: 0.02,
+        PSD_CMD_GET_ALL: 0.2,
+        PSD_CMD_GET_BURST: 0.001, # Per record on top of the ADC time (see burst_delay)
+        PSD_CMD_TRIGGER: 0.02,
+        PSD_CMD_SET_I2C_ADDRESS: 0.01,
+    }
+
+    # Optional metrics.Metrics object for latency histograms and counters
+    metrics = None
+
+    # Optional frametrace.FrameTrace object for recording the raw frames
+    trace = None
+
+    def __init__(self, addr: int, i2c: I2cController = None, url: str = PSD_DEFAULT_URL, frequency: float = None):
         """
         Initialize connection to PSD Sun Sensor
         aka opens FTDI 232H I2C controller and and I2C port for the sensor.
@@ -109,14 +228,101 @@ class PSDSunSensor:
             addr: Sensor I2C address
             i2c: FTDI I2C Controller object. If not given a new controller
                 object will be initialized with default values.
+            url: FTDI device URL for the new controller object.
+            frequency: I2C bus frequency for the new controller object.
+                Default is the tuned frequency of the URL (see tuned_frequency).
         """
         if i2c is None:
-            i2c = I2cController()
-            i2c.configure("ftdi://ftdi:232h/1", frequency=50e3)
+            i2c = open_i2c(url, frequency)
+        self.addr = addr
+        self.clock = None # Timer clock of the firmware build, read from the status when needed
+        self.samples = None # ADC samples per measurement, read from the calibration when needed
         self._i2c = i2c
         self._port = i2c.get_port(addr)
 
 
+    def _command(self, request: bytes, response_code: int, response_len: int, delay: float=None) -> bytes:
+        """
+        Send a command and read the response.
+
+        Args:
+            request: Command code followed by the parameters.
+            response_code: Expected response code. None accepts any code.
+            response_len: Length of the response in bytes.
+            delay: Conversion delay. Default is from conversion_delay.
+
+        Returns:
+            The response including the response code.
+        """
+        metrics = self.metrics
+        if metrics is None:
+            return self._transfer(request, response_code, response_len, delay)
+
+        labels = {
+            "addr": f"0x{self.addr:02x}",
+            "cmd": PSD_COMMAND_NAMES.get(request[0], f"0x{request[0]:02x}"),
+        }
+        metrics.count("psd_tx_bytes_total", len(request), **labels)
+        start = time.perf_counter()
+        try:
+            rsp = self._transfer(request, response_code, response_len, delay)
+        except Exception as e:
+            metrics.count("psd_errors_total", type=type(e).__name__, **labels)
+            raise
+        metrics.observe("psd_command_seconds", time.perf_counter() - start, **labels)
+        metrics.count("psd_rx_bytes_total", len(rsp), **labels)
+        return rsp
+
+
+    def _transfer(self, request: bytes, response_code: int, response_len: int, delay: float=None) -> bytes:
+        """
+        Write the request, wait for the conversion and read the response.
+        """
+        trace = self.trace
+        try:
+            if trace is not None:
+                trace.record(TRACE_I2C, TRACE_TX, self.addr, request)
+            self._port.write(request)
+
+            if delay is None:
+                delay = self.conversion_delay.get(request[0])
+            if delay:
+                time.sleep(delay)
+
+            rsp = self._port.read(response_len)
+            if trace is not None:
+                trace.record(TRACE_I2C, TRACE_RX, self.addr, rsp)
+            if response_code is not None and rsp[0] != response_code:
+                raise RuntimeError(f"Sensor responded error 0x{rsp[0]:02x}")
+            return rsp
+        except Exception:
+            if trace is not None:
+                trace.error()
+            raise
+
+
+    def get_status(self) -> Status:
+        """
+        Read sensor status including the firmware profiling counters.
+
+        Returns:
+            A Status object
+        """
+
+        # Non-profiling firmware answers with one byte and feeds 0xFF for the rest
+        rsp = self._command(struct.pack("B", PSD_CMD_STATUS), None, 6 + 18 * len(PSD_PROFILE_PROBES))
+        if rsp[0] not in (PSD_RSP_OK, PSD_RSP_SLEEP):
+            raise RuntimeError(f"Sensor responded error 0x{rsp[0]:02x}")
+
+        clock, profile = PSD_TIMESTAMP_CLOCK_HZ, None
+        if rsp[1] == len(PSD_PROFILE_PROBES):
+            clock, = struct.unpack_from("<I", rsp, 2)
+            profile = { name: ProfileProbe(*struct.unpack_from("<HIIII", rsp, 6 + 18 * i))
+                for i, name in enumerate(PSD_PROFILE_PROBES) }
+        self.clock = clock
+        return Status(rsp[0] == PSD_RSP_SLEEP, clock, profile)
+
+
     def get_raw(self) -> RawMeasurement:
         """
         Read raw measurements from the sun sensor.
@@ -125,12 +331,7 @@ class PSDSunSensor:
             A RawMeasurement object
         """
 
-        self._port.write(struct.pack("B", PSD_CMD_GET_RAW))
-        time.sleep(0.01)
-
-        rsp = self._port.read(9)
-        if rsp[0] != PSD_RSP_RAW:
-            raise RuntimeError(f"Sensor responded error 0x{rsp[0]:02x}")
+        rsp = self._command(struct.pack("B", PSD_CMD_GET_RAW), PSD_RSP_RAW, 9)
         return RawMeasurement(*struct.unpack("<xHHHH", rsp))
 
 
@@ -142,12 +343,7 @@ class PSDSunSensor:
             A PointMeasurement object
         """
 
-        self._port.write(struct.pack("B", PSD_CMD_GET_POINT))
-        time.sleep(0.01)
-
-        rsp = self._port.read(7)
-        if rsp[0] != PSD_RSP_POINT:
-            raise RuntimeError(f"Sensor responded error 0x{rsp[0]:02x}")
+        rsp = self._command(struct.pack("B", PSD_CMD_GET_POINT), PSD_RSP_POINT, 7)
         return PointMeasurement(*struct.unpack("<xhhH", rsp))
 
 
@@ -159,12 +355,7 @@ class PSDSunSensor:
             A VectorMeasurement object
         """
 
-        self._port.write(struct.pack("B", PSD_CMD_GET_VECTOR))
-        time.sleep(0.01)
-
-        rsp = self._port.read(9)
-        if rsp[0] != PSD_RSP_VECTOR:
-            raise RuntimeError(f"Sensor responded error 0x{rsp[0]:02x}")
+        rsp = self._command(struct.pack("B", PSD_CMD_GET_VECTOR), PSD_RSP_VECTOR, 9)
         return VectorMeasurement(*struct.unpack("<xhhhH", rsp))
 
 
@@ -176,12 +367,7 @@ class PSDSunSensor:
             A AngleMeasurement object
         """
 
-        self._port.write(struct.pack("B", PSD_CMD_GET_ANGLES))
-        time.sleep(0.02)
-
-        rsp = self._port.read(7)
-        if rsp[0] != PSD_RSP_ANGLES:
-            raise RuntimeError(f"Sensor responded error 0x{rsp[0]:02x}")
+        rsp = self._command(struct.pack("B", PSD_CMD_GET_ANGLES), PSD_RSP_ANGLES, 7)
         meas = struct.unpack("<xHHH", rsp)
         return AngleMeasurement(meas[0] / 10, meas[1] / 10, meas[2])
 
@@ -194,12 +380,7 @@ class PSDSunSensor:
             A tuple containing RawMeasurement, PointMeasurement and AngleMeasurement object
         """
 
-        self._port.write(struct.pack("B", PSD_CMD_GET_ALL))
-        time.sleep(0.2)
-
-        rsp = self._port.read(21)
-        if rsp[0] != PSD_RSP_ALL:
-            raise RuntimeError(f"Sensor responded error 0x{rsp[0]:02x}")
+        rsp = self._command(struct.pack("B", PSD_CMD_GET_ALL), PSD_RSP_ALL, 21)
 
         raw   =   RawMeasurement(*struct.unpack("<HHHH", rsp[1:9]))
         point = PointMeasurement(*struct.unpack("<hhH",  rsp[9:15]))
@@ -207,6 +388,76 @@ class PSDSunSensor:
         return raw, point, angle
 
 
+    def timer_clock(self) -> int:
+        """
+        Get the clock of the firmware timer counting the measurement ages and
+        the profiling cycles. The status is read once to find out the build.
+        """
+        if self.clock is None:
+            self.get_status()
+        return self.clock
+
+
+    def get_latched(self) -> LatchedMeasurement:
+        """
+        Read the measurement latched by the last broadcast trigger (see PSDGroup).
+
+        Returns:
+            A LatchedMeasurement object with the trigger tag as the sequence number,
+            the time since the trigger as the age and the angles in degrees
+        """
+
+        rsp = self._command(struct.pack("B", PSD_CMD_GET_LATCHED), PSD_RSP_LATCHED, 25)
+        tag, age = struct.unpack_from("<HH", rsp, 1)
+        ax, ay, intensity = struct.unpack_from("<hhH", rsp, 19)
+        return LatchedMeasurement(tag, age / self.timer_clock(),
+            RawMeasurement(*struct.unpack_from("<HHHH", rsp, 5)),
+            PointMeasurement(*struct.unpack_from("<hhH", rsp, 13)),
+            AngleMeasurement(ax / 10, ay / 10, intensity))
+
+
+    def get_burst(self, count: int, fmt: int=PSD_BURST_POINT) -> BurstMeasurement:
+        """
+        Read a burst of records sampled back to back in one transaction.
+
+        Args:
+            count: Number of records (1 to PSD_BURST_MAX[fmt])
+            fmt: Record format PSD_BURST_RAW or PSD_BURST_POINT
+
+        Returns:
+            A BurstMeasurement object with the records in a NumPy structured array
+        """
+        import numpy as np
+
+        if not 1 <= count <= PSD_BURST_MAX[fmt]:
+            raise ValueError(f"Invalid burst length {count}")
+
+        dtype = np.dtype(PSD_BURST_FIELDS[fmt])
+        rsp = self._command(struct.pack("BBB", PSD_CMD_GET_BURST, count, fmt), PSD_RSP_BURST,
+            4 + count * dtype.itemsize, self.burst_delay(count))
+
+        sequence, n = struct.unpack_from("<HB", rsp, 1)
+        if n != count:
+            raise RuntimeError(f"Sensor returned {n} records instead of {count}")
+        return BurstMeasurement(sequence, np.frombuffer(rsp, dtype=dtype, offset=4))
+
+
+    def burst_delay(self, count: int) -> float:
+        """
+        Time for the sensor to sample a burst of count records. Each record
+        is averaged from the calibrated number of ADC samples, which is read
+        once from the sensor. Zero without a PSD_CMD_GET_BURST conversion delay.
+        """
+        overhead = self.conversion_delay.get(PSD_CMD_GET_BURST)
+        if overhead is None:
+            return 0.0
+        if self.samples is None:
+            self.get_calibration()
+        # read_voltage_channels() runs one sample for values out of 1..8
+        samples = self.samples if 0 < self.samples <= 8 else 1
+        return count * (samples * PSD_ADC_SAMPLE_TIME + overhead)
+
+
 
     def get_temperature(self) -> float:
         """
@@ -216,11 +467,7 @@ class PSDSunSensor:
             Temperature reading in Celcius degrees.
         """
 
-        self._port.write(struct.pack("B", PSD_CMD_GET_TEMPERATURE))
-
-        rsp = self._port.read(3)
-        if rsp[0] != PSD_RSP_TEMPERATURE:
-            raise RuntimeError(f"Sensor responded error 0x{rsp[0]:02x}")
+        rsp = self._command(struct.pack("B", PSD_CMD_GET_TEMPERATURE), PSD_RSP_TEMPERATURE, 3)
         return struct.unpack("<xh", rsp)[0] / 10.0
 
 
@@ -235,12 +482,8 @@ class PSDSunSensor:
             set_calibration(sensor, Calibration(offset_x=0, offset_y=0, height=670, samples=1, temp_offset=650))
         """
 
-        self._port.write(struct.pack("<Bhhhhh", PSD_CMD_SET_CALIBRATION, *calib))
-        #time.sleep(0.05)
-
-        rsp = self._port.read(1)
-        if rsp[0] != PSD_RSP_OK:
-            raise RuntimeError(f"Sensor responded error 0x{rsp[0]:02x}")
+        self._command(struct.pack("<Bhhhhh", PSD_CMD_SET_CALIBRATION, *calib), PSD_RSP_OK, 1)
+        self.samples = Calibration(*calib).samples
 
 
     def get_calibration(self) -> Calibration:
@@ -251,13 +494,10 @@ class PSDSunSensor:
             A Calibration object
         """
 
-        self._port.write(struct.pack("B", PSD_CMD_GET_CALIBRATION))
-        #time.sleep(0.05)
-
-        rsp = self._port.read(11)
-        if rsp[0] != PSD_RSP_CALIBRATION:
-            raise RuntimeError(f"Sensor responded error 0x{rsp[0]:02x}")
-        return Calibration(*struct.unpack("<xhhhhh", rsp))
+        rsp = self._command(struct.pack("B", PSD_CMD_GET_CALIBRATION), PSD_RSP_CALIBRATION, 11)
+        calib = Calibration(*struct.unpack("<xhhhhh", rsp))
+        self.samples = calib.samples
+        return calib
 
 
     def set_lut(self, lut: List[int]) -> None:
@@ -287,12 +527,154 @@ class PSDSunSensor:
             addr: I2C address (from 0x00 to 0x7F)
         """
 
-        self._port.write(struct.pack("BB", PSD_CMD_SET_I2C_ADDRESS, addr))
-        time.sleep(0.01)
+        self._command(struct.pack("BB", PSD_CMD_SET_I2C_ADDRESS, addr), PSD_RSP_OK, 1)
 
-        rsp = self._port.read(1)
-        if rsp[0] != PSD_RSP_OK:
-            raise RuntimeError(f"Sensor responded error 0x{rsp[0]:02x}")
+
+class PSDGroup:
+    """
+    Sensors on one bus sampled simultaneously. A trigger broadcast to the I2C
+    general call address makes every sensor sample at the same instant and
+    latch the result, which is then collected from each sensor in turn.
+    """
+
+    def __init__(self, addresses: Iterable[int], i2c: I2cController = None, url: str = PSD_DEFAULT_URL,
+            frequency: float = None):
+        """
+        Args:
+            addresses: Sensor I2C addresses
+            i2c: FTDI I2C Controller object. If not given a new controller
+                object will be initialized with default values.
+            url: FTDI device URL for the new controller object.
+            frequency: I2C bus frequency for the new controller object.
+        """
+        if i2c is None:
+            i2c = open_i2c(url, frequency)
+        self.sensors = [ PSDSunSensor(addr, i2c) for addr in addresses ]
+        self._broadcast = i2c.get_port(PSD_GENERAL_CALL_ADDRESS)
+        # Random start so that results latched in an earlier session are not mistaken as new
+        self.tag = random.randrange(0x10000)
+        self._triggered = None
+
+
+    def trigger(self) -> int:
+        """
+        Broadcast a sample trigger to all the sensors.
+
+        Returns:
+            Tag of the trigger
+        """
+        self.tag = (self.tag + 1) & 0xFFFF
+        request = struct.pack("<BH", PSD_CMD_TRIGGER, self.tag)
+        trace = PSDSunSensor.trace
+        if trace is not None:
+            trace.record(TRACE_I2C, TRACE_TX, PSD_GENERAL_CALL_ADDRESS, request)
+        self._broadcast.write(request)
+        self._triggered = time.monotonic()
+        return self.tag
+
+
+    def collect(self) -> Dict[int, LatchedMeasurement]:
+        """
+        Read the measurements latched by the last trigger.
+
+        Returns:
+            Dictionary from sensor address to LatchedMeasurement
+        """
+        if self._triggered is None:
+            raise RuntimeError("Not triggered")
+
+        # Wait for the sensors to sample
+        delay = self._triggered + PSDSunSensor.conversion_delay.get(PSD_CMD_TRIGGER, 0) - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+        results = {}
+        for psd in self.sensors:
+            latched = psd.get_latched()
+            if latched.sequence != self.tag:
+                raise RuntimeError(f"Sensor 0x{psd.addr:02x} missed trigger {self.tag}")
+            results[psd.addr] = latched
+        return results
+
+
+    def sample(self) -> Dict[int, LatchedMeasurement]:
+        """
+        Trigger and collect simultaneous measurements from all the sensors.
+        """
+        self.trigger()
+        return self.collect()
+
+
+def aggregate_profile(current: Dict[str, ProfileProbe],
+        previous: Optional[Dict[str, ProfileProbe]]=None) -> Dict[str, ProfileStats]:
+    """
+    Calculate profiling statistics between two status reads.
+
+    Args:
+        current: Profile of the latest status
+        previous: Profile of an earlier status. If not given the statistics are since reset.
+
+    Returns:
+        Dictionary from probe name to ProfileStats
+    """
+    stats = {}
+    for name, probe in current.items():
+        count, total = probe.count, probe.total
+        if previous is not None:
+            count = (count - previous[name].count) & 0xFFFF
+            total = (total - previous[name].total) & 0xFFFFFFFF
+        stats[name] = ProfileStats(count, total / count if count else float("nan"), probe.last, probe.min, probe.max)
+    return stats
+
+
+def tuned_frequency(url: str = PSD_DEFAULT_URL, fname: str = PSD_TUNING_FILE) -> float:
+    """
+    Get the I2C bus frequency selected by i2ctune.py for the FTDI URL.
+
+    Returns:
+        The tuned frequency or PSD_DEFAULT_FREQUENCY if the bus has not been tuned.
+    """
+    try:
+        with open(fname) as f:
+            return float(json.load(f)[url]["frequency"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return PSD_DEFAULT_FREQUENCY
+
+
+def open_i2c(url: str = PSD_DEFAULT_URL, frequency: float = None) -> I2cController:
+    """
+    Open FTDI I2C controller.
+
+    Args:
+        url: FTDI device URL
+        frequency: I2C bus frequency. Default is the tuned frequency of the URL.
+    """
+    i2c = I2cController()
+    i2c.configure(url, frequency=frequency or tuned_frequency(url))
+    return i2c
+
+
+def scan_sensors(i2c: I2cController, addresses: Iterable[int]=range(0, 127)) -> List[int]:
+    """
+    Scan the I2C bus for responsive PSD Sun Sensors.
+
+    Args:
+        i2c: Configured FTDI I2C Controller object.
+        addresses: I2C addresses to be probed.
+
+    Returns:
+        List of addresses which responded to a temperature request.
+    """
+    found = []
+    for addr in addresses:
+        try:
+            PSDSunSensor(addr, i2c).get_temperature()
+        except I2cNackError:
+            continue
+        except RuntimeError:
+            continue
+        found.append(addr)
+    return found
 
 
 if __name__ == "__main__":
@@ -300,6 +682,8 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="PSD test tool")
     auto_int = lambda x: int(x,0)
+    parser.add_argument('--url', default=PSD_DEFAULT_URL, help="FTDI device URL")
+    parser.add_argument('--frequency', type=float, help="I2C bus frequency (default: tuned frequency)")
     parser.add_argument('--addr', '-a', type=auto_int, default=0x4A, help="Sensor I2C address")
     parser.add_argument('--rate', '-r', type=float, default=0.2, help="Sampling rate")
 
@@ -310,6 +694,9 @@ if __name__ == "__main__":
     parser.add_argument('--angles', action='store_true', help='Sample angle data')
     parser.add_argument('--all', action='store_true', help='Sample all data types')
     parser.add_argument('--temp', action='store_true', help='Sample temperature types')
+    parser.add_argument('--burst', type=int, help='Sample point data in bursts of given length')
+    parser.add_argument('--profile', action='store_true', help='Print firmware profiling statistics (PROFILING build)')
+    parser.add_argument('--trigger', type=auto_int, nargs='+', metavar='ADDR', help='Sample given sensors simultaneously with broadcast trigger')
     parser.add_argument('--scan', action='store_true', help='Scan responsive sensors')
 
     # Calibration
@@ -326,23 +713,27 @@ if __name__ == "__main__":
     # Scan sensors
     if args.scan:
         i2c = I2cController()
-        i2c.configure("ftdi://ftdi:232h/1", frequency=10e3)
-
-        for addr in range(0, 127):
-            try:
-                print(f"0x{addr:02X}: ", end='')
-                sensor = i2c.get_port(addr)
-                PSDSunSensor(addr, i2c).get_temperature()
-                print("Found!")
-            except I2cNackError:
-                print("NACK")
-            except Exception as e:
-                print(e)
+        i2c.configure(args.url, frequency=10e3)
+
+        found = scan_sensors(i2c)
+        for addr in found:
+            print(f"0x{addr:02X}: Found!")
+        if not found:
+            print("No sensors found")
 
         sys.exit(0)
 
 
-    psd = PSDSunSensor(args.addr)
+    # Simultaneous sampling loop
+    if args.trigger:
+        group = PSDGroup(args.trigger, url=args.url, frequency=args.frequency)
+        while True:
+            for addr, latched in group.sample().items():
+                print("0x%02X %5d %5d %5d %5d" % (addr, latched.sequence, *latched.point))
+            time.sleep(args.rate)
+
+
+    psd = PSDSunSensor(args.addr, url=args.url, frequency=args.frequency)
 
     # Read calibration
     if args.calib:
@@ -371,7 +762,8 @@ if __name__ == "__main__":
         print("New calibration:\n", calib)
 
     # Infinite sampling loop
-    if args.raw or args.point or args.vector or args.angles or args.temp:
+    if args.raw or args.point or args.vector or args.angles or args.temp or args.burst or args.profile:
+        profile = None
         while True:
             if args.raw:
                 print("%5d %5d %5d %5d" % psd.get_raw())
@@ -383,5 +775,17 @@ if __name__ == "__main__":
                 print("%5.2f %5.2f %5d" % psd.get_angles())
             if args.temp:
                 print("%.1f °C" % psd.get_temperature())
+            if args.burst:
+                burst = psd.get_burst(args.burst)
+                for x, y, intensity in burst.samples:
+                    print("%5d %5d %5d %5d" % (burst.sequence, x, y, intensity))
+            if args.profile:
+                status = psd.get_status()
+                if status.profile is None:
+                    sys.exit("Firmware is not a profiling build")
+                for name, s in aggregate_profile(status.profile, profile).items():
+                    print("%-8s %5d calls, mean %8.1f cycles (%7.1f us), min %6d, max %6d" % (name, s.count, s.mean,
+                        1e6 * s.mean / status.clock, s.min, s.max))
+                profile = status.profile
 
             time.sleep(args.rate)
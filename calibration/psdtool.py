@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+    Unified command line tool for the PSD Sun Sensor.
+
+    The subcommands import their dependencies only when they are run so the
+    interactive commands (scan, sample, calib) don't pay for numpy, scipy or
+    matplotlib.
+"""
+
+import sys
+import time
+import argparse
+
+from psd import PSD_DEFAULT_URL
+
+
+# Modules that the interactive commands must not import
+HEAVY_MODULES = ("numpy", "scipy", "matplotlib")
+
+
+def auto_int(x):
+    return int(x, 0)
+
+
+def open_bus(args):
+    from psd import open_i2c
+    return open_i2c(args.url, args.frequency)
+
+
+def open_sensor(args):
+    from psd import PSDSunSensor
+    return PSDSunSensor(args.addr, open_bus(args))
+
+
+def cmd_scan(args):
+    from psd import scan_sensors
+
+    for addr in scan_sensors(open_bus(args)):
+        print(f"0x{addr:02X}")
+
+
+def cmd_sample(args):
+    psd = open_sensor(args)
+    n = 0
+    while args.count == 0 or n < args.count:
+        if args.raw:
+            print("%5d %5d %5d %5d" % psd.get_raw())
+        if args.point:
+            print("%5d %5d %5d" % psd.get_point())
+        if args.vector:
+            print("%5d %5d %5d %5d" % psd.get_vector())
+        if args.angles:
+            print("%5.2f %5.2f %5d" % psd.get_angles())
+        if args.temp:
+            print("%.1f °C" % psd.get_temperature())
+        n += 1
+        time.sleep(args.rate)
+
+
+def cmd_calib(args):
+    psd = open_sensor(args)
+    calib = psd.get_calibration()
+    print(calib)
+
+    new = calib
+    if args.set_offset:
+        new = new._replace(offset_x=args.set_offset[0], offset_y=args.set_offset[1], height=args.set_offset[2])
+    if args.set_samples is not None:
+        new = new._replace(samples=args.set_samples)
+    if args.set_temp is not None:
+        new = new._replace(temp_offset=args.set_temp)
+    if new != calib:
+        psd.set_calibration(new)
+        print("New calibration:\n", psd.get_calibration())
+
+
+def cmd_sweep(args):
+    import os
+    import csv
+    import datetime
+    import numpy as np
+    import meas
+    from psd import Calibration, PSD_DEFAULT_TEMP_OFFSET
+    from thor import ThorRotator
+
+    psd = open_sensor(args)
+    thor = ThorRotator(device=args.device)
+
+    temp_offset = psd.get_calibration().temp_offset or PSD_DEFAULT_TEMP_OFFSET
+    psd.set_calibration(Calibration(0, 0, 670, 1, temp_offset))
+    calib = psd.get_calibration()
+
+    os.makedirs(args.output, exist_ok=True)
+    fname = os.path.join(args.output, datetime.datetime.now().isoformat("_") + "_psd_%x.csv" % args.addr)
+    print(f"Outputting to {fname!r}")
+
+    with open(fname, "w", newline="") as f:
+        writer = csv.writer(f)
+        meas.write_calibration(writer, calib, timestamps=args.mode == "continuous")
+        if args.mode == "continuous":
+            rows = meas.continuous_sweep(psd, thor, -args.degree, args.degree, args.velocity, writer)
+        elif args.mode == "adaptive":
+            import adaptive
+            rows = adaptive.adaptive_sweep(psd, thor, args.degree, csvwriter=writer, samples=args.samples, dwell=args.dwell,
+                axis=args.axis)
+        else:
+            rows = meas.step_sweep(psd, thor, np.arange(-args.degree, args.degree + 1, 1), writer,
+                samples=args.samples, dwell=args.dwell)
+
+    if args.plot:
+        meas.plot_measurements("PSD %x" % args.addr, rows)
+
+
+def cmd_fit(args):
+    from plot import calc_calib, fit_calib, read_capture_pair
+
+    for fname in args.files:
+        data = read_capture_pair(fname)
+        if args.plot:
+            calc_calib(fname, *data)
+            continue
+        offset_x, offset_y, height = fit_calib(*data).x
+        print(f"{fname}: offset_x {offset_x:.2f}, offset_y {offset_y:.2f}, height {height:.2f}")
+
+
+def cmd_lut(args):
+    import lut
+
+    table = lut.make_lut()
+    lut.print_lut(table)
+    if args.plot:
+        lut.plot_lut(table)
+    if args.error:
+        lut.plot_error(table)
+
+
+def cmd_budget(args):
+    """
+    Check that the tool and the interactive command dependencies load
+    within the time budget and without the heavy modules.
+    """
+    import subprocess
+
+    code = ("import time; t = time.perf_counter(); import psdtool, psd; psdtool.make_parser(); "
+        "import sys; print(time.perf_counter() - t); "
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))")
+
+    best, heavy = float("inf"), ""
+    for _ in range(args.repeat):
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+            cwd=sys.path[0] or ".").stdout.split("\n")
+        best, heavy = min(best, float(out[0])), out[1]
+
+    print(f"Import time {1e3 * best:.1f} ms (budget {1e3 * args.budget:.0f} ms)")
+    if heavy:
+        print(f"Heavy modules imported: {heavy}")
+    if best > args.budget or heavy:
+        sys.exit(1)
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="PSD Sun Sensor tool")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def bus_parser(name, help, func):
+        p = sub.add_parser(name, help=help)
+        p.add_argument('--url', default=PSD_DEFAULT_URL, help="FTDI device URL")
+        p.add_argument('--frequency', type=float, help="I2C bus frequency (default: tuned frequency)")
+        p.set_defaults(func=func)
+        return p
+
+    p = bus_parser("scan", "Scan responsive sensors", cmd_scan)
+
+    p = bus_parser("sample", "Sample sensor data", cmd_sample)
+    p.add_argument('--addr', '-a', type=auto_int, default=0x4A, help="Sensor I2C address")
+    p.add_argument('--rate', '-r', type=float, default=0.2, help="Sampling interval")
+    p.add_argument('--count', '-n', type=int, default=0, help="Number of samples (0 = forever)")
+    p.add_argument('--raw', action='store_true', help='Sample raw data')
+    p.add_argument('--point', action='store_true', help='Sample point data')
+    p.add_argument('--vector', action='store_true', help='Sample vector data')
+    p.add_argument('--angles', action='store_true', help='Sample angle data')
+    p.add_argument('--temp', action='store_true', help='Sample temperature')
+
+    p = bus_parser("calib", "Get or set calibration values", cmd_calib)
+    p.add_argument('--addr', '-a', type=auto_int, default=0x4A, help="Sensor I2C address")
+    p.add_argument('--set_offset', type=int, nargs=3, metavar=("OFFSET_X", "OFFSET_Y", "HEIGHT"), help='Set position offset and height')
+    p.add_argument('--set_samples', type=int, help='Set number of samples')
+    p.add_argument('--set_temp', type=int, help='Set temperature offset')
+
+    p = bus_parser("sweep", "Run a calibration sweep", cmd_sweep)
+    p.add_argument('--addr', '-a', type=auto_int, default=0x4A, help="Sensor I2C address")
+    p.add_argument('--device', '-D', default="/dev/ttyUSB0", help="Rotator serial device")
+    p.add_argument('--degree', '-d', type=int, default=80, help="Sweep range in degrees")
+    p.add_argument('--mode', choices=("step", "continuous", "adaptive"), default="step", help="Sweep mode")
+    p.add_argument('--velocity', type=float, default=5.0, help="Continuous sweep velocity (deg/s)")
+    p.add_argument('--axis', choices=("x", "y"), default="x", help="Sensor axis rotated by the adaptive sweep")
+    p.add_argument('--samples', type=int, default=10, help="Samples per angle")
+    p.add_argument('--dwell', type=float, default=0.1, help="Delay before each sample")
+    p.add_argument('--output', '-w', default="meas", help="Output folder")
+    p.add_argument('--plot', action='store_true', help="Plot the measurements")
+
+    p = sub.add_parser("fit", help="Fit calibration values to measurements")
+    p.add_argument('files', nargs='+', help="X_calib capture files. The Y_calib captures are found by name.")
+    p.add_argument('--plot', action='store_true', help="Plot the fit")
+    p.set_defaults(func=cmd_fit)
+
+    p = sub.add_parser("lut", help="Generate the tangent look-up table")
+    p.add_argument('--plot', action='store_true', help="Plot the table")
+    p.add_argument('--error', action='store_true', help="Plot the interpolation error")
+    p.set_defaults(func=cmd_lut)
+
+    p = sub.add_parser("budget", help="Check the start-up import time")
+    p.add_argument('--budget', type=float, default=0.5, help="Import time budget in seconds")
+    p.add_argument('--repeat', type=int, default=3, help="Number of measurements")
+    p.set_defaults(func=cmd_budget)
+
+    return parser
+
+
+if __name__ == "__main__":
+    args = make_parser().parse_args()
+    args.func(args)
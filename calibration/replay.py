@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+    Replay recorded captures through the PSDSunSensor API.
+
+    The recorded responses are served by an endpoint plugged to the simulated
+    I2C controller of sim.py, so ReplaySensor decodes them with the very same
+    PSDSunSensor code as the hardware responses.
+
+    Captures can be loaded from frametrace.py trace files (all the commands
+    with their exact responses) or from meas.py CSV files. For the CSV files
+    the raw, point, vector, angle, all and calibration responses are
+    synthesized from the recorded positions with the firmware math of
+    fwmodel.py. Temperature is only served if given as the files don't
+    record it. Other commands need a trace capture.
+"""
+
+import csv
+import time
+import struct
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import fwmodel
+from psd import PSDSunSensor, Calibration, \
+    PSD_CMD_GET_RAW, PSD_CMD_GET_POINT, PSD_CMD_GET_VECTOR, PSD_CMD_GET_ANGLES, PSD_CMD_GET_ALL, \
+    PSD_CMD_GET_TEMPERATURE, PSD_CMD_GET_CALIBRATION, \
+    PSD_RSP_RAW, PSD_RSP_POINT, PSD_RSP_VECTOR, PSD_RSP_ANGLES, PSD_RSP_ALL, PSD_RSP_TEMPERATURE, PSD_RSP_CALIBRATION
+from sim import SimulatedI2cController
+
+
+class Capture:
+    """
+    Recorded responses for each command code with their timestamps.
+    """
+
+    def __init__(self, frames: Dict[int, Tuple[np.ndarray, List[bytes]]]):
+        """
+        Args:
+            frames: Dictionary from command code to (timestamps in seconds, responses)
+        """
+        self.frames = frames
+        starts = [ t[0] for t, _ in frames.values() if len(t) ]
+        ends = [ t[-1] for t, _ in frames.values() if len(t) ]
+        self.start = min(starts) if starts else 0.0
+        self.duration = (max(ends) - self.start) if ends else 0.0
+
+
+    @classmethod
+    def from_trace(cls, fname: str, addr: Optional[int]=None) -> "Capture":
+        """
+        Load a frametrace.py trace file. Each I2C request is paired with the
+        following response from the same address.
+
+        Args:
+            addr: Sensor address. Default is the first address in the trace.
+        """
+        from frametrace import read_trace, TRACE_I2C, TRACE_TX, TRACE_RX
+
+        frames = {}
+        pending = None
+        for frame in read_trace(fname):
+            if frame.bus != TRACE_I2C or not frame.data:
+                continue
+            if addr is None:
+                addr = frame.addr
+            if frame.addr != addr:
+                continue
+            if frame.direction == TRACE_TX:
+                pending = frame
+            elif pending is not None and frame.direction == TRACE_RX:
+                times, responses = frames.setdefault(pending.data[0], ([], []))
+                times.append(pending.timestamp / 1e9)
+                responses.append(bytes(frame.data))
+                pending = None
+
+        return cls({ cmd: (np.array(t), r) for cmd, (t, r) in frames.items() })
+
+
+    @classmethod
+    def from_csv(cls, fname: str, interval: float=0.01, temperature: Optional[float]=None) -> "Capture":
+        """
+        Load a meas.py CSV capture. The responses are generated from the
+        positions and the calibration in the file preamble like the firmware
+        calculates them. The raw values are reconstructed from the position
+        and intensity assuming balanced diagonals, so they reproduce the
+        recorded position within a few counts but not the actual diode readings.
+
+        Args:
+            interval: Sample interval in seconds if the file has no Time column
+            temperature: Constant temperature to be served in Celsius degrees.
+                Without it GET_TEMPERATURE is not in the capture.
+        """
+        with open(fname) as f:
+            rows = csv.reader(f)
+            next(rows)
+            next(rows)
+            calib = Calibration(*map(int, next(rows)))
+            header = next(rows)
+            data = np.array([ row for row in rows if row ], dtype=float)
+
+        x, y, intensity = data[:, 1].astype(np.int16), data[:, 2].astype(np.int16), data[:, 3].astype(np.uint16)
+        times = data[:, 4] if "Time" in header else interval * np.arange(len(data))
+
+        # Invert calculate_position(): total from the intensity and the
+        # x1 + x2 - y1 - y2 diagonal difference set to zero
+        total = 4 * intensity.astype(np.int64)
+        a = (x.astype(np.int64) - calib.offset_x) * total / 2048
+        b = (y.astype(np.int64) - calib.offset_y) * total / 2048
+        raw = np.column_stack((total - a - b, total + a + b, total + a - b, total - a + b)) / 4
+        raw = np.clip(np.round(raw), 0, fwmodel.ADC_MAX).astype(np.int64)
+
+        ax, ay = fwmodel.atan(x), fwmodel.atan(y)
+
+        raw = [ struct.pack("<HHHH", *v) for v in raw.tolist() ]
+        point = [ struct.pack("<hhH", *v) for v in zip(x.tolist(), y.tolist(), intensity.tolist()) ]
+        angles = [ struct.pack("<hhH", *v) for v in zip(ax.tolist(), ay.tolist(), intensity.tolist()) ]
+        vector = [ struct.pack("<hhhH", -v[0], -v[1], calib.height, v[2])
+            for v in zip(x.tolist(), y.tolist(), intensity.tolist()) ]
+
+        frames = {
+            PSD_CMD_GET_RAW: (times, [ bytes([PSD_RSP_RAW]) + r for r in raw ]),
+            PSD_CMD_GET_POINT: (times, [ bytes([PSD_RSP_POINT]) + p for p in point ]),
+            PSD_CMD_GET_VECTOR: (times, [ bytes([PSD_RSP_VECTOR]) + v for v in vector ]),
+            PSD_CMD_GET_ANGLES: (times, [ bytes([PSD_RSP_ANGLES]) + a for a in angles ]),
+            PSD_CMD_GET_ALL: (times, [ bytes([PSD_RSP_ALL]) + r + p + a for r, p, a in zip(raw, point, angles) ]),
+            PSD_CMD_GET_CALIBRATION: (times, [ struct.pack("<Bhhhhh", PSD_RSP_CALIBRATION, *calib) ] * len(times)),
+        }
+        if temperature is not None:
+            frames[PSD_CMD_GET_TEMPERATURE] = (times,
+                [ struct.pack("<Bh", PSD_RSP_TEMPERATURE, round(10 * temperature)) ] * len(times))
+        return cls(frames)
+
+
+class ReplayEndpoint:
+    """
+    Sensor endpoint for sim.SimulatedI2cController serving the recorded responses.
+    """
+
+    def __init__(self, capture: Capture, speed: Optional[float]=None, loop: bool=False):
+        """
+        Args:
+            capture: Recorded capture
+            speed: Playback speed relative to real time (1.0 = real time).
+                None serves the responses as fast as possible.
+            loop: Restart from the beginning at the end of the capture
+        """
+        self.capture = capture
+        self.speed = speed
+        self.loop = loop
+        self.cursors = { cmd: 0 for cmd in capture.frames }
+        self.laps = { cmd: 0 for cmd in capture.frames }
+        self.served = 0
+        self._t0 = None
+        self._lock = threading.Lock()
+
+
+    def handle_command(self, msg: bytes) -> bytes:
+        if not msg:
+            return b""
+        cmd = msg[0]
+        if cmd not in self.capture.frames:
+            raise RuntimeError(f"Command 0x{cmd:02X} is not in the capture")
+
+        times, responses = self.capture.frames[cmd]
+        with self._lock:
+            i = self.cursors[cmd]
+            if i >= len(responses):
+                if not self.loop:
+                    raise EOFError("End of the capture")
+                i = 0
+                self.laps[cmd] += 1
+            self.cursors[cmd] = i + 1
+            self.served += 1
+            if self._t0 is None:
+                self._t0 = time.monotonic()
+
+        if self.speed:
+            # Wait until the response is due on the playback clock
+            period = self.capture.duration + (times[1] - times[0] if len(times) > 1 else 0.0)
+            due = (times[i] - self.capture.start + self.laps[cmd] * period) / self.speed
+            delay = self._t0 + due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+        return responses[i]
+
+
+class ReplaySensor(PSDSunSensor):
+    """
+    PSDSunSensor serving samples from a recorded capture.
+    """
+
+    # The playback clock replaces the conversion delays
+    conversion_delay = {}
+
+    def __init__(self, capture: Capture, speed: Optional[float]=None, loop: bool=False, addr: int=0x4A):
+        """
+        Args:
+            capture: Recorded capture
+            speed: Playback speed relative to real time. None for as fast as possible.
+            loop: Restart from the beginning at the end of the capture
+            addr: I2C address reported by the sensor
+        """
+        self.endpoint = ReplayEndpoint(capture, speed, loop)
+        super().__init__(addr, SimulatedI2cController({ addr: self.endpoint }))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Replay a capture through the PSDSunSensor API")
+    parser.add_argument('capture', help="Trace (.bin) or measurement CSV file")
+    parser.add_argument('--speed', type=float, help="Playback speed (1 = real time, default: as fast as possible)")
+    parser.add_argument('--loop', action='store_true', help="Loop the capture")
+    parser.add_argument('--getter', default="get_point", help="PSDSunSensor getter to call")
+    parser.add_argument('--count', '-n', type=int, default=0, help="Number of samples (0 = until the end)")
+    parser.add_argument('--temperature', type=float, help="Temperature served from a CSV capture (Celsius)")
+    parser.add_argument('--quiet', '-q', action='store_true', help="Only print the throughput")
+    args = parser.parse_args()
+
+    if args.capture.endswith(".csv"):
+        capture = Capture.from_csv(args.capture, temperature=args.temperature)
+    else:
+        capture = Capture.from_trace(args.capture)
+
+    psd = ReplaySensor(capture, args.speed, args.loop)
+    getter = getattr(psd, args.getter)
+    n = 0
+    start = time.perf_counter()
+    try:
+        while args.count == 0 or n < args.count:
+            value = getter()
+            n += 1
+            if not args.quiet:
+                print(value)
+    except (EOFError, KeyboardInterrupt):
+        pass
+    elapsed = time.perf_counter() - start
+    print(f"{n} samples in {elapsed:.2f} s ({n / elapsed:.0f} samples/s)")
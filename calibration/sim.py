@@ -0,0 +1,432 @@
+"""
+    Simulated PSD Sun Sensor and Thor rotator endpoints.
+
+    SimulatedI2cController can be given to PSDSunSensor in place of the FTDI
+    I2C controller and SimulatedRotator to ThorRotator as its serial port.
+    The sensors emulate the firmware command handling with the integer math
+    from fwmodel.py and see the sun at the angle of the simulated rotator,
+    so the host tools can be run without any hardware.
+"""
+
+import time
+import struct
+import bisect
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+from pyftdi.i2c import I2cNackError
+
+import fwmodel
+from mcsim import diode_counts
+from psd import (
+    Calibration, PSD_DEFAULT_TEMP_OFFSET,
+    PSD_CMD_STATUS, PSD_CMD_GET_RAW, PSD_CMD_GET_POINT, PSD_CMD_GET_VECTOR, PSD_CMD_GET_ANGLES,
+    PSD_CMD_GET_ALL, PSD_CMD_GET_TEMPERATURE, PSD_CMD_GET_BURST,
+    PSD_CMD_TRIGGER, PSD_CMD_GET_LATCHED, PSD_CMD_SET_CALIBRATION,
+    PSD_CMD_GET_CALIBRATION, PSD_CMD_SET_I2C_ADDRESS,
+    PSD_RSP_OK, PSD_RSP_RAW, PSD_RSP_POINT, PSD_RSP_VECTOR, PSD_RSP_ANGLES, PSD_RSP_ALL,
+    PSD_RSP_TEMPERATURE, PSD_RSP_BURST, PSD_RSP_LATCHED, PSD_RSP_CALIBRATION, PSD_RSP_UNKNOWN_COMMAND,
+    PSD_RSP_INVALID_PARAM, PSD_RSP_ERROR,
+    PSD_BURST_RAW, PSD_BURST_MAX, PSD_TIMESTAMP_CLOCK_HZ, PSD_GENERAL_CALL_ADDRESS,
+)
+from thor import *
+
+
+class SimulatedSensor:
+    """
+    Firmware emulation of a single PSD Sun Sensor.
+    """
+
+    def __init__(self,
+            sun: Callable[[], Tuple[float, float]]=lambda: (0.0, 0.0),
+            height: float=670,
+            offset: Tuple[float, float]=(0, 0),
+            full_scale: float=3000,
+            noise: float=1.0,
+            temperature: float=25.0,
+            seed: Optional[int]=None
+        ):
+        """
+        Args:
+            sun: Function returning the sun angles (degrees) around X and Y axes.
+            height: Optical height in position units
+            offset: Light point offset in position units
+            full_scale: Sum of the diode counts at normal incidence
+            noise: ADC noise in counts
+            temperature: Sensor temperature in Celcius degrees
+            seed: Random seed
+        """
+        self.sun = sun
+        self.height = height
+        self.offset = offset
+        self.full_scale = full_scale
+        self.noise = noise
+        self.temperature = temperature
+        self.calibration = Calibration(0, 0, 670, 1, PSD_DEFAULT_TEMP_OFFSET)
+        self.burst_sequence = 0
+
+        # Broadcast trigger: tag, time and sample latched by the last trigger
+        self.latched = None
+        self.rng = np.random.default_rng(seed)
+
+        # Samples are simulated in batches for the same sun angle and calibration
+        self._batch_key = None
+        self._batch = []
+
+
+    def _simulate_batch(self, ax: float, ay: float, n: int=256) -> list:
+        tx, ty = np.tan(np.radians(ax)), np.tan(np.radians(ay))
+        cos_incidence = 1 / np.sqrt(1 + tx**2 + ty**2) if abs(ax) < 90 and abs(ay) < 90 else 0
+        px = self.height * tx + self.offset[0]
+        py = self.height * ty + self.offset[1]
+        currents = diode_counts(px, py, self.full_scale * cos_incidence)
+
+        samples = self.calibration.samples
+        adc_sum = np.zeros((n, 4), dtype=np.int64)
+        for _ in range(fwmodel.acquired_samples(samples)):
+            adc = fwmodel.ADC_MAX - currents + self.rng.normal(0, self.noise, (n, 4))
+            adc_sum += np.clip(np.round(adc), 0, fwmodel.ADC_MAX).astype(np.int64)
+        raw = fwmodel.average_samples(adc_sum, samples if samples > 0 else 1)
+
+        x, y, intensity = fwmodel.calculate_position(raw, self.calibration.offset_x, self.calibration.offset_y)
+        ang_x, ang_y = fwmodel.atan(x), fwmodel.atan(y)
+        return list(zip(raw.tolist(), zip(x.tolist(), y.tolist(), intensity.tolist()),
+            zip(ang_x.tolist(), ang_y.tolist(), intensity.tolist())))
+
+
+    def sample(self) -> Tuple[list, tuple, tuple]:
+        """
+        Emulate read_voltage_channels(), calculate_position() and calculate_angles()
+
+        Returns:
+            Tuple of raw (x1, x2, y1, y2), point (x, y, intensity) and angles (ax, ay, intensity).
+        """
+        ax, ay = self.sun()
+        key = (ax, ay, self.calibration)
+        if key != self._batch_key or not self._batch:
+            # Simulate a whole batch only when the sun angle stays still
+            self._batch = self._simulate_batch(ax, ay, 256 if key == self._batch_key else 1)
+            self._batch_key = key
+        return self._batch.pop()
+
+
+    def read_temperature(self) -> int:
+        """
+        Emulate read_temperature()
+        """
+        counts = round((10 * self.temperature - 300) / 4 + PSD_DEFAULT_TEMP_OFFSET)
+        if self.calibration.temp_offset == 0:
+            return counts
+        return (counts - self.calibration.temp_offset) * 4 + 300
+
+
+    def handle_general_call(self, msg: bytes) -> None:
+        """
+        Emulate handle_general_call()
+        """
+        if len(msg) == 3 and msg[0] == PSD_CMD_TRIGGER:
+            self.latched = (struct.unpack_from("<H", msg, 1)[0], time.monotonic(), self.sample())
+
+
+    def handle_command(self, msg: bytes) -> bytes:
+        """
+        Emulate handle_command()
+
+        Args:
+            msg: Received command
+
+        Returns:
+            Response to be transmitted.
+        """
+        cmd = msg[0]
+
+        if cmd == PSD_CMD_STATUS:
+            return bytes([PSD_RSP_OK])
+
+        elif cmd in (PSD_CMD_GET_RAW, PSD_CMD_GET_POINT, PSD_CMD_GET_VECTOR, PSD_CMD_GET_ANGLES, PSD_CMD_GET_ALL):
+            raw, point, angles = self.sample()
+            raw = struct.pack("<HHHH", *raw)
+            point = struct.pack("<hhH", *point)
+            angles = struct.pack("<hhH", *angles)
+            if cmd == PSD_CMD_GET_RAW:
+                return bytes([PSD_RSP_RAW]) + raw
+            elif cmd == PSD_CMD_GET_POINT:
+                return bytes([PSD_RSP_POINT]) + point
+            elif cmd == PSD_CMD_GET_VECTOR:
+                x, y, intensity = struct.unpack("<hhH", point)
+                return bytes([PSD_RSP_VECTOR]) + struct.pack("<hhhH", -x, -y, self.calibration.height, intensity)
+            elif cmd == PSD_CMD_GET_ANGLES:
+                return bytes([PSD_RSP_ANGLES]) + angles
+            else:
+                return bytes([PSD_RSP_ALL]) + raw + point + angles
+
+        elif cmd == PSD_CMD_GET_BURST:
+            if len(msg) != 3 or msg[2] not in PSD_BURST_MAX or not 1 <= msg[1] <= PSD_BURST_MAX[msg[2]]:
+                return bytes([PSD_RSP_INVALID_PARAM])
+            count, fmt = msg[1], msg[2]
+            records = [ self.sample()[0 if fmt == PSD_BURST_RAW else 1] for _ in range(count) ]
+            record_fmt = "<HHHH" if fmt == PSD_BURST_RAW else "<hhH"
+            self.burst_sequence = (self.burst_sequence + 1) & 0xFFFF
+            return struct.pack("<BHB", PSD_RSP_BURST, self.burst_sequence, count) + \
+                b"".join(struct.pack(record_fmt, *r) for r in records)
+
+        elif cmd == PSD_CMD_GET_LATCHED:
+            if self.latched is None:
+                return bytes([PSD_RSP_ERROR])
+            tag, t, (raw, point, angles) = self.latched
+            age = round((time.monotonic() - t) * PSD_TIMESTAMP_CLOCK_HZ) & 0xFFFF
+            return struct.pack("<BHH", PSD_RSP_LATCHED, tag, age) + \
+                struct.pack("<HHHH", *raw) + struct.pack("<hhH", *point) + struct.pack("<hhH", *angles)
+
+        elif cmd == PSD_CMD_GET_TEMPERATURE:
+            return struct.pack("<Bh", PSD_RSP_TEMPERATURE, self.read_temperature())
+
+        elif cmd == PSD_CMD_SET_CALIBRATION:
+            if len(msg) != 11:
+                return bytes([PSD_RSP_INVALID_PARAM])
+            self.calibration = Calibration(*struct.unpack("<xhhhhh", msg))
+            return bytes([PSD_RSP_OK])
+
+        elif cmd == PSD_CMD_GET_CALIBRATION:
+            return struct.pack("<Bhhhhh", PSD_RSP_CALIBRATION, *self.calibration)
+
+        elif cmd == PSD_CMD_SET_I2C_ADDRESS:
+            if len(msg) != 2 or msg[1] & 0x80:
+                return bytes([PSD_RSP_INVALID_PARAM])
+            return bytes([PSD_RSP_OK])
+
+        return bytes([PSD_RSP_UNKNOWN_COMMAND])
+
+
+class SimulatedI2cPort:
+    """
+    Emulation of pyftdi I2cPort connected to a simulated sensor.
+    """
+
+    def __init__(self, controller: "SimulatedI2cController", address: int):
+        self._controller = controller
+        self._address = address
+        self._response = b""
+
+    def _sensor(self) -> SimulatedSensor:
+        try:
+            return self._controller.sensors[self._address]
+        except KeyError:
+            raise I2cNackError("NACK from slave") from None
+
+    def write(self, out: bytes, relax: bool=True, start: bool=True) -> None:
+        if self._address == PSD_GENERAL_CALL_ADDRESS:
+            # General call is received by all the sensors supporting it
+            sensors = [ s for s in self._controller.sensors.values() if hasattr(s, "handle_general_call") ]
+            if not sensors:
+                raise I2cNackError("NACK from slave")
+            if self._controller.latency:
+                time.sleep(self._controller.latency)
+            for sensor in sensors:
+                sensor.handle_general_call(bytes(out))
+            return
+
+        sensor = self._sensor()
+        if self._controller.latency:
+            time.sleep(self._controller.latency)
+        self._response = sensor.handle_command(bytes(out))
+
+    def read(self, readlen: int=0, relax: bool=True, start: bool=True) -> bytes:
+        self._sensor()
+        if self._controller.latency:
+            time.sleep(self._controller.latency)
+        # The firmware feeds 0xFF when the master reads more than available
+        rsp = self._response[:readlen]
+        return rsp + b"\xFF" * (readlen - len(rsp))
+
+    def exchange(self, out: bytes, readlen: int=0, relax: bool=True, start: bool=True) -> bytes:
+        self.write(out)
+        return self.read(readlen)
+
+
+class SimulatedI2cController:
+    """
+    Emulation of pyftdi I2cController with simulated sensors on the bus.
+    """
+
+    def __init__(self, sensors: Optional[Dict[int, SimulatedSensor]]=None, latency: float=0.0):
+        """
+        Args:
+            sensors: Simulated sensors indexed by their I2C address.
+            latency: Simulated bus latency per transfer in seconds.
+        """
+        self.sensors = sensors if sensors is not None else {}
+        self.latency = latency
+        self.frequency = 50e3
+
+    def configure(self, url: str, **kwargs) -> None:
+        self.frequency = kwargs.get("frequency", self.frequency)
+
+    def terminate(self) -> None:
+        pass
+
+    def get_port(self, address: int) -> SimulatedI2cPort:
+        return SimulatedI2cPort(self, address)
+
+
+class SimulatedRotator:
+    """
+    Serial port emulation of a Thorlabs APT rotator controller.
+
+    Moves take real time according to the velocity parameters. The current
+    stage angle is available in degrees from the `angle` property.
+    """
+
+    def __init__(self, velocity: float=10.0, acceleration: float=10.0, enc_cnt: int=ThorRotator.EncCnt):
+        """
+        Args:
+            velocity: Maximum velocity in degrees per second
+            acceleration: Acceleration in degrees per second squared
+            enc_cnt: Encoder counts per degree
+        """
+        self.timeout = 0.1
+        self.enc_cnt = enc_cnt
+        self.velocity = velocity
+        self.acceleration = acceleration
+
+        self._lock = threading.Lock()
+        self._rx = bytearray()
+        self._pending = [] # (ready time, frame) sorted by the time
+        self._abs_position = 0
+        self._rel_distance = 0
+
+        # Current motion: start time, start position, velocity (counts/s), target position
+        self._motion = (time.monotonic(), 0.0, 0.0, None)
+
+
+    def _position(self, now: Optional[float]=None) -> float:
+        t0, p0, v, target = self._motion
+        p = p0 + v * ((now or time.monotonic()) - t0)
+        if target is not None and (p - target) * v >= 0:
+            return target
+        return p
+
+    @property
+    def angle(self) -> float:
+        return self._position() / self.enc_cnt
+
+
+    def _move_to(self, target: float, done: Optional[bytes]=None) -> None:
+        """
+        Start a move and schedule the move completed message.
+        Simplified to constant velocity moves including the acceleration time.
+
+        Args:
+            target: Target position in encoder counts
+            done: Frame sent when the move is done (default: MOVE_COMPLETED)
+        """
+        now = time.monotonic()
+        p = self._position(now)
+        d = abs(target - p) / self.enc_cnt
+        vmax, acc = self.velocity, self.acceleration
+        duration = 2 * np.sqrt(d / acc) if d < vmax**2 / acc else d / vmax + vmax / acc
+        v = (target - p) / duration if duration > 0 else 0.0
+        self._motion = (now, p, v, target)
+        self._schedule(now + duration, done or self._status_frame(MGMSG_MOT_MOVE_COMPLETED, target))
+
+
+    def _status_frame(self, message_id: int, position: float) -> bytes:
+        data = struct.pack("<HiiI", 1, int(position), int(position), 0)
+        return struct.pack("<HHBB", message_id, len(data), 0x01 | 0x80, 0x50) + data
+
+    def _data_frame(self, message_id: int, data: bytes) -> bytes:
+        return struct.pack("<HHBB", message_id, len(data), 0x01 | 0x80, 0x50) + data
+
+    def _schedule(self, ready: float, frame: bytes) -> None:
+        bisect.insort(self._pending, (ready, frame))
+
+
+    def _handle(self, message_id: int, param1: int, param2: int, data: Optional[bytes]) -> None:
+        now = time.monotonic()
+
+        if message_id == MGMSG_MOT_REQ_ENCCOUNTER or message_id == MGMSG_MOT_REQ_POSCOUNTER:
+            frame = self._data_frame(message_id + 1, struct.pack("<Hi", 1, int(self._position(now))))
+            self._schedule(now, frame)
+        elif message_id == MGMSG_MOT_SET_ENCCOUNTER:
+            _, position = struct.unpack("<Hi", data)
+            self._motion = (now, float(position), 0.0, None)
+        elif message_id == MGMSG_MOT_SET_VELPARAMS:
+            _, min_vel, accl, max_vel = struct.unpack("<HIII", data)
+            self.velocity = max_vel / ThorRotator.velocity_scale
+            self.acceleration = accl / ThorRotator.acceleration_scale
+        elif message_id == MGMSG_MOT_REQ_VELPARAMS:
+            data = struct.pack("<HIII", 1, 0,
+                int(self.acceleration * ThorRotator.acceleration_scale),
+                int(self.velocity * ThorRotator.velocity_scale))
+            self._schedule(now, self._data_frame(MGMSG_MOT_GET_VELPARAMS, data))
+        elif message_id == MGMSG_MOT_SET_MOVEABSPARAMS:
+            _, self._abs_position = struct.unpack("<Hi", data)
+        elif message_id == MGMSG_MOT_REQ_MOVEABSPARAMS:
+            self._schedule(now, self._data_frame(MGMSG_MOT_GET_MOVEABSPARAMS, struct.pack("<Hi", 1, self._abs_position)))
+        elif message_id == MGMSG_MOT_SET_MOVERELPARAMS:
+            _, self._rel_distance = struct.unpack("<Hi", data)
+        elif message_id == MGMSG_MOT_REQ_MOVERELPARAMS:
+            self._schedule(now, self._data_frame(MGMSG_MOT_GET_MOVERELPARAMS, struct.pack("<Hi", 1, self._rel_distance)))
+        elif message_id == MGMSG_MOD_REQ_CHANENABLESTATE:
+            self._schedule(now, struct.pack("<HBBBB", MGMSG_MOD_GET_CHANENABLESTATE, 1, 1, 0x01, 0x50))
+        elif message_id == MGMSG_MOT_MOVE_ABSOLUTE:
+            self._move_to(self._abs_position)
+        elif message_id == MGMSG_MOT_MOVE_RELATIVE:
+            self._move_to(self._position(now) + self._rel_distance)
+        elif message_id == MGMSG_MOT_MOVE_HOME:
+            self._move_to(0, struct.pack("<HBBBB", MGMSG_MOT_MOVE_HOMED, 1, 0, 0x01, 0x50))
+        elif message_id == MGMSG_MOT_MOVE_VELOCITY:
+            p = self._position(now)
+            v = self.velocity * self.enc_cnt * (1 if param2 == 1 else -1)
+            self._motion = (now, p, v, None)
+        elif message_id == MGMSG_MOT_MOVE_STOP:
+            p = self._position(now)
+            self._motion = (now, p, 0.0, None)
+            self._schedule(now, self._status_frame(MGMSG_MOT_MOVE_STOPPED, p))
+
+
+    def write(self, msg: bytes) -> int:
+        """
+        Receive command frames from the host.
+        """
+        with self._lock:
+            msg = bytes(msg)
+            while len(msg) >= 6:
+                message_id, param1, param2, dest, src = struct.unpack("<HBBBB", msg[:6])
+                if dest & 0x80:
+                    length = param1 | (param2 << 8)
+                    data, msg = msg[6:6 + length], msg[6 + length:]
+                    self._handle(message_id, None, None, data)
+                else:
+                    msg = msg[6:]
+                    self._handle(message_id, param1, param2, None)
+        return len(msg)
+
+
+    def _collect(self) -> None:
+        now = time.monotonic()
+        while self._pending and self._pending[0][0] <= now:
+            self._rx += self._pending.pop(0)[1]
+
+    @property
+    def in_waiting(self) -> int:
+        with self._lock:
+            self._collect()
+            return len(self._rx)
+
+    def read(self, size: int=1) -> bytes:
+        """
+        Read bytes sent by the controller. Blocks until `size` bytes are
+        available or the timeout expires.
+        """
+        deadline = time.monotonic() + (self.timeout if self.timeout is not None else 1e9)
+        while True:
+            with self._lock:
+                self._collect()
+                if len(self._rx) >= size or time.monotonic() >= deadline:
+                    data = bytes(self._rx[:size])
+                    del self._rx[:size]
+                    return data
+                next_ready = self._pending[0][0] if self._pending else deadline
+            time.sleep(max(0, min(next_ready, deadline) - time.monotonic()))
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+    Sun vector estimation from multiple PSD Sun Sensors.
+
+    All the functions work on NumPy arrays so that whole measurement logs
+    can be processed at once. Measurements from N sensors over T time steps
+    are given as arrays of shape (N, T).
+
+    The sensor frame follows the firmware convention (calculate_vectors):
+    the sun vector is (-x, -y, height) where x and y are the offset
+    corrected light point position.
+"""
+
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def raw_to_points(raw: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Calculate light point position from raw diode currents.
+    Same as calculate_position() in the firmware but without
+    integer truncation or calibration offsets.
+
+    Args:
+        raw: Raw measurements as array of shape (..., 4) in order x1, x2, y1, y2.
+
+    Returns:
+        Tuple of x, y and intensity arrays of shape (...).
+    """
+    raw = np.asarray(raw, dtype=float)
+    x1, x2, y1, y2 = np.moveaxis(raw, -1, 0)
+
+    total = x1 + x2 + y1 + y2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x = np.where(total > 0, 2048 * ((x2 + y1) - (x1 + y2)) / total, 0.0)
+        y = np.where(total > 0, 2048 * ((x2 + y2) - (x1 + y1)) / total, 0.0)
+    return x, y, total / 4
+
+
+def sensor_vectors(x: np.ndarray, y: np.ndarray,
+        offset_x: np.ndarray, offset_y: np.ndarray, height: np.ndarray
+    ) -> np.ndarray:
+    """
+    Convert light point positions to unit sun vectors in the sensor frame.
+
+    Args:
+        x, y: Light point positions of shape (N, T)
+        offset_x, offset_y, height: Calibration values of shape (N,)
+
+    Returns:
+        Unit vectors of shape (N, T, 3)
+    """
+    offset_x, offset_y, height = (np.asarray(a, dtype=float)[:, None] for a in (offset_x, offset_y, height))
+    x = np.asarray(x, dtype=float)
+    v = np.stack(np.broadcast_arrays(-(x + offset_x), -(y + offset_y), height), axis=-1)
+    return v / np.linalg.norm(v, axis=-1, keepdims=True)
+
+
+def combine_vectors(vectors: np.ndarray,
+        weights: np.ndarray,
+        sigma: Optional[np.ndarray]=None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Combine sun vectors from several sensors with a weighted mean.
+
+    The covariance contains the spread between the sensors and the
+    measurement noise of each sensor projected perpendicular to its vector.
+
+    Args:
+        vectors: Unit vectors in body frame, shape (N, T, 3)
+        weights: Non-negative weights, shape (N, T)
+        sigma: Angular noise of each sensor in radians, shape (N,)
+
+    Returns:
+        Tuple of unit sun vector estimates (T, 3) and their covariances (T, 3, 3).
+        Time steps without any weight are NaN.
+    """
+    w = np.asarray(weights, dtype=float)
+    w_sum = w.sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.einsum("nt,nti->ti", w, vectors) / w_sum[:, None]
+
+        d = vectors - mean
+        cov = np.einsum("nt,nti,ntj->tij", w**2, d, d)
+        if sigma is not None:
+            s2 = (w * np.asarray(sigma, dtype=float)[:, None])**2
+            proj = np.eye(3) - np.einsum("nti,ntj->ntij", vectors, vectors)
+            cov += np.einsum("nt,ntij->tij", s2, proj)
+        cov /= (w_sum**2)[:, None, None]
+
+        norm = np.linalg.norm(mean, axis=-1)
+        mean /= norm[:, None]
+        cov /= (norm**2)[:, None, None]
+
+    return mean, cov
+
+
+class SensorArray:
+    """
+    Group of PSD Sun Sensors mounted on the spacecraft body.
+    """
+
+    def __init__(self,
+            rotations: Sequence[np.ndarray],
+            calibrations: Sequence,
+            sigma: Optional[Sequence[float]]=None,
+            min_intensity: int=50
+        ):
+        """
+        Args:
+            rotations: Rotation matrix from sensor frame to body frame for each sensor.
+            calibrations: Calibration object (or any object having offset_x, offset_y
+                and height attributes) for each sensor.
+            sigma: Angular measurement noise of each sensor in degrees.
+            min_intensity: Measurements dimmer than this are ignored.
+        """
+        self.rotations = np.asarray(rotations, dtype=float)
+        if self.rotations.shape != (len(calibrations), 3, 3):
+            raise ValueError("One 3x3 rotation matrix per sensor required")
+
+        self.offset_x = np.array([ c.offset_x for c in calibrations ], dtype=float)
+        self.offset_y = np.array([ c.offset_y for c in calibrations ], dtype=float)
+        self.height = np.array([ c.height for c in calibrations ], dtype=float)
+        self.sigma = None if sigma is None else np.radians(np.asarray(sigma, dtype=float))
+        self.min_intensity = min_intensity
+
+
+    def vectors(self, x: np.ndarray, y: np.ndarray, offsets_applied: bool=True) -> np.ndarray:
+        """
+        Convert light point positions to unit sun vectors in body frame.
+
+        Args:
+            x, y: Light point positions of shape (N, T)
+            offsets_applied: True if the firmware has already added calibration
+                offsets to the positions (as get_point() does).
+
+        Returns:
+            Unit vectors of shape (N, T, 3)
+        """
+        if offsets_applied:
+            zeros = np.zeros_like(self.height)
+            v = sensor_vectors(x, y, zeros, zeros, self.height)
+        else:
+            v = sensor_vectors(x, y, self.offset_x, self.offset_y, self.height)
+        return np.einsum("nij,ntj->nti", self.rotations, v)
+
+
+    def from_points(self, x: np.ndarray, y: np.ndarray, intensity: np.ndarray,
+            offsets_applied: bool=True
+        ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Estimate the sun vector from point measurements.
+
+        Args:
+            x, y, intensity: Point measurements of shape (N, T)
+            offsets_applied: See vectors()
+
+        Returns:
+            Tuple of sun vectors (T, 3) and covariances (T, 3, 3) in body frame.
+        """
+        intensity = np.asarray(intensity, dtype=float)
+        weights = np.where(intensity >= self.min_intensity, intensity, 0.0)
+        return combine_vectors(self.vectors(x, y, offsets_applied), weights, self.sigma)
+
+
+    def from_raw(self, raw: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Estimate the sun vector from raw measurements.
+
+        Args:
+            raw: Raw measurements of shape (N, T, 4)
+
+        Returns:
+            Tuple of sun vectors (T, 3) and covariances (T, 3, 3) in body frame.
+        """
+        x, y, intensity = raw_to_points(raw)
+        return self.from_points(x, y, intensity, offsets_applied=False)
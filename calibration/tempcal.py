@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+    Calibrate the temperature sensor offset of all PSD Sun Sensors on a bus.
+
+    The firmware gives out raw ADC counts when the temperature offset is 0.
+    The calibrated temperature is calculated in firmware as
+        T [0.1 °C] = (raw - temp_offset) * 4 + 300
+    so the offset can be solved from a burst of raw readings taken at a known
+    reference temperature.
+"""
+
+import re
+import sys
+import time
+from typing import Dict, List, Sequence
+
+from pyftdi.i2c import I2cController
+
+from psd import PSDSunSensor, Calibration, PSD_DEFAULT_URL, scan_sensors
+
+
+def temperature_offset(raw_counts: Sequence[int], reference: float) -> int:
+    """
+    Calculate the temperature offset from raw temperature sensor readings.
+
+    Args:
+        raw_counts: Raw ADC counts read while the sensor was in raw mode.
+        reference: Reference temperature in Celcius degrees.
+
+    Returns:
+        Temperature offset value for the Calibration struct.
+    """
+    mean = sum(raw_counts) / len(raw_counts)
+    return round(mean - (10 * reference - 300) / 4)
+
+
+def read_reference(fname: str) -> float:
+    """
+    Read the reference temperature from a file.
+    The last number in the file is used so that thermometer log files
+    can be given as such.
+
+    Args:
+        fname: File name
+
+    Returns:
+        Reference temperature in Celcius degrees.
+    """
+    with open(fname) as f:
+        numbers = re.findall(r"[-+]?\d+(?:\.\d*)?", f.read())
+    if not numbers:
+        raise ValueError(f"No temperature found from {fname!r}")
+    return float(numbers[-1])
+
+
+def calibrate_temperature(sensors: Dict[int, PSDSunSensor],
+        reference: float,
+        samples: int=32,
+        interval: float=0.0
+    ) -> Dict[int, Calibration]:
+    """
+    Calibrate temperature offsets of multiple sensors at once.
+
+    All the sensors are first put to raw temperature mode and then sampled
+    in turns so that every sensor sees the same conditions during the burst.
+    Finally, the new offsets are written back. If something fails the old
+    calibration values are restored.
+
+    Args:
+        sensors: Dictionary of sensor objects indexed by their I2C address.
+        reference: Reference temperature in Celcius degrees.
+        samples: Number of raw readings collected from each sensor.
+        interval: Delay between rounds in seconds.
+
+    Returns:
+        Dictionary of the new calibration values indexed by I2C address.
+    """
+    old = { addr: psd.get_calibration() for addr, psd in sensors.items() }
+    try:
+        for addr, psd in sensors.items():
+            psd.set_calibration(old[addr]._replace(temp_offset=0))
+
+        readings: Dict[int, List[int]] = { addr: [] for addr in sensors }
+        for _ in range(samples):
+            for addr, psd in sensors.items():
+                # In raw mode the firmware response is ADC count and not 0.1 °C
+                readings[addr].append(round(10 * psd.get_temperature()))
+            if interval:
+                time.sleep(interval)
+
+        new = {}
+        for addr, psd in sensors.items():
+            offset = temperature_offset(readings[addr], reference)
+            new[addr] = old[addr]._replace(temp_offset=offset)
+            psd.set_calibration(new[addr])
+        return new
+
+    except:
+        for addr, psd in sensors.items():
+            psd.set_calibration(old[addr])
+        raise
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="PSD temperature calibration tool")
+    auto_int = lambda x: int(x,0)
+    parser.add_argument('--addr', '-a', type=auto_int, nargs='+', help="Sensor I2C addresses")
+    parser.add_argument('--scan', action='store_true', help="Calibrate all responsive sensors on the bus")
+    parser.add_argument('--url', default=PSD_DEFAULT_URL, help="FTDI device URL")
+    parser.add_argument('--samples', '-n', type=int, default=32, help="Number of raw readings per sensor")
+    parser.add_argument('--interval', type=float, default=0.0, help="Delay between sampling rounds")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--ref', '-t', type=float, help="Reference temperature in Celcius degrees")
+    group.add_argument('--ref-file', help="Read reference temperature from a file")
+    args = parser.parse_args()
+
+    reference = args.ref if args.ref is not None else read_reference(args.ref_file)
+
+    i2c = I2cController()
+    i2c.configure(args.url, frequency=50e3)
+
+    if args.scan:
+        addrs = scan_sensors(i2c)
+    elif args.addr:
+        addrs = args.addr
+    else:
+        parser.error("Give sensor addresses or --scan")
+
+    if not addrs:
+        print("No sensors found!")
+        sys.exit(1)
+
+    sensors = { addr: PSDSunSensor(addr, i2c) for addr in addrs }
+
+    t = time.monotonic()
+    calibs = calibrate_temperature(sensors, reference, args.samples, args.interval)
+    print(f"Calibrated {len(calibs)} sensors at {reference:.1f} °C in {time.monotonic() - t:.1f} s")
+
+    for addr, calib in calibs.items():
+        print(f"0x{addr:02X}: temp_offset={calib.temp_offset:4d}  now {sensors[addr].get_temperature():.1f} °C")
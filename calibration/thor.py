@@ -6,11 +6,16 @@
     Manual: https://www.thorlabs.com/Software/Motion%20Control/APT_Communications_Protocol.pdf
 """
 
+import time
 import struct
-from typing import NamedTuple, Optional
+import threading
+from collections import deque
+from typing import Dict, NamedTuple, Optional, Tuple
 
 import serial
 
+from frametrace import TRACE_APT, TRACE_TX, TRACE_RX
+
 
 #
 # List of message IDs
@@ -120,6 +125,9 @@ MGMSG_MOT_SET_TRACKSETTLEPARAMS = 0x04E0
 MGMSG_MOT_REQ_TRACKSETTLEPARAMS = 0x04E1
 MGMSG_MOT_GET_TRACKSETTLEPARAMS = 0x04E2
 
+# Message names for diagnostics
+MGMSG_NAMES = { v: k[6:] for k, v in list(globals().items()) if k.startswith("MGMSG_") }
+
 
 class ThorResponse(NamedTuple):
     message_id: int
@@ -185,7 +193,14 @@ class ThorRotator:
     velocity_scale = 36650
     acceleration_scale = 95.276
 
-    print_packets = False
+    # Optional frametrace.FrameTrace object for recording the raw frames
+    trace = None
+
+    # Maximum number of unclaimed frames kept per message ID
+    max_queued = 16
+
+    # Optional metrics.Metrics object for latency histograms and counters
+    metrics = None
 
 
     def __init__(self, device: str="/dev/ttyUSB0", _serial=None):
@@ -204,6 +219,12 @@ class ThorRotator:
         self.dest = 0x50
         self.src = 0x01
 
+        self._rx = bytearray()
+        self._queues: Dict[int, deque] = {} # Received frames per message ID
+        self._sequence = 0
+        self._rx_lock = threading.Lock()
+        self._tx_lock = threading.Lock()
+
 
     def degrees(self, count: int) -> float:
         """
@@ -240,9 +261,12 @@ class ThorRotator:
         else:
             msg = struct.pack("<HBBBB", message_id, param1, param2, self.dest, self.src)
 
-        if self.print_packets:
-            print("TX:", msg)
-        self._serial.write(msg)
+        if self.trace is not None:
+            self.trace.record(TRACE_APT, TRACE_TX, self.dest, msg)
+        if self.metrics is not None:
+            self.metrics.count("thor_tx_bytes_total", len(msg), msg=MGMSG_NAMES.get(message_id, f"0x{message_id:04x}"))
+        with self._tx_lock:
+            self._serial.write(msg)
 
 
     def _get(self, message_id: int, length: int) -> bytes:
@@ -250,56 +274,118 @@ class ThorRotator:
         """
         raise NotImplementedError()
         msg = struct.pack("<HHBB", message_id, length, self.dest | 0x80, self.src)
-        if self.print_packets:
-            print("TX:", msg)
-
         self._serial.write(msg)
-
-        data = self._serial.read(length)
-        if self.print_packets:
-            print("RX:", data)
-        return data
+        return self._serial.read(length)
 
 
-    def _request(self, **kwargs) -> ThorResponse:
+    def _request(self, reply: Optional[int]=None, timeout: Optional[float]=None, **kwargs) -> ThorResponse:
         """
-        Send and receive
+        Send a message and wait for the reply.
+
+        Args:
+            reply: Message ID of the reply. Default is the request ID + 1
+                (MGMSG_*_REQ_* -> MGMSG_*_GET_*).
+            timeout: Reply timeout in seconds
         """
+        message_id = kwargs["message_id"]
+        if reply is None:
+            reply = message_id + 1
+
+        # Drop stale replies, e.g. late answers to an earlier timed out request
+        self._poll(block=False)
+        self._queues.pop(reply, None)
+
+        metrics = self.metrics
+        if metrics is None:
+            self._send(**kwargs)
+            return self._receive(reply, timeout)
+
+        name = MGMSG_NAMES.get(message_id, f"0x{message_id:04x}")
+        start = time.perf_counter()
         self._send(**kwargs)
-        return self._receive()
+        try:
+            rsp = self._receive(reply, timeout)
+        except Exception as e:
+            metrics.count("thor_errors_total", msg=name, type=type(e).__name__)
+            raise
+        metrics.observe("thor_request_seconds", time.perf_counter() - start, msg=name)
+        return rsp
 
 
-    def _receive(self, timeout: Optional[int]=None) -> ThorResponse:
+    def _poll(self, block: bool=True) -> None:
         """
-        Wait for response from the device.
+        Read all the available bytes from the serial port and parse the complete frames.
+
+        Args:
+            block: If true, wait up to the serial port timeout for at least one byte.
+        """
+        with self._rx_lock:
+            n = self._serial.in_waiting
+            if n == 0 and not block:
+                return
+            self._rx += self._serial.read(max(n, 1))
+
+            rx, pos = self._rx, 0
+            while len(rx) - pos >= 6:
+                message_id, param1, param2, dest, src = struct.unpack_from("<HBBBB", rx, pos)
+                if 0x80 & dest:
+                    # Arbitrary length frame
+                    end = pos + 6 + (param1 | (param2 << 8))
+                    if end > len(rx):
+                        break
+                    rsp = ThorResponse(message_id, None, None, bytes(rx[pos + 6:end]))
+                else:
+                    end = pos + 6
+                    rsp = ThorResponse(message_id, param1, param2, None)
+
+                if self.trace is not None:
+                    self.trace.record(TRACE_APT, TRACE_RX, src, rx[pos:end])
+                if self.metrics is not None:
+                    self.metrics.count("thor_rx_bytes_total", end - pos, msg=MGMSG_NAMES.get(message_id, f"0x{message_id:04x}"))
+
+                queue = self._queues.get(message_id)
+                if queue is None:
+                    queue = self._queues[message_id] = deque(maxlen=self.max_queued)
+                queue.append((self._sequence, rsp))
+                self._sequence += 1
+                pos = end
+
+            del rx[:pos]
+
+
+    def _receive(self, message_id: Optional[int]=None, timeout: Optional[float]=None) -> ThorResponse:
+        """
+        Wait for a frame from the device. Frames with other message IDs
+        are queued for later calls.
+
+        Args:
+            message_id: Message ID to wait for. If None the oldest received frame is returned.
+            timeout: Timeout in seconds. Default is the serial port timeout.
 
         Returns:
             ThorResponse object
         """
-        t = self._serial.timeout
-        try:
-            if timeout is not None:
-                self._serial.timeout = timeout
-            hdr = self._serial.read(6)
-        finally:
-            self._serial.timeout = t
-
-        if self.print_packets:
-            print("RX:", hdr)
+        if timeout is None:
+            timeout = self._serial.timeout
+        deadline = time.monotonic() + timeout
 
-        if len(hdr) != 6:
-            raise serial.SerialTimeoutException()
-        message_id, param1, param2, dest, src = struct.unpack(">HBBBB", hdr)
+        while True:
+            if message_id is None:
+                queues = [ q for q in list(self._queues.values()) if q ]
+                if queues:
+                    return min(queues, key=lambda q: q[0][0]).popleft()[1]
+            else:
+                queue = self._queues.get(message_id)
+                if queue:
+                    return queue.popleft()[1]
 
-        if 0x80 & dest:
-            # Arbitrary length frame
-            data_len = param1 | (param2 << 8)
-            data = self._serial.read(data_len)
-            if self.print_packets:
-                print("   ", data)
-            return ThorResponse(message_id, None, None, data)
+            if time.monotonic() >= deadline:
+                break
+            self._poll()
 
-        return ThorResponse(message_id, param1, param2, None)
+        if self.trace is not None:
+            self.trace.error()
+        raise serial.SerialTimeoutException()
 
 
     def identify(self, channel: int) -> None:
@@ -394,6 +480,32 @@ class ThorRotator:
         )
 
 
+    def set_velocity_degrees(self, channel: int, velocity: float, acceleration: float) -> None:
+        """
+        Set velocity parameters in degrees.
+
+        Args:
+            channel: The channel being addressed.
+            velocity: Maximum velocity in degrees per second
+            acceleration: Acceleration in degrees per second squared
+        """
+        self.set_velocity(channel, 0, int(acceleration * self.acceleration_scale), int(velocity * self.velocity_scale))
+
+
+    def get_velocity_degrees(self, channel: int) -> Tuple[float, float]:
+        """
+        Get velocity parameters in degrees.
+
+        Args:
+            channel: The channel being addressed.
+
+        Returns:
+            Maximum velocity in degrees per second and acceleration in degrees per second squared
+        """
+        params = self.get_velocity(channel)
+        return params.max_velocity / self.velocity_scale, params.accleration / self.acceleration_scale
+
+
     def get_velocity(self, channel: int) -> VelocityParameters:
         """
         Get velocity paramters
@@ -667,11 +779,12 @@ class ThorRotator:
         Args:
             channel: The channel being addressed.
         """
-        self._send(
+        self._request(
             message_id=MGMSG_MOT_MOVE_HOME,
-            param1=channel
+            param1=channel,
+            reply=MGMSG_MOT_MOVE_HOMED,
+            timeout=120 # Wait for move done
         )
-        self._receive(timeout=120) # Wait for move done
 
 
 
@@ -686,8 +799,8 @@ class ThorRotator:
         if distance is not None:
             self.set_relative_distance(channel, distance)
 
-        self._send(MGMSG_MOT_MOVE_RELATIVE, param1=channel)
-        self._receive(timeout=120) # Wait for move done
+        self._request(message_id=MGMSG_MOT_MOVE_RELATIVE, param1=channel,
+            reply=MGMSG_MOT_MOVE_COMPLETED, timeout=120) # Wait for move done
 
 
     def move_absolute(self, channel: int, position: Optional[int]=None) -> None:
@@ -701,8 +814,8 @@ class ThorRotator:
         if position is not None:
             self.set_absolute_postion(channel, position)
 
-        self._send(MGMSG_MOT_MOVE_ABSOLUTE, param1=channel)
-        self._receive(timeout=120) # Wait for move done
+        self._request(message_id=MGMSG_MOT_MOVE_ABSOLUTE, param1=channel,
+            reply=MGMSG_MOT_MOVE_COMPLETED, timeout=120) # Wait for move done
 
 
     def move_velocity(self, channel: int, direction: int) -> None:
@@ -748,12 +861,13 @@ class ThorRotator:
             direction: The direction to Jog. 1 = forward, 2 = reverse
         """
 
-        self._send(
+        self._request(
             message_id=MGMSG_MOT_MOVE_JOG,
             param1=channel,
             param2=direction,
+            reply=MGMSG_MOT_MOVE_COMPLETED,
+            timeout=120 # Wait for move done
         )
-        self._receive(timeout=120) # Wait for move done
 
 if __name__ == "__main__":
 
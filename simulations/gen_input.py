@@ -1,20 +1,104 @@
 """
-	Script to generate "half rectified" sinewave for the Spice simulator current input
+	Script to generate PWL current inputs for the Spice simulator.
+
+	By default a "half rectified" sinewave is written to current_input.txt
+	(the sum of the PSD diode currents of a spinning satellite). With --channels
+	the current is split to the four PSD diode channels X1/X2/Y1/Y2 and written
+	to separate files. Long profiles are generated and written in chunks.
 """
 
 import numpy as np
-import math, random
+import argparse
+
+parser = argparse.ArgumentParser(description="Spice current input generator")
+parser.add_argument('--output', '-o', default="current_input.txt", help="Output file (channel name is appended with --channels)")
+parser.add_argument('--duration', '-t', type=float, default=10, help="Length of the profile in seconds")
+parser.add_argument('--points', '-n', type=int, default=10000, help="Number of points")
+parser.add_argument('--spin', '-f', type=float, default=1, help="Spin rate in Hz")
+parser.add_argument('--amplitude', '-a', type=float, default=150e-6, help="Total current at normal incidence in Amps")
+parser.add_argument('--elevation', type=float, default=0, help="Sun elevation from the spin plane in degrees")
+parser.add_argument('--albedo', type=float, default=0, help="Earth albedo current relative to the amplitude")
+parser.add_argument('--orbit', type=float, default=5400, help="Orbit period in seconds")
+parser.add_argument('--eclipse', type=float, nargs=2, metavar=("START", "END"), help="Eclipse start and end time within the orbit in seconds")
+parser.add_argument('--noise', type=float, default=0, help="Current noise standard deviation in Amps")
+parser.add_argument('--height', type=float, default=670 / 2048, help="PSD optical height relative to the half width of the PSD")
+parser.add_argument('--channels', action='store_true', help="Write X1/X2/Y1/Y2 channel currents to separate files")
+parser.add_argument('--chunk', type=int, default=1000000, help="Number of points generated at once")
+parser.add_argument('--seed', type=int, help="Random seed for the noise")
+args = parser.parse_args()
+
+CHANNELS = ("x1", "x2", "y1", "y2")
+MAX_CURRENT = 1e-3 # Amps
+
+rng = np.random.default_rng(args.seed)
+elevation = np.radians(args.elevation)
+
+
+def generate(t):
+	"""
+	Calculate the channel currents for time instants t.
+
+	Returns:
+		Array of shape (4, len(t)) with X1, X2, Y1, Y2 currents
+	"""
+	# Sun direction in the sensor frame. Normal incidence when sin(2*pi*f*t) = 1
+	phi = 2 * np.pi * args.spin * t - np.pi / 2
+	sx = np.sin(phi) * np.cos(elevation)
+	sy = np.full_like(t, np.sin(elevation))
+	sz = np.cos(phi) * np.cos(elevation)
+
+	eclipse = np.zeros(t.shape, dtype=bool)
+	if args.eclipse:
+		orbit_t = t % args.orbit
+		eclipse = (orbit_t >= args.eclipse[0]) & (orbit_t < args.eclipse[1])
+	sunlit = (sz > 0) & ~eclipse
+
+	total = np.where(sunlit, args.amplitude * sz, 0)
+
+	# Light point position on the PSD (-1 to 1) and split to the diode channels
+	with np.errstate(divide="ignore", invalid="ignore"):
+		ux = np.clip(np.where(sunlit, args.height * sx / sz, 0), -1, 1)
+		uy = np.clip(np.where(sunlit, args.height * sy / sz, 0), -1, 1)
+	q = total / 4
+	currents = np.stack((
+		q * (1 - ux - uy),
+		q * (1 + ux + uy),
+		q * (1 + ux - uy),
+		q * (1 - ux + uy),
+	))
+
+	# Earth albedo is diffuse light from the opposite direction so it doesn't move the light point
+	if args.albedo:
+		earth = np.where(eclipse, 0, np.clip(-sz, 0, None))
+		currents += args.albedo * args.amplitude * earth / 4
+
+	if args.noise:
+		currents += rng.normal(0, args.noise, currents.shape)
+
+	return np.clip(currents, 0, MAX_CURRENT)
+
+
+if args.channels:
+	root, ext = args.output.rsplit(".", 1) if "." in args.output else (args.output, "txt")
+	fnames = [ f"{root}_{ch}.{ext}" for ch in CHANNELS ]
+else:
+	fnames = [ args.output ]
+
+files = [ open(fname, "w", buffering=1 << 20) for fname in fnames ]
 
-f = open("current_input.txt", "w")
+dt = args.duration / (args.points - 1)
+for start in range(0, args.points, args.chunk):
+	t = np.arange(start, min(start + args.chunk, args.points)) * dt
+	currents = generate(t)
+	if not args.channels:
+		currents = currents.sum(axis=0, keepdims=True)
 
-frequency = 1 # Hz
-amplitude = 150e-6 # Amps
+	# One big string formatting per chunk is much faster than writing line by line
+	line_fmt = "%.9g %.9g\n" * len(t)
+	for f, i in zip(files, currents):
+		f.write(line_fmt % tuple(np.column_stack((t, i)).ravel()))
 
-for t in np.linspace(0, 10, 10000):
-	v = amplitude * math.sin(2 * math.pi * frequency * t)
-	#v += 20e-6 * random.random()
-	v = max(min(v, 1e-3), 0)
-	
-	f.write(f"{t} {v}\n")
+for f in files:
+	f.close()
 
-f.close()
+print("Wrote", ", ".join(fnames))
@@ -0,0 +1,101 @@
+"""
+	Helpers to read component values from the LTspice schematic and to
+	generate plain SPICE netlists of the transimpedance amplifier.
+"""
+
+import os
+import re
+
+SI_PREFIXES = {
+	"f": 1e-15, "p": 1e-12, "n": 1e-9, "u": 1e-6, "µ": 1e-6,
+	"m": 1e-3, "k": 1e3, "meg": 1e6, "g": 1e9, "t": 1e12,
+}
+
+
+def parse_value(value):
+	"""
+	Convert a SPICE value such as '9.1k', '470n' or '1Meg' to float.
+	"""
+	m = re.match(r"^([-+]?\d*\.?\d+(?:[eE][-+]?\d+)?)(meg|[fpnuµmkgt])?", value.strip(), re.IGNORECASE)
+	if m is None:
+		raise ValueError(f"Invalid value {value!r}")
+	number, prefix = m.groups()
+	return float(number) * (SI_PREFIXES[prefix.lower()] if prefix else 1)
+
+
+def format_value(value):
+	"""
+	Convert float to a SPICE value with SI prefix.
+	"""
+	for prefix, scale in (("t", 1e12), ("g", 1e9), ("meg", 1e6), ("k", 1e3), ("", 1),
+			("m", 1e-3), ("u", 1e-6), ("n", 1e-9), ("p", 1e-12), ("f", 1e-15)):
+		if abs(value) >= scale:
+			return f"{value / scale:g}{prefix}"
+	return f"{value:g}"
+
+
+def read_components(fname="tia.asc"):
+	"""
+	Read component values from an LTspice schematic.
+
+	Returns:
+		Dictionary of value strings indexed by instance name (for example 'R1': '9.1k').
+	"""
+	components = {}
+	name = None
+	with open(fname, encoding="latin-1") as f:
+		for line in f:
+			fields = line.split(maxsplit=2)
+			if not fields:
+				continue
+			if fields[0] == "SYMBOL":
+				name = None
+			elif fields[0] == "SYMATTR" and len(fields) == 3:
+				if fields[1] == "InstName":
+					name = fields[2].strip()
+				elif fields[1] == "Value" and name is not None:
+					components[name] = fields[2].strip()
+	return components
+
+
+def subckt_name(model):
+	"""
+	Get the name of the first subcircuit defined in a model file.
+	"""
+	with open(model, encoding="latin-1") as f:
+		for line in f:
+			if line.lower().startswith(".subckt"):
+				return line.split()[1]
+	raise ValueError(f"No subcircuit found from {model!r}")
+
+
+def tia_netlist(components, model, source, analysis):
+	"""
+	Generate a netlist of the photodiode and transimpedance amplifier in tia.asc.
+
+	Args:
+		components: Component values (see read_components())
+		model: Opamp model file with a IN+ IN- VCC VEE OUT subcircuit
+		source: Current source specification (for example 'DC 0 AC 100u')
+		analysis: Analysis command (for example '.ac dec 20 10m 100k')
+
+	Returns:
+		Netlist as string
+	"""
+	c = components
+	return "\n".join([
+		"* Photodiode transimpedance amplifier (tia.asc)",
+		f".include {os.path.abspath(model)}",
+		f"V1 VCC 0 {c['V1']}",
+		f"V2 Vref 0 {c['V2']}",
+		f"I1 VCC IN {source}",
+		f"C3 VCC IN {c['C3']}",
+		f"R2 VCC IN {c['R2']}",
+		f"C2 IN 0 {c['C2']}",
+		f"R1 IN OUT {c['R1']}",
+		f"C1 IN OUT {c['C1']}",
+		f"XU1 Vref IN VCC 0 OUT {subckt_name(model)}",
+		analysis,
+		".end",
+		"",
+	])
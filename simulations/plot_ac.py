@@ -1,10 +1,10 @@
 
-import ltspice
 import matplotlib.pyplot as plt
 import numpy as np
 
-l = ltspice.Ltspice("tia.raw")
-l.parse() 
+from rawfile import RawFile
+
+l = RawFile("tia.raw")
 
 
 fig, ax1 = plt.subplots()
@@ -1,22 +1,24 @@
 
-import ltspice
 import matplotlib.pyplot as plt
 import numpy as np
 
-l = ltspice.Ltspice("tia.raw")
-l.parse() 
+from rawfile import RawFile, envelope
+
+l = RawFile("tia.raw")
 
 
 fig, ax1 = plt.subplots()
 ax2 = ax1.twinx()
 
-time = l.get_time()
-I_source = l.get_data('I(I1)') * 1e6
-V_out = l.get_data('V(out)')
+# Plot min-max envelopes so that long transient runs are never fully loaded
+time, V_min, V_max = envelope(l.get_data('time'), l.get_data('V(out)'))
+_, I_min, I_max = envelope(l.get_data('time'), l.get_data('I(I1)'))
+time = np.abs(time)
+I_min, I_max = I_min * 1e6, I_max * 1e6
 
 
 color = 'tab:blue'
-ax1.plot(time, V_out, label="Amplitude", color=color)
+ax1.fill_between(time, V_min, V_max, label="Amplitude", color=color, step="post")
 ax1.set_ylabel("Output (V)", color=color)
 ax1.set_xlabel("Time (s)")
 ax1.tick_params(axis='y', labelcolor=color)
@@ -26,7 +28,7 @@ ax1.grid()
 
 
 color = 'tab:red'
-ax2.plot(time, I_source, label="Phase", color=color)
+ax2.fill_between(time, I_min, I_max, label="Phase", color=color, step="post")
 ax2.set_ylabel("Source current (µA)", color=color)
 ax2.tick_params(axis='y', labelcolor=color)
 ax2.set_ylim(0, 200)
@@ -0,0 +1,148 @@
+"""
+	Lazy reader for LTspice/ngspice binary .raw files.
+
+	Only the header is parsed when the file is opened. The binary data section
+	is memory mapped and each trace is returned as a NumPy view to the mapping,
+	so the data is read from the disk only when it is actually used.
+"""
+
+import numpy as np
+
+
+class RawFile:
+
+	def __init__(self, fname):
+		"""
+		Open a binary raw file and parse its header.
+
+		Args:
+			fname: Raw file name
+		"""
+		self.fname = fname
+
+		with open(fname, "rb") as f:
+			head = f.read(1 << 16)
+
+		# LTspice writes the header in UTF-16, ngspice in ASCII
+		encoding = "utf-16-le" if head[1:2] == b"\x00" else "ascii"
+		marker = "Binary:\n".encode(encoding)
+		idx = head.find(marker)
+		if idx < 0:
+			raise ValueError(f"{fname!r} is not a binary raw file")
+		header = head[:idx].decode(encoding)
+		data_offset = idx + len(marker)
+
+		self.header = {}
+		self.variables = []
+		lines = iter(header.splitlines())
+		for line in lines:
+			key, _, value = line.partition(":")
+			if key == "Variables":
+				break
+			self.header[key.strip()] = value.strip()
+		for line in lines:
+			fields = line.split()
+			if len(fields) >= 3:
+				self.variables.append(fields[1])
+
+		self.plotname = self.header.get("Plotname", "")
+		self.flags = self.header.get("Flags", "").split()
+		self.n_points = int(self.header["No. Points"])
+		if len(self.variables) != int(self.header["No. Variables"]):
+			raise ValueError(f"Broken variable list in {fname!r}")
+
+		# Data types: LTspice stores transient data as float32 except the time axis
+		ltspice = "LTspice" in self.header.get("Command", "")
+		if "complex" in self.flags:
+			dtypes = [ "<c16" ] * len(self.variables)
+		elif ltspice and "double" not in self.flags:
+			dtypes = [ "<f8" ] + [ "<f4" ] * (len(self.variables) - 1)
+		else:
+			dtypes = [ "<f8" ] * len(self.variables)
+
+		self._traces = {}
+		if "fastaccess" in self.flags:
+			# Each trace is stored contiguously one after another
+			offset = data_offset
+			for name, dtype in zip(self.variables, dtypes):
+				self._traces[name] = np.memmap(fname, dtype=dtype, mode="r", offset=offset, shape=(self.n_points,))
+				offset += self.n_points * np.dtype(dtype).itemsize
+		else:
+			# Points are stored interleaved
+			record = np.dtype([ (name, dtype) for name, dtype in zip(self.variables, dtypes) ])
+			data = np.memmap(fname, dtype=record, mode="r", offset=data_offset, shape=(self.n_points,))
+			for name in self.variables:
+				self._traces[name] = data[name]
+
+
+	def get_data(self, name):
+		"""
+		Get a trace by its name (for example 'V(out)' or 'I(I1)') as lazy view.
+		"""
+		try:
+			return self._traces[name]
+		except KeyError:
+			# Spice variable names are case insensitive
+			for key, trace in self._traces.items():
+				if key.lower() == name.lower():
+					return trace
+			raise
+
+
+	def get_time(self):
+		"""
+		Get the time axis of a transient analysis.
+		LTspice uses the sign bit of the time values as a flag so the absolute value is returned.
+		"""
+		return np.abs(self._traces[self.variables[0]])
+
+
+	def get_frequency(self):
+		"""
+		Get the frequency axis of an AC analysis.
+		"""
+		return self._traces[self.variables[0]].real
+
+
+def decimate(trace, max_points):
+	"""
+	Decimate a trace by picking every n:th point so that at most max_points remain.
+	Returns a view to the original data.
+	"""
+	step = max(1, -(-len(trace) // max_points))
+	return trace[::step]
+
+
+def envelope(x, y, n_bins=2000, chunk=1 << 20):
+	"""
+	Calculate min-max envelope of a trace for plotting.
+
+	The trace is split to n_bins equal sized blocks and processed a chunk at a
+	time so the whole trace is never loaded into memory at once.
+
+	Args:
+		x: X-axis trace (for example time)
+		y: Real valued trace
+		n_bins: Number of envelope points
+		chunk: Maximum number of points processed at once
+
+	Returns:
+		Tuple of (x, y_min, y_max) arrays where x is the first x value of each bin.
+	"""
+	n = len(y)
+	if n <= 2 * n_bins:
+		y = np.asarray(y)
+		return np.asarray(x), y, y
+
+	bin_size = -(-n // n_bins)
+	bins_per_chunk = max(1, chunk // bin_size)
+
+	x_out, y_min, y_max = [], [], []
+	for start in range(0, n, bins_per_chunk * bin_size):
+		block = np.asarray(y[start:start + bins_per_chunk * bin_size])
+		idx = np.arange(0, len(block), bin_size)
+		y_min.append(np.minimum.reduceat(block, idx))
+		y_max.append(np.maximum.reduceat(block, idx))
+		x_out.append(np.asarray(x[start:start + len(block):bin_size]))
+
+	return np.concatenate(x_out), np.concatenate(y_min), np.concatenate(y_max)
@@ -0,0 +1,154 @@
+"""
+	Parallel parametric sweep of the transimpedance amplifier.
+
+	Netlists are generated from the tia.asc component values with the swept
+	values replaced, simulated with a batch mode simulator (ngspice by default)
+	in parallel and the gain, bandwidth and settling time are collected to a
+	table. Simulation results are cached by the hash of the netlist and the
+	model file so reruns only simulate the changed points.
+"""
+
+import os
+import csv
+import sys
+import shlex
+import hashlib
+import argparse
+import itertools
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from netlist import read_components, parse_value, format_value, tia_netlist
+from rawfile import RawFile
+
+
+AC_AMPLITUDE = 100e-6 # Amps
+STEP_DELAY = 1e-3 # s
+SETTLING_BAND = 0.01
+
+
+def analyses(components):
+	"""
+	Current source and analysis commands for the AC and step response runs.
+	"""
+	tau = parse_value(components["R1"]) * parse_value(components["C1"])
+	tstop = STEP_DELAY + max(10 * tau, 10e-3)
+	return {
+		"ac": (f"DC 0 AC {format_value(AC_AMPLITUDE)}", ".ac dec 20 10m 1meg"),
+		"tran": (f"PULSE(0 {format_value(AC_AMPLITUDE)} {format_value(STEP_DELAY)} 1u 1u 10 20)",
+			f".tran {format_value(tstop / 5000)} {format_value(tstop)}"),
+	}
+
+
+def simulate(netlist, model, cache_dir, command):
+	"""
+	Run a netlist through the simulator unless the result is already cached.
+
+	Returns:
+		Tuple of raw file name and a flag telling was the result cached.
+	"""
+	h = hashlib.sha256(netlist.encode())
+	with open(model, "rb") as f:
+		h.update(f.read())
+	key = h.hexdigest()[:20]
+
+	raw = os.path.join(cache_dir, key + ".raw")
+	if os.path.exists(raw):
+		return raw, True
+
+	cir = os.path.join(cache_dir, key + ".cir")
+	with open(cir, "w") as f:
+		f.write(netlist)
+
+	tmp = raw + ".tmp"
+	# Split the template before substituting so paths with spaces stay one argument
+	args = [ arg.format(netlist=cir, raw=tmp) for arg in shlex.split(command) ]
+	subprocess.run(args, check=True,
+		stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+	os.replace(tmp, raw)
+	return raw, False
+
+
+def ac_metrics(raw):
+	"""
+	Calculate transimpedance gain (Ohms) and -3 dB bandwidth (Hz) from AC results.
+	"""
+	r = RawFile(raw)
+	freq = r.get_frequency()
+	gain = np.abs(r.get_data("V(out)")) / AC_AMPLITUDE
+	below = np.nonzero(gain < gain[0] / np.sqrt(2))[0]
+	bandwidth = freq[below[0]] if len(below) else np.nan
+	return gain[0], bandwidth
+
+
+def settling_time(raw):
+	"""
+	Calculate step response settling time to the SETTLING_BAND of the final value.
+	"""
+	r = RawFile(raw)
+	t = r.get_time()
+	v = np.asarray(r.get_data("V(out)"))
+	initial = v[np.searchsorted(t, STEP_DELAY) - 1]
+	final = v[-1]
+	outside = np.nonzero(np.abs(v - final) > SETTLING_BAND * abs(final - initial))[0]
+	if len(outside) == 0:
+		return 0.0
+	return t[min(outside[-1] + 1, len(t) - 1)] - STEP_DELAY
+
+
+def run_point(point, base, cache_dir, command):
+	"""
+	Simulate one sweep point.
+	"""
+	components = dict(base, **{ k: v for k, v in point.items() if k != "model" })
+	result = dict(point)
+
+	cached = True
+	for name, (source, analysis) in analyses(components).items():
+		netlist = tia_netlist(components, point["model"], source, analysis)
+		raw, hit = simulate(netlist, point["model"], cache_dir, command)
+		cached &= hit
+		if name == "ac":
+			result["gain"], result["bandwidth"] = ac_metrics(raw)
+		else:
+			result["settling"] = settling_time(raw)
+
+	result["cached"] = cached
+	return result
+
+
+if __name__ == "__main__":
+
+	parser = argparse.ArgumentParser(description="TIA parametric sweep")
+	parser.add_argument('--schematic', default="tia.asc", help="LTspice schematic with the default component values")
+	parser.add_argument('--R1', nargs='+', help="Feedback resistor values")
+	parser.add_argument('--C1', nargs='+', help="Feedback capacitor values")
+	parser.add_argument('--C2', nargs='+', help="Photodiode terminal capacitance values")
+	parser.add_argument('--model', nargs='+', default=["LMV342.cir"], help="Opamp model files")
+	parser.add_argument('--cache', default="sweep_cache", help="Cache directory")
+	parser.add_argument('--command', default="ngspice -b -r {raw} {netlist}", help="Simulator command")
+	parser.add_argument('--jobs', '-j', type=int, default=os.cpu_count(), help="Number of parallel simulations")
+	parser.add_argument('--output', '-o', help="Write results to a CSV file")
+	args = parser.parse_args()
+
+	base = read_components(args.schematic)
+	os.makedirs(args.cache, exist_ok=True)
+
+	swept = { name: values for name in ("R1", "C1", "C2") if (values := getattr(args, name)) }
+	swept["model"] = args.model
+	points = [ dict(zip(swept, values)) for values in itertools.product(*swept.values()) ]
+
+	with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+		results = list(pool.map(lambda p: run_point(p, base, args.cache, args.command), points))
+
+	fields = list(swept) + [ "gain", "bandwidth", "settling", "cached" ]
+	out = open(args.output, "w", newline="") if args.output else sys.stdout
+	writer = csv.DictWriter(out, fieldnames=fields)
+	writer.writeheader()
+	for result in results:
+		writer.writerow({ k: (f"{v:.6g}" if isinstance(v, float) else v) for k, v in result.items() })
+
+	n_cached = sum(r["cached"] for r in results)
+	print(f"{len(results)} points, {len(results) - n_cached} simulated, {n_cached} cached", file=sys.stderr)
@@ -0,0 +1,185 @@
+"""
+	Analytic surrogate model of the photodiode transimpedance amplifier.
+
+	The model is built from the tia.asc component values:
+		Zf  = R1 || C1                  (feedback)
+		Zin = R2 || (C2 + C3)           (photodiode and terminal capacitance)
+		A   = A0 / (1 + s / wa)         (single pole opamp, wa = 2 pi GBW / A0)
+
+	and gives the output voltage for a photodiode current flowing into the
+	inverting input:
+		Vout = Vref - I * Zf / (1 + (1 + Zf / Zin) / A)
+
+	The transfer function is discretized with the bilinear transform and run
+	as a second-order-sections filter so that millions of samples of the
+	gen_input.py current profile are processed in milliseconds.
+"""
+
+import time
+import argparse
+
+import numpy as np
+from scipy import signal
+
+from netlist import read_components, parse_value
+
+
+class TIAModel:
+
+	def __init__(self, components=None, gbw=1e6, a0=1e5):
+		"""
+		Args:
+			components: Component values (see netlist.read_components).
+				Read from tia.asc if not given.
+			gbw: Opamp gain bandwidth product in Hz
+			a0: Opamp DC open loop gain
+		"""
+		if components is None:
+			components = read_components("tia.asc")
+		v = { name: parse_value(value) for name, value in components.items()
+			if name in ("R1", "C1", "C2", "C3", "R2", "V1", "V2") }
+
+		self.r1, self.c1 = v["R1"], v["C1"]
+		self.r2, self.cin = v["R2"], v["C2"] + v["C3"]
+		self.vref = v["V2"]
+		self.bias = (v["V1"] - v["V2"]) / v["R2"] # Leakage through R2 from VCC
+		self.a0 = a0
+		self.wa = 2 * np.pi * gbw / a0
+
+
+	def transfer_function(self):
+		"""
+		Transfer function from input current to output voltage.
+
+		Returns:
+			Numerator and denominator polynomial coefficients in s (highest power first).
+		"""
+		df = [ self.r1 * self.c1, 1 ]  # 1 + s R1 C1
+		di = [ self.r2 * self.cin, 1 ] # 1 + s R2 Cin
+		da = [ 1 / self.wa, 1 ]        # 1 + s / wa
+
+		num = [ -self.r1 * self.r2 * self.a0 ]
+		den = np.polyadd(
+			np.polymul([ self.a0 * self.r2 ], df),
+			np.polymul(np.polyadd(np.polymul([ self.r2 ], df), np.polymul([ self.r1 ], di)), da),
+		)
+		return np.array(num), den
+
+
+	def frequency_response(self, freq):
+		"""
+		Complex transimpedance (V/A) at given frequencies.
+		"""
+		num, den = self.transfer_function()
+		return signal.freqs(num, den, worN=2 * np.pi * np.asarray(freq))[1]
+
+
+	def discrete(self, fs):
+		"""
+		Discrete time filter as second order sections for sample rate fs.
+		"""
+		z, p, k = signal.tf2zpk(*self.transfer_function())
+		return signal.zpk2sos(*signal.bilinear_zpk(z, p, k, fs))
+
+
+	def simulate(self, current, fs):
+		"""
+		Calculate the output voltage for uniformly sampled input current.
+		The filter starts from the steady state of the first sample.
+
+		Args:
+			current: Photodiode current in Amps
+			fs: Sample rate in Hz
+
+		Returns:
+			Output voltage array
+		"""
+		current = np.asarray(current, dtype=float) + self.bias
+		sos = self.discrete(fs)
+		zi = signal.sosfilt_zi(sos) * current[0]
+		return self.vref + signal.sosfilt(sos, current, zi=zi)[0]
+
+
+def load_pwl(fname):
+	"""
+	Read a two column PWL file written by gen_input.py.
+	"""
+	with open(fname) as f:
+		data = np.array(f.read().split(), dtype=float)
+	return data[0::2], data[1::2]
+
+
+def resample(t, values, fs):
+	"""
+	Linearly interpolate non-uniformly sampled data to sample rate fs.
+	"""
+	t_uniform = np.arange(t[0], t[-1], 1 / fs)
+	return t_uniform, np.interp(t_uniform, t, values)
+
+
+def validate(model, fname, ac_amplitude=100e-6):
+	"""
+	Compare the model against a stored SPICE result.
+
+	AC results are compared by magnitude and phase, transient results by
+	driving the model with the simulated source current I(I1).
+	"""
+	from rawfile import RawFile
+
+	raw = RawFile(fname)
+	if "complex" in raw.flags:
+		freq = raw.get_frequency()
+		spice = np.asarray(raw.get_data("V(out)")) / ac_amplitude
+		surrogate = model.frequency_response(freq)
+		mag_err = 20 * np.log10(np.abs(surrogate) / np.abs(spice))
+		phase_err = np.angle(surrogate / spice, deg=True)
+		print(f"AC: {len(freq)} points, max magnitude error {np.max(np.abs(mag_err)):.3f} dB, "
+			f"max phase error {np.max(np.abs(phase_err)):.2f} deg")
+	else:
+		t = np.asarray(raw.get_time())
+		order = np.argsort(t, kind="stable")
+		t = t[order]
+		current = np.asarray(raw.get_data("I(I1)"))[order]
+		v_out = np.asarray(raw.get_data("V(out)"))[order]
+
+		fs = 1 / np.median(np.diff(t))
+		t_uniform, i_uniform = resample(t, current, fs)
+		err = np.interp(t, t_uniform, model.simulate(i_uniform, fs)) - v_out
+		print(f"Transient: {len(t)} points, RMS error {1e3 * np.sqrt(np.mean(err**2)):.3f} mV, "
+			f"max error {1e3 * np.max(np.abs(err)):.3f} mV")
+
+
+if __name__ == "__main__":
+
+	parser = argparse.ArgumentParser(description="TIA surrogate model")
+	parser.add_argument('--schematic', default="tia.asc", help="LTspice schematic")
+	parser.add_argument('--gbw', type=float, default=1e6, help="Opamp gain bandwidth product (Hz)")
+	parser.add_argument('--a0', type=float, default=1e5, help="Opamp DC open loop gain")
+	parser.add_argument('--input', '-i', help="PWL current input file to be simulated")
+	parser.add_argument('--fs', type=float, help="Sample rate for the input (default: from the file)")
+	parser.add_argument('--output', '-o', help="Save simulated output to a .npy file")
+	parser.add_argument('--validate', help="Compare against a SPICE .raw file")
+	args = parser.parse_args()
+
+	model = TIAModel(read_components(args.schematic), gbw=args.gbw, a0=args.a0)
+
+	freq = np.logspace(-1, 6, 701)
+	gain = np.abs(model.frequency_response(freq))
+	bw = freq[np.argmax(gain < gain[0] / np.sqrt(2))]
+	print(f"Transimpedance {gain[0]:.4g} Ohm, bandwidth {bw:.4g} Hz")
+
+	if args.validate:
+		validate(model, args.validate)
+
+	if args.input:
+		t, current = load_pwl(args.input)
+		fs = args.fs or 1 / np.median(np.diff(t))
+		if not np.allclose(np.diff(t), 1 / fs, rtol=1e-3):
+			t, current = resample(t, current, fs)
+
+		start = time.perf_counter()
+		v_out = model.simulate(current, fs)
+		print(f"Simulated {len(current)} samples in {1e3 * (time.perf_counter() - start):.1f} ms")
+
+		if args.output:
+			np.save(args.output, np.column_stack((t, v_out)))
@@ -38,6 +38,7 @@ void read_voltage_channels()
 {
 
 	START_TIMING();
+	PROFILE_BEGIN();
 
 	/* Wakeup the opamp and ADC if needed */
 	if (sleep_mode)
@@ -78,38 +79,22 @@ void read_voltage_channels()
 		raw.vx2 = 0xFFFF;
 		raw.vy1 = 0xFFFF;
 		raw.vy2 = 0xFFFF;
+		PROFILE_END(PROFILE_ADC);
 		return;
 	}
 
-	if (calibration.samples == 1) {
-		// none
-	}
-	else if (calibration.samples == 2) {
-		raw.vx1 >>= 1; raw.vx2 >>= 1;
-		raw.vy1 >>= 1; raw.vy2 >>= 1;
-	}
-	else if (calibration.samples == 4) {
-		raw.vx1 >>= 2; raw.vx2 >>= 2;
-		raw.vy1 >>= 2; raw.vy2 >>= 2;
-	}
-	else if (calibration.samples == 8) {
-		raw.vx1 >>= 3; raw.vx2 >>= 3;
-		raw.vy1 >>= 3; raw.vy2 >>= 3;
-	}
-	else if (calibration.samples == 16) {
-		raw.vx1 >>= 4; raw.vx2 >>= 4;
-		raw.vy1 >>= 4; raw.vy2 >>= 4;
-	}
-	else {
-		raw.vx1 /= calibration.samples; raw.vx2 /= calibration.samples;
-		raw.vy1 /= calibration.samples; raw.vy2 /= calibration.samples;
-	}
+	// Power of two sample counts are averaged with a shift
+	int shift = 4;
+	while (shift >= 0 && (1 << shift) != calibration.samples)
+		shift--;
 
-	raw.vx1 = 1023 - raw.vx1;
-	raw.vx2 = 1023 - raw.vx2;
-	raw.vy1 = 1023 - raw.vy1;
-	raw.vy2 = 1023 - raw.vy2;
+	uint16_t* channel = &raw.vx1;
+	for (i = 0; i < 4; i++) {
+		uint16_t avg = (shift >= 0) ? (channel[i] >> shift) : (channel[i] / calibration.samples);
+		channel[i] = 1023 - avg;
+	}
 
+	PROFILE_END(PROFILE_ADC);
 	STOP_TIMING();
 }
 
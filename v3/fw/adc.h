@@ -9,7 +9,7 @@ void init_adc(void);
 
 
 /*
- *
+ * Sample the PSD channels to `raw` (waits for the conversions to end)
  */
 void read_voltage_channels();
 
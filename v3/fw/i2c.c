@@ -7,8 +7,10 @@
 volatile int new_message = 0;
 
 unsigned char received_message[BUFFER_LENGTH];
-unsigned char transmit_message[BUFFER_LENGTH];
+unsigned char transmit_message[TX_BUFFER_LENGTH];
 unsigned int receive_len, transmit_len, transmit_idx;
+volatile int general_call = 0;
+uint16_t burst_sequence = 0;
 
 #if 0
 #define SAMPLING_LED_ON()  LED_ON()
@@ -36,7 +38,7 @@ void init_i2c() {
 	// eUSCI configuration for I2C
 	UCB0CTLW0 |= UCSWRST;                   // Software reset enabled
 	UCB0CTLW0 |= UCMODE_3 + UCSYNC;         // I2C slave mode, sync mode, SMCLK
-	UCB0I2COA0 = i2c_address + UCOAEN;      // Own address + enable
+	UCB0I2COA0 = i2c_address + UCOAEN + UCGCEN; // Own address + enable + respond to general call
 	UCB0CTLW1 |= UCCLTO_3;                  // Clock low timeout ?ms
 	UCB0CTLW0 &= ~UCSWRST;                  // Clear reset register
 
@@ -76,6 +78,7 @@ __interrupt void USCIB0_ISR(void)
 		else { // Receiving starts
 			new_message = 0;
 			receive_len = 0;
+			general_call = (UCB0STATW & UCGC) != 0;
 		}
 
 
@@ -150,11 +153,90 @@ inline void set_response(unsigned char status) {
 }
 
 
+/*
+ * Set response with the status followed by a copy of the data
+ */
+static void set_data_response(unsigned char status, const void* data, unsigned int len) {
+	transmit_message[0] = status;
+	memcpy(transmit_message + 1, data, len);
+	transmit_len = 1 + len;
+}
+
+
+#define MEASURE_RAW     0
+#define MEASURE_POINT   1
+#define MEASURE_ANGLES  2
+
+/*
+ * Update the measurement globals up to the given level
+ */
+static void measure(int level) {
+
+	SAMPLING_LED_ON();
+	read_voltage_channels();
+	if (level >= MEASURE_POINT)
+		calculate_position();
+	if (level >= MEASURE_ANGLES)
+		calculate_angles();
+	SAMPLING_LED_OFF();
+}
+
+
+/*
+ * Set response with a measurement record and its age
+ */
+static void set_record_response(unsigned char status, const record_t* record) {
+	uint16_t age = record_age(record);
+
+	transmit_message[0] = status;
+	transmit_message[1] = record->sequence & 0xFF;
+	transmit_message[2] = (record->sequence >> 8) & 0xFF;
+	transmit_message[3] = age & 0xFF;
+	transmit_message[4] = (age >> 8) & 0xFF;
+	// The raw, position and angle measurements follow each other in the record
+	memcpy(transmit_message + 5, &record->raw, sizeof(record->raw) + sizeof(record->position) + sizeof(record->angles));
+	transmit_len = 5 + sizeof(record->raw) + sizeof(record->position) + sizeof(record->angles);
+}
+
+
+/*
+ * Handle message sent to the general call address. No response can be read
+ * from the general call address so the transmit buffer is left untouched.
+ */
+static void handle_general_call() {
+
+	switch (received_message[0]) {
+
+	case CMD_TRIGGER: {
+		/*
+		 * Broadcast trigger: all the sensors on the bus sample at the
+		 * same instant and latch the result with the tag given by the host
+		 */
+
+		if (receive_len == 3)
+			latch_measurement(received_message[1] | (received_message[2] << 8));
+
+		break;
+	}
+
+	default:
+		/* Ignore other general calls (e.g. reset) */
+		break;
+	}
+}
+
+
 void handle_command() {
 
 	if (receive_len == 0)
 		return;
 
+	if (general_call) {
+		handle_general_call();
+		receive_len = 0;
+		return;
+	}
+
 
 	switch (received_message[0]) {
 
@@ -166,6 +248,14 @@ void handle_command() {
 		transmit_message[0] = sleep_mode ? RSP_SLEEP : RSP_OK;
 		transmit_len = 1;
 
+#ifdef PROFILING
+		// Extended status: number of probes, the measured profiling timer clock in Hz and the probe counters
+		transmit_message[1] = PROFILE_PROBES;
+		memcpy(transmit_message + 2, &profile_clock, sizeof(profile_clock));
+		memcpy(transmit_message + 6, profile_probes, sizeof(profile_probes));
+		transmit_len = 6 + sizeof(profile_probes);
+#endif
+
 		break;
 	}
 
@@ -174,13 +264,9 @@ void handle_command() {
 		 * Get raw current measurements
 		 */
 
-		 SAMPLING_LED_ON();
-		read_voltage_channels();
-		SAMPLING_LED_OFF();
+		measure(MEASURE_RAW);
 
-		transmit_message[0] = RSP_RAW;
-		memcpy(transmit_message + 1, &raw, sizeof(raw));
-		transmit_len = sizeof(raw) + 1;
+		set_data_response(RSP_RAW, &raw, sizeof(raw));
 
 		break;
 	}
@@ -190,14 +276,9 @@ void handle_command() {
 		 * Get position of the light spot
 		 */
 
-		SAMPLING_LED_ON();
-		read_voltage_channels();
-		calculate_position();
-		SAMPLING_LED_OFF();
+		measure(MEASURE_POINT);
 
-		transmit_message[0] = RSP_POINT;
-		memcpy(transmit_message + 1, &position, sizeof(position));
-		transmit_len = 1 + sizeof(position);
+		set_data_response(RSP_POINT, &position, sizeof(position));
 
 		break;
 	}
@@ -207,15 +288,10 @@ void handle_command() {
 		 * Get sun vector
 		 */
 
-		SAMPLING_LED_ON();
-		read_voltage_channels();
-		calculate_position();
+		measure(MEASURE_POINT);
 		calculate_vectors();
-		SAMPLING_LED_OFF();
 
-		transmit_message[0] = RSP_VECTOR;
-		memcpy(transmit_message + 1, &vector, sizeof(vector));
-		transmit_len = 1 + sizeof(vector);
+		set_data_response(RSP_VECTOR, &vector, sizeof(vector));
 
 		break;
 	}
@@ -225,15 +301,9 @@ void handle_command() {
 		 * Get sun angle
 		 */
 
-		SAMPLING_LED_ON();
-		read_voltage_channels();
-		calculate_position();
-		calculate_angles();
-		SAMPLING_LED_OFF();
+		measure(MEASURE_ANGLES);
 
-		transmit_message[0] = RSP_ANGLES;
-		memcpy(transmit_message + 1, &angles, sizeof(angles));
-		transmit_len = 1 + sizeof(angles);
+		set_data_response(RSP_ANGLES, &angles, sizeof(angles));
 
 		break;
 	}
@@ -243,11 +313,7 @@ void handle_command() {
 		 * Get all the measurement data (mainly for testing purposes)
 		 */
 
-		SAMPLING_LED_ON();
-		read_voltage_channels();
-		calculate_position();
-		calculate_angles();
-		SAMPLING_LED_OFF();
+		measure(MEASURE_ANGLES);
 
 		transmit_message[0] = RSP_ALL;
 		memcpy(transmit_message + 1, &raw, sizeof(raw));
@@ -258,6 +324,67 @@ void handle_command() {
 		break;
 	}
 
+	case CMD_GET_BURST: {
+		/*
+		 * Sample N times back to back and return all the raw or point
+		 * records in one response. The sequence number lets the host
+		 * detect lost or repeated bursts.
+		 */
+
+		unsigned int count = received_message[1];
+		unsigned int format = received_message[2];
+		unsigned int max_count = (format == BURST_FORMAT_RAW) ? BURST_MAX_RAW : BURST_MAX_POINT;
+
+		if (receive_len != 3 || format > BURST_FORMAT_POINT || count == 0 || count > max_count) {
+			set_response(RSP_INVALID_PARAM);
+			break;
+		}
+
+		unsigned char* record = transmit_message + BURST_HEADER_LENGTH;
+
+		SAMPLING_LED_ON();
+		unsigned int i;
+		for (i = 0; i < count; i++) {
+			read_voltage_channels();
+			if (format == BURST_FORMAT_RAW) {
+				memcpy(record, &raw, sizeof(raw));
+				record += sizeof(raw);
+			}
+			else {
+				calculate_position();
+				memcpy(record, &position, sizeof(position));
+				record += sizeof(position);
+			}
+		}
+		SAMPLING_LED_OFF();
+
+		burst_sequence++;
+		transmit_message[0] = RSP_BURST;
+		transmit_message[1] = burst_sequence & 0xFF;
+		transmit_message[2] = (burst_sequence >> 8) & 0xFF;
+		transmit_message[3] = count;
+		transmit_len = record - transmit_message;
+
+		break;
+	}
+
+
+	case CMD_GET_LATCHED: {
+		/*
+		 * Get the measurement latched by the last broadcast trigger
+		 * with the trigger tag and the time since the trigger
+		 */
+
+		if (!latched_valid) {
+			set_response(RSP_ERROR);
+			break;
+		}
+
+		set_record_response(RSP_LATCHED, &latched);
+
+		break;
+	}
+
 
 	case CMD_GET_TEMPERATURE: {
 		/*
@@ -298,9 +425,7 @@ void handle_command() {
 		 * Get calibration
 		 */
 
-		transmit_message[0] = RSP_CALIBRATION;
-		memcpy(transmit_message + 1, &calibration, sizeof(calibration));
-		transmit_len = sizeof(calibration) + 1;
+		set_data_response(RSP_CALIBRATION, &calibration, sizeof(calibration));
 
 		break;
 	}
@@ -25,6 +25,9 @@
 #define CMD_GET_ANGLES          0x06
 #define CMD_GET_ALL             0x07
 #define CMD_GET_TEMPERATURE     0x08
+#define CMD_GET_BURST           0x09
+#define CMD_TRIGGER             0x0C // General call only
+#define CMD_GET_LATCHED         0x0D
 #define CMD_SET_CALIBRATION     0x10
 #define CMD_GET_CALIBRATION     0x11
 #define CMD_SET_LUT             0x12
@@ -39,6 +42,8 @@
 #define RSP_ANGLES              0xF6
 #define RSP_ALL                 0xF7
 #define RSP_TEMPERATURE         0xF8
+#define RSP_BURST               0xF9
+#define RSP_LATCHED             0xFC
 #define RSP_CALIBRATION         0xFA
 #define RSP_UNKNOWN_COMMAND     0xFD
 #define RSP_INVALID_PARAM       0xFE
@@ -48,12 +53,26 @@
 // Max I2C packet length (Must me a bit longer than telemetry frame!)
 #define BUFFER_LENGTH   24
 
+// Max I2C response length (burst responses don't fit to BUFFER_LENGTH)
+#define TX_BUFFER_LENGTH 128
+
+/* Burst record formats: */
+#define BURST_FORMAT_RAW        0x00
+#define BURST_FORMAT_POINT      0x01
+
+// Burst response header: response code, 16-bit sequence number and record count
+#define BURST_HEADER_LENGTH     4
+#define BURST_MAX_RAW           ((TX_BUFFER_LENGTH - BURST_HEADER_LENGTH) / sizeof(raw_measurements_t))
+#define BURST_MAX_POINT         ((TX_BUFFER_LENGTH - BURST_HEADER_LENGTH) / sizeof(position_measurement_t))
+
 
 // I2C bus
 extern volatile int new_message; // Flag to indicate a new received command
 extern unsigned char received_message[BUFFER_LENGTH];
-extern unsigned char transmit_message[BUFFER_LENGTH];
+extern unsigned char transmit_message[TX_BUFFER_LENGTH];
 extern unsigned int receive_len, transmit_len, transmit_idx;
+extern volatile int general_call; // The received message was sent to the general call address
+extern uint16_t burst_sequence; // Number of burst responses since reset
 
 
 
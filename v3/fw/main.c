@@ -13,6 +13,15 @@ vector_measurement_t vector;
 angle_measurement_t angles;
 int sleep_mode = 1;
 
+record_t latched;
+int latched_valid = 0;
+
+#ifdef PROFILING
+profile_probe_t profile_probes[PROFILE_PROBES];
+uint32_t profile_clock;
+static volatile uint16_t timer_overflows = 0;
+#endif
+
 
 #pragma SET_DATA_SECTION(".fram_vars")
 calibration_t calibration = {
@@ -106,6 +115,7 @@ int main(void)
 	 */
 	init_i2c();
 	init_adc();
+	init_timestamp_timer(); // Uses Timer_B0 in the profiling build before the heartbeat
 	init_heartbeat_timer();
 
 	sleepmode();
@@ -129,7 +139,7 @@ int main(void)
 
 		// If we wake up check is there new messages to be handled...
 		if (new_message) {
-			handle_command();
+			PROFILE(PROFILE_COMMAND, handle_command());
 			new_message = 0;
 			idle_counter = 0;
 		}
@@ -157,6 +167,8 @@ int main(void)
 
 void calculate_position() {
 
+	PROFILE_BEGIN();
+
 	int32_t sum = raw.vx1 + raw.vx2 + raw.vy1 + raw.vy2;
 	int32_t a = (int32_t)(raw.vx2 + raw.vy1) - (int32_t)(raw.vx1 + raw.vy2);
 	int32_t b = (int32_t)(raw.vx2 + raw.vy2) - (int32_t)(raw.vx1 + raw.vy1);
@@ -175,11 +187,16 @@ void calculate_position() {
 		position.y += calibration.offset_y;
 	}
 
+	PROFILE_END(PROFILE_POSITION);
 }
 
 
 
-#define LUT_SIZE 256
+/*
+ * Position to angle table up to 63.3 degrees (position 508).
+ * Larger positions are clipped to the last entry.
+ */
+#define LUT_SIZE 128
 
 const int16_t lt[LUT_SIZE] = {
 	     0,    9,   18,   27,   36,   45,   54,   62,
@@ -201,6 +218,7 @@ const int16_t lt[LUT_SIZE] = {
 };
 
 
+#pragma FUNC_CANNOT_INLINE(atan); // Keep a single copy for both axes
 int16_t atan(int16_t x) {
 	x = (x >= 0) ? x : -x;
 	unsigned int pos = x >> 2;
@@ -228,8 +246,8 @@ void calculate_vectors() {
 
 void calculate_angles() {
 
-	angles.ax = atan(position.x);
-	angles.ay = atan(position.y);
+	PROFILE(PROFILE_ATAN, angles.ax = atan(position.x));
+	PROFILE(PROFILE_ATAN, angles.ay = atan(position.y));
 
 	angles.intensity = position.intensity;
 }
@@ -258,7 +276,7 @@ void wakeup() {
 	ADCCTL0 |= ADCON; // Enable ADC
 	PMMCTL0_H = 0; // Lock PMM
 
-	__delay_cycles(400);  // Delay for stuff to settle
+	__delay_cycles(SETTLE_CYCLES);  // Delay for stuff to settle
 
 	sleep_mode = 0;
 }
@@ -281,6 +299,133 @@ void init_heartbeat_timer() {
 }
 
 
+void init_timestamp_timer() {
+	/*
+	 * Configure TimerB1 as free running timestamp timer
+	 *
+	 * ACLK = REFOCLK = 32768 Hz, continuous mode.
+	 *
+	 * In the profiling build the timer counts SMCLK cycles instead
+	 * and the overflow interrupt extends the count. The DCO runs without
+	 * the FLL so SMCLK is first measured by counting SMCLK / 64 over
+	 * 1024 REFOCLK periods (1/32 s) timed with Timer_B0.
+	 */
+
+#ifndef PROFILING
+	TB1CTL = TBSSEL_1 + MC_2 + TBCLR; // ACLK, continuous mode
+#else
+	TB0CCTL0 = 0;
+	TB0CCR0 = 1024;
+	TB1EX0 = TBIDEX_7; // Divide by 8
+	TB1CTL = TBSSEL_2 + ID_3 + MC_2 + TBCLR; // SMCLK / 8, continuous mode
+	TB0CTL = TBSSEL_1 + MC_2 + TBCLR; // ACLK, continuous mode
+	while (!(TB0CCTL0 & CCIFG))
+		__no_operation();
+	profile_clock = (uint32_t)TB1R << 11; // 64 * 32 counts per second
+	TB1EX0 = 0;
+
+	TB1CTL = TBSSEL_2 + MC_2 + TBCLR + TBIE; // SMCLK, continuous mode, overflow interrupt
+#endif
+	TB1CCTL0 = 0;
+}
+
+
+#ifdef PROFILING
+
+uint32_t profile_time() {
+	uint16_t high, low;
+	do {
+		high = timer_overflows;
+		low = TB1R;
+	} while (high != timer_overflows);
+	return ((uint32_t)high << 16) | low;
+}
+
+
+/*
+ * Record the cycles elapsed since the start time to the probe
+ */
+void profile_end(unsigned int probe, uint32_t start) {
+	uint32_t cycles = profile_time() - start;
+	profile_probe_t* p = &profile_probes[probe];
+	if (p->count == 0 || cycles < p->min)
+		p->min = cycles;
+	if (cycles > p->max)
+		p->max = cycles;
+	p->last = cycles;
+	p->total += cycles;
+	p->count++;
+}
+
+
+/*
+ * Timer B1 overflow interrupt (profiling clock extension)
+ */
+#pragma vector=TIMER1_B1_VECTOR
+__interrupt void Timer_B1_overflow(void)
+{
+	switch (__even_in_range(TB1IV, TBIV__TBIFG))
+	{
+	case TBIV__TBIFG:
+		timer_overflows++;
+		break;
+	default: break;
+	}
+}
+
+#endif
+
+
+/*
+ * Read the timestamp timer. The timer runs asynchronously to MCLK so read it
+ * until two consecutive reads agree.
+ */
+static uint16_t read_timestamp() {
+	uint16_t t;
+	do {
+		t = TB1R;
+	} while (t != TB1R);
+	return t;
+}
+
+
+/*
+ * Copy the measurement globals to a record
+ */
+static void store_record(record_t* record, uint16_t sequence, uint16_t timestamp) {
+	record->sequence = sequence;
+	record->timestamp = timestamp;
+	record->raw = raw;
+	record->position = position;
+	record->angles = angles;
+}
+
+
+uint16_t record_age(const record_t* record) {
+	return read_timestamp() - record->timestamp;
+}
+
+
+void latch_measurement(uint16_t tag) {
+
+	uint16_t timestamp = read_timestamp();
+
+	// Sample after the same settling delay whether the sensor was sleeping
+	// or not so that all the sensors on the bus sample at the same instant
+	if (sleep_mode)
+		wakeup();
+	else
+		__delay_cycles(SETTLE_CYCLES);
+
+	read_voltage_channels();
+	calculate_position();
+	calculate_angles();
+
+	store_record(&latched, tag, timestamp);
+	latched_valid = 1;
+}
+
+
 /*
  * Timer B0 interrupt (triggering every 50ms)
  */
@@ -8,6 +8,9 @@
 /* Turn on/off debug features */
 #define DEBUG
 
+/* Turn on/off cycle count instrumentation (reported in CMD_STATUS response with the timer clock) */
+//#define PROFILING
+
 /* Frequency of the external crystal */
 #define CLK_HZ 2000000
 
@@ -46,12 +49,28 @@ typedef struct {
 } angle_measurement_t;
 
 
+/*
+ * Measurement with its sequence number and timestamp
+ */
+typedef struct {
+	uint16_t sequence;  // Sequence number or tag of the measurement
+	uint16_t timestamp; // Timestamp timer count when the measurement was started
+	raw_measurements_t raw;
+	position_measurement_t position;
+	angle_measurement_t angles;
+} record_t;
+
+
 extern raw_measurements_t raw;
 extern position_measurement_t position;
 extern vector_measurement_t vector;
 extern angle_measurement_t angles;
 extern int sleep_mode;
 
+/* Broadcast trigger */
+extern record_t latched; // Measurement latched by the last trigger (sequence is the trigger tag)
+extern int latched_valid;
+
 
 #pragma SET_DATA_SECTION(".fram_vars")
 extern calibration_t calibration;
@@ -63,6 +82,9 @@ extern uint8_t i2c_address;
 #define OPAMP_ON()  do { P2OUT |=  BIT0; } while(0)
 #define OPAMP_OFF() do { P2OUT &= ~BIT0; } while(0)
 
+/* Op-amp and voltage reference settling time after the wakeup */
+#define SETTLE_CYCLES 400
+
 
 
 #ifdef DEBUG
@@ -84,10 +106,51 @@ void calculate_position();
 void calculate_vectors();
 void calculate_angles();
 
+/*
+ * Cycle count instrumentation
+ *
+ * Timer_B1 counts SMCLK cycles and its overflows extend the count to 32 bits.
+ * Each probe collects the number of measurements, the last, minimum, maximum
+ * and total cycle count. Counters wrap around.
+ */
+#define PROFILE_ADC             0 // read_voltage_channels()
+#define PROFILE_POSITION        1 // calculate_position()
+#define PROFILE_ATAN            2 // atan()
+#define PROFILE_COMMAND         3 // handle_command()
+#define PROFILE_PROBES          4
+
+#ifdef PROFILING
+
+typedef struct {
+	uint16_t count;
+	uint32_t last, min, max, total;
+} profile_probe_t;
+
+extern profile_probe_t profile_probes[PROFILE_PROBES];
+extern uint32_t profile_clock; // SMCLK frequency in Hz measured against REFOCLK at startup
+
+uint32_t profile_time();
+void profile_end(unsigned int probe, uint32_t start);
+
+#define PROFILE_BEGIN()           uint32_t profile_start = profile_time()
+#define PROFILE_END(probe)        profile_end(probe, profile_start)
+#define PROFILE(probe, statement) do { PROFILE_BEGIN(); statement; PROFILE_END(probe); } while (0)
+
+#else
+#define PROFILE_BEGIN()
+#define PROFILE_END(probe)
+#define PROFILE(probe, statement) do { statement; } while (0)
+#endif
+
+
 void sleepmode();
 void wakeup();
 void init_heartbeat_timer();
 
+void init_timestamp_timer();
+uint16_t record_age(const record_t* record);
+void latch_measurement(uint16_t tag);
+
 
 
 #endif /* __MAIN_H__ */